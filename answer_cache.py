@@ -0,0 +1,257 @@
+"""
+Semantic cache of generated answers.
+
+A generation costs seconds of Ollama time, and users ask the same thing in other words
+("Quels événements en septembre ?", "événements prévus en septembre 2024"). The cache embeds the
+question with the store's embedding model (the vector is shared with the retrieval through
+query_cache.embed_query), looks up earlier questions in a small inner-product FAISS index, and
+returns the stored answer and sources of the nearest one when:
+- the cosine similarity of the questions is at least the threshold;
+- both questions have the same numbers and month names: sentence embeddings barely tell
+  "septembre" from "octobre", or 2023 from 2024, and "réunion de septembre 2023" is not answered
+  by the answer to "réunion de septembre";
+- it was answered with the same settings (LLM, prompt, filters, k: the entry's scope);
+- its source chunks are unchanged. Each entry records the docstore id and a hash of the content
+  of its sources. When the index has been updated since the entry was last checked (new index
+  version), they are compared with the docstore, and the entry is dropped if one of them was
+  removed or changed.
+
+Entries are kept in a SQLite file next to the vector store (answer_cache.sqlite), so they
+survive restarts. Past `max_entries`, the least recently used ones are evicted. Several processes
+(Streamlit sessions, CLI runs) can open the same file: each one searches the entries it loaded or
+added, and an entry another one has deleted in the meantime is a miss.
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+import faiss
+import numpy as np
+from langchain.schema import Document
+
+from query_cache import embed_query, normalize_query
+from sparse_index import tokenize
+from vector_store import index_version
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+ANSWER_CACHE_FILENAME = "answer_cache.sqlite"
+DEFAULT_SIMILARITY_THRESHOLD = 0.85
+DEFAULT_MAX_ENTRIES = 1000
+NEIGHBOURS = 8  # nearest questions examined per lookup, for when the closest ones are out of scope
+
+_MONTHS = frozenset(tokenize("janvier février mars avril mai juin juillet août septembre octobre novembre décembre"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    id INTEGER PRIMARY KEY,
+    scope TEXT NOT NULL,
+    question TEXT NOT NULL,
+    embedding BLOB NOT NULL,
+    answer TEXT NOT NULL,
+    sources TEXT NOT NULL,
+    index_version TEXT,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+def _key_terms(question):
+    # Numbers and month names: the terms whose change gives a different question of similar meaning
+    return frozenset(term for term in tokenize(question) if term.isdigit() or term in _MONTHS)
+
+
+def _content_hash(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class AnswerCache:
+    """
+    Answers of earlier questions, looked up by question similarity.
+    """
+
+    def __init__(self, path, vector_store, threshold=DEFAULT_SIMILARITY_THRESHOLD, max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        Parameters:
+        - path (str): SQLite file of the cache, created if needed.
+        - vector_store (FAISS): The store the answers are based on: its embedding model embeds
+          the questions and its docstore validates the sources.
+        - threshold (float): Minimum cosine similarity between two questions for a hit.
+        - max_entries (int): Number of answers kept before evicting the least recently used.
+        """
+        self.path = path
+        self.vector_store = vector_store
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self.evicted = 0
+        self._lock = threading.RLock()
+        self._entries = {}  # id -> (scope, key terms, question)
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+        dimension = vector_store.index.d
+        self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(dimension))
+        ids, vectors, stale = [], [], []
+        for entry_id, scope, question, embedding in self._conn.execute(
+                "SELECT id, scope, question, embedding FROM answers"):
+            vector = np.frombuffer(embedding, dtype=np.float32)
+            if len(vector) != dimension:
+                stale.append(entry_id)  # Written with another embedding model
+                continue
+            ids.append(entry_id)
+            vectors.append(vector)
+            self._entries[entry_id] = (scope, _key_terms(question), question)
+        if ids:
+            self._index.add_with_ids(np.vstack(vectors), np.asarray(ids, dtype=np.int64))
+        if stale:
+            self._conn.executemany("DELETE FROM answers WHERE id = ?", [(entry_id,) for entry_id in stale])
+        self._conn.commit()
+        logger.info(f"Answer cache opened with {len(ids)} entries from {path}")
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _embed(self, question):
+        vector = np.asarray([embed_query(self.vector_store.embedding_function, question)], dtype=np.float32)
+        faiss.normalize_L2(vector)
+        return vector
+
+    def _sources_valid(self, sources, entry_version, version):
+        if entry_version == version:
+            return True
+        for source in sources:
+            if source["id"] is None:
+                return False  # Retrieved without its docstore id: only valid for the index it came from
+            document = self.vector_store.docstore.search(source["id"])
+            if not isinstance(document, Document) or _content_hash(document.page_content) != source["hash"]:
+                return False
+        return True
+
+    def _forget(self, entry_ids):
+        # Drops entries from this instance's index only: the rows may belong to another instance
+        self._index.remove_ids(np.asarray(entry_ids, dtype=np.int64))
+        for entry_id in entry_ids:
+            self._entries.pop(entry_id, None)
+
+    def _delete(self, entry_ids):
+        self._conn.executemany("DELETE FROM answers WHERE id = ?", [(entry_id,) for entry_id in entry_ids])
+        self._forget(entry_ids)
+
+    def get(self, question, scope=""):
+        """
+        Returns the answer of an earlier question similar to this one, if still valid.
+
+        Parameters:
+        - question (str): The question.
+        - scope (str): Settings the answer must have been generated with (see the module docstring).
+
+        Returns:
+        - tuple | None: (answer, source documents), or None on a miss.
+        """
+        with span("answer_cache", entries=len(self)) as cache_span, self._lock:
+            if self._index.ntotal:
+                key_terms = _key_terms(question)
+                version = index_version(self.vector_store)
+                scores, found = self._index.search(self._embed(question), min(NEIGHBOURS, self._index.ntotal))
+                for score, entry_id in zip(scores[0].tolist(), found[0].tolist()):
+                    if entry_id == -1 or score < self.threshold:
+                        break
+                    entry_scope, entry_terms, entry_question = self._entries[entry_id]
+                    if entry_scope != scope or entry_terms != key_terms:
+                        continue
+                    row = self._conn.execute("SELECT question, answer, sources, index_version FROM answers "
+                                             "WHERE id = ?", (entry_id,)).fetchone()
+                    if row is None or row[0] != entry_question:
+                        # Replaced, invalidated or evicted by another instance sharing the file (SQLite
+                        # may since have given its id to a new row)
+                        self._forget([entry_id])
+                        continue
+                    _, answer, sources, entry_version = row
+                    sources = json.loads(sources)
+                    if not self._sources_valid(sources, entry_version, version):
+                        self._delete([entry_id])
+                        self._conn.commit()
+                        self.invalidated += 1
+                        continue
+                    self._conn.execute("UPDATE answers SET index_version = ?, last_used = ?, hits = hits + 1 "
+                                       "WHERE id = ?", (version, time.time(), entry_id))
+                    self._conn.commit()
+                    self.hits += 1
+                    cache_span.set(hit=True, similarity=round(score, 4))
+                    return answer, [Document(id=source["id"], page_content=source["page_content"],
+                                             metadata=source["metadata"]) for source in sources]
+            self.misses += 1
+            cache_span.set(hit=False)
+        return None
+
+    def put(self, question, answer, documents, scope=""):
+        """
+        Stores the answer to a question, with the documents it was generated from.
+
+        Parameters:
+        - question (str): The question.
+        - answer (str): The generated answer.
+        - documents (List[Document]): The source chunks given to the LLM.
+        - scope (str): Settings the answer was generated with.
+        """
+        if not answer or not answer.strip():
+            return
+        sources = [{"id": document.id, "hash": _content_hash(document.page_content),
+                    "page_content": document.page_content, "metadata": document.metadata}
+                   for document in documents]
+        vector = self._embed(question)
+        with self._lock:
+            # A new answer to the same question replaces the previous one
+            normalized = normalize_query(question)
+            replaced = [entry_id for entry_id, entry_scope, entry_question
+                        in self._conn.execute("SELECT id, scope, question FROM answers WHERE scope = ?", (scope,))
+                        if normalize_query(entry_question) == normalized]
+            if replaced:
+                self._delete(replaced)
+            cursor = self._conn.execute(
+                "INSERT INTO answers (scope, question, embedding, answer, sources, index_version, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (scope, question, vector[0].tobytes(), answer, json.dumps(sources, ensure_ascii=False),
+                 index_version(self.vector_store), time.time()))
+            entry_id = cursor.lastrowid
+            self._index.add_with_ids(vector, np.asarray([entry_id], dtype=np.int64))
+            self._entries[entry_id] = (scope, _key_terms(question), question)
+
+            # Counted in the file, which other instances may also have added to
+            excess = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0] - self.max_entries
+            if excess > 0:
+                evicted = [row[0] for row in self._conn.execute(
+                    "SELECT id FROM answers ORDER BY last_used LIMIT ?", (excess,))]
+                self._delete(evicted)
+                self.evicted += len(evicted)
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM answers")
+            self._conn.commit()
+            self._index.reset()
+            self._entries.clear()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def stats(self):
+        """
+        Returns the hit/miss counters, the hit rate and the number of entries dropped.
+        """
+        lookups = self.hits + self.misses
+        return {"entries": len(self), "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "invalidated": self.invalidated, "evicted": self.evicted}
@@ -0,0 +1,315 @@
+"""
+Retrieval latency and quality benchmark.
+
+For each corpus size, embedding model and FAISS index type, measures:
+- ingestion: create_vector_store (embedding + index build + save), in seconds and chunks/s;
+- cold start: load_vector_store with the embedding model unloaded, then the first query;
+- per-query retrieval latency (p50/p95/p99), end to end (embedding + search) and index-only;
+- hybrid (FAISS + BM25, reciprocal rank fusion) latency for a precomputed query embedding;
+- recall@k of the reference documents, for dense and hybrid retrieval.
+
+The corpus is either synthetic, or a fixture folder (chunked like the CLI does) padded with
+synthetic distractor chunks up to the requested size. Queries come from the questions YAML used
+by rag_test (recall against its reference documents); with a synthetic corpus, each query is a
+passage of a random chunk and its reference is that chunk's document.
+
+Results are written as JSON, one row per configuration, for regression tracking:
+
+    python benchmark.py --sizes 1000 100000 --index-types flat hnsw --output bench.json
+"""
+import os
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+from datetime import datetime
+
+import faiss
+import numpy as np
+from langchain.schema import Document
+
+from embedding_models import clear_models, get_embedding_model
+from faiss_indexes import INDEX_TYPES
+from query_cache import clear_caches
+from rag_cli import EMBEDDING_MODELS
+from vector_store import create_vector_store, load_vector_store, hybrid_search, get_sparse_index
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = (1000,)
+DEFAULT_K = 5
+DEFAULT_QUERIES = 200
+CHUNKS_PER_DOCUMENT = 10
+WORDS_PER_CHUNK = 60
+QUERY_WORDS = 12
+
+# Vocabulary of the synthetic corpus, in the register of the association's documents
+_VOCABULARY = (
+    "association conseil administration assemblée générale budget subvention adhérents bénévoles "
+    "rapport activité bilan financier compte rendu réunion président trésorier secrétaire vote "
+    "projet partenariat commune région département convention cotisation événement formation "
+    "jeunesse culture sport solidarité environnement patrimoine alsace strasbourg colmar mulhouse "
+    "janvier février mars avril mai juin juillet août septembre octobre novembre décembre "
+    "décision proposition approbation comptes exercice prévisionnel investissement locaux matériel "
+    "communication site internet journal bulletin calendrier planning équipe salariés recrutement "
+    "statuts règlement intérieur modification élection bureau mandat démission remerciements"
+).split()
+
+
+def synthetic_chunks(n_chunks, seed=0, offset=0):
+    """
+    Generates reproducible pseudo-French chunks, grouped in documents of CHUNKS_PER_DOCUMENT chunks.
+
+    Parameters:
+    - n_chunks (int): Number of chunks.
+    - seed (int): Random seed.
+    - offset (int): Number given to the first document (to tell distractors from fixture documents).
+
+    Returns:
+    - List[Document]: The chunks, with source, title and date metadata.
+    """
+    rng = np.random.default_rng(seed)
+    words = np.array(_VOCABULARY)
+    chunks = []
+    for i in range(n_chunks):
+        doc_number = offset + i // CHUNKS_PER_DOCUMENT
+        title = f"document_{doc_number:07d}"
+        chunks.append(Document(
+            page_content=" ".join(words[rng.integers(0, len(words), WORDS_PER_CHUNK)]),
+            metadata={"source": f"{title}.txt", "title": title,
+                      "date": f"{2015 + doc_number % 10}-{1 + doc_number % 12:02d}-01"},
+        ))
+    return chunks
+
+
+def synthetic_queries(chunks, n_queries, seed=0):
+    """
+    Samples queries from the chunks: a passage of a random chunk, whose document is the reference.
+
+    Returns:
+    - List[Tuple[str, List[str]]]: (query, reference documents) pairs.
+    """
+    rng = np.random.default_rng(seed + 1)
+    queries = []
+    for i in rng.choice(len(chunks), min(n_queries, len(chunks)), replace=False):
+        words = chunks[i].page_content.split()
+        start = int(rng.integers(0, max(1, len(words) - QUERY_WORDS)))
+        queries.append((" ".join(words[start:start + QUERY_WORDS]), [chunks[i].metadata["title"]]))
+    return queries
+
+
+def fixture_chunks(corpus_path, chunk_size=500, chunk_overlap=50):
+    """
+    Loads and chunks a folder of documents, as the CLI does (character-based chunking).
+    """
+    from preprocessing import load_documents
+    from chunking import split_documents
+
+    documents = load_documents(corpus_path, is_directory=True)
+    return [chunk for chunk in split_documents(documents, chunk_size=chunk_size, chunk_overlap=chunk_overlap,
+                                               semantic_chunking=False)
+            if chunk.page_content.strip()]
+
+
+def yaml_queries(questions_file):
+    """
+    Loads the rag_test questions with their reference documents.
+
+    Returns:
+    - List[Tuple[str, List[str]]]: (question, reference documents) pairs.
+    """
+    from rag_test import load_questions_from_yaml
+
+    return [(q["question"], list(q["documents"])) for q in load_questions_from_yaml(questions_file)]
+
+
+def _document_keys(doc):
+    source = doc.metadata.get("source", "")
+    keys = {doc.metadata.get("title", ""), source, os.path.splitext(source)[0]}
+    return {key.strip().casefold() for key in keys if key}
+
+
+def recall_at_k(retrieved, references):
+    """
+    Fraction of the reference documents (titles or file names) found among the retrieved chunks.
+    """
+    found = set().union(*(_document_keys(doc) for doc in retrieved)) if retrieved else set()
+    references = {reference.strip().casefold() for reference in references}
+    return len(references & found) / len(references)
+
+
+def _percentiles(latencies):
+    values = 1000 * np.asarray(latencies)
+    return {**{f"p{p}": float(np.percentile(values, p)) for p in (50, 95, 99)}, "mean": float(values.mean())}
+
+
+def _directory_size(path):
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+def benchmark_configuration(chunks, queries, model_name, index_type, k=DEFAULT_K, workdir=None):
+    """
+    Benchmarks one (corpus, model, index type) configuration.
+
+    Parameters:
+    - chunks (List[Document]): The corpus.
+    - queries (List[Tuple[str, List[str]]]): (query, reference documents) pairs.
+    - model_name (str): Embedding model.
+    - index_type (str): FAISS index type.
+    - k (int): Number of chunks retrieved per query.
+    - workdir (str, optional): Directory where the store is saved (a temporary one by default).
+
+    Returns:
+    - dict: The measurements.
+    """
+    store_path = tempfile.mkdtemp(prefix="ragnar_bench_", dir=workdir)
+    try:
+        # Ingestion: embedding, index training/build and save. The model is loaded beforehand
+        # so that its loading time is only counted in the cold start.
+        clear_models()
+        clear_caches()
+        get_embedding_model(model_name)
+        start = time.perf_counter()
+        vector_store = create_vector_store(chunks, model_name=model_name, save_path=store_path,
+                                           index_type=index_type)
+        ingestion_s = time.perf_counter() - start
+        with open(os.path.join(store_path, "metadata.json")) as metadata_file:
+            built_index = json.load(metadata_file)["index"]
+        del vector_store
+
+        # Cold start: nothing in memory, neither the model nor the index
+        clear_models()
+        clear_caches()
+        start = time.perf_counter()
+        vector_store = load_vector_store(directory_path=store_path)
+        load_s = time.perf_counter() - start
+        start = time.perf_counter()
+        vector_store.similarity_search(queries[0][0], k=k)
+        first_query_s = time.perf_counter() - start
+
+        # Warm queries, bypassing the query caches
+        get_sparse_index(vector_store)
+        query_latencies, search_latencies, hybrid_latencies, recalls, hybrid_recalls = [], [], [], [], []
+        embeddings = np.asarray([vector_store.embedding_function.embed_query(query) for query, _ in queries],
+                                dtype=np.float32)
+        for (query, references), embedding in zip(queries, embeddings):
+            start = time.perf_counter()
+            retrieved = vector_store.similarity_search(query, k=k)
+            query_latencies.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            vector_store.index.search(embedding.reshape(1, -1), k)
+            search_latencies.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            hybrid_retrieved = hybrid_search(vector_store, query, k=k, embedding=embedding)
+            hybrid_latencies.append(time.perf_counter() - start)
+
+            if references:
+                recalls.append(recall_at_k(retrieved, references))
+                hybrid_recalls.append(recall_at_k(hybrid_retrieved, references))
+
+        return {
+            "model_name": model_name,
+            "requested_index_type": index_type,
+            "index": built_index,
+            "chunks": len(chunks),
+            "queries": len(queries),
+            "k": k,
+            "ingestion_s": ingestion_s,
+            "ingestion_chunks_per_s": len(chunks) / ingestion_s,
+            "store_bytes": _directory_size(store_path),
+            "cold_start": {"load_s": load_s, "first_query_s": first_query_s},
+            "query_latency_ms": _percentiles(query_latencies),
+            "search_latency_ms": _percentiles(search_latencies),
+            "hybrid_latency_ms": _percentiles(hybrid_latencies),
+            f"recall@{k}": float(np.mean(recalls)) if recalls else None,
+            f"hybrid_recall@{k}": float(np.mean(hybrid_recalls)) if hybrid_recalls else None,
+        }
+    finally:
+        shutil.rmtree(store_path, ignore_errors=True)
+
+
+def run_benchmark(sizes=DEFAULT_SIZES, models=None, index_types=INDEX_TYPES, k=DEFAULT_K,
+                  n_queries=DEFAULT_QUERIES, corpus_path=None, questions_file=None, seed=0, workdir=None):
+    """
+    Runs the benchmark over every (size, model, index type) combination.
+
+    Returns:
+    - dict: Environment description and one result row per configuration.
+    """
+    models = models or [model_name for model_name, _ in EMBEDDING_MODELS.values()]
+    base_chunks = fixture_chunks(corpus_path) if corpus_path else []
+    base_queries = yaml_queries(questions_file) if questions_file else []
+
+    results = []
+    for size in sizes:
+        # Fixture chunks first, then synthetic distractors up to the requested size
+        chunks = base_chunks[:size] + synthetic_chunks(max(0, size - len(base_chunks)), seed=seed,
+                                                       offset=len(base_chunks))
+        queries = base_queries or synthetic_queries(chunks, n_queries, seed=seed)
+        queries = queries[:n_queries]
+        for model_name in models:
+            for index_type in index_types:
+                logger.info(f"Benchmark: {size} chunks, model '{model_name}', index '{index_type}'")
+                try:
+                    row = benchmark_configuration(chunks, queries, model_name, index_type, k=k, workdir=workdir)
+                except Exception as e:
+                    logger.error(f"Benchmark failed for {model_name}/{index_type}/{size}: {e}")
+                    row = {"model_name": model_name, "requested_index_type": index_type, "chunks": size,
+                           "error": f"{type(e).__name__}: {e}"}
+                results.append(row)
+                print(_format_row(row, k))
+
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpu_count": os.cpu_count(), "faiss": faiss.__version__},
+        "corpus": corpus_path or "synthetic",
+        "questions": questions_file,
+        "results": results,
+    }
+
+
+def _format_row(row, k):
+    if "error" in row:
+        return f"{row['chunks']:>8} {row['model_name']:<40} {row['requested_index_type']:<9} ERROR {row['error']}"
+    recall = row[f"recall@{k}"]
+    hybrid_recall = row[f"hybrid_recall@{k}"]
+    return (f"{row['chunks']:>8} {row['model_name']:<40} {row['index']['type']:<9} "
+            f"ingest {row['ingestion_s']:8.2f}s  cold {row['cold_start']['load_s']:6.2f}s  "
+            f"p50 {row['query_latency_ms']['p50']:7.2f}ms  p95 {row['query_latency_ms']['p95']:7.2f}ms  "
+            f"p99 {row['query_latency_ms']['p99']:7.2f}ms  "
+            f"recall@{k} {'n/a' if recall is None else f'{recall:.3f}'}  "
+            f"hybrid p50 {row['hybrid_latency_ms']['p50']:7.2f}ms  "
+            f"recall@{k} {'n/a' if hybrid_recall is None else f'{hybrid_recall:.3f}'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrieval latency and quality benchmark.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES),
+                        help="Corpus sizes, in chunks (e.g. 1000 100000 1000000).")
+    parser.add_argument("--models", nargs="+", help="Embedding models (default: the CLI's models).")
+    parser.add_argument("--index-types", nargs="+", default=list(INDEX_TYPES), choices=INDEX_TYPES)
+    parser.add_argument("--k", type=int, default=DEFAULT_K, help="Chunks retrieved per query.")
+    parser.add_argument("--queries", type=int, default=DEFAULT_QUERIES, help="Maximum number of queries.")
+    parser.add_argument("--corpus", help="Fixture folder of documents (default: synthetic corpus).")
+    parser.add_argument("--questions", help="rag_test questions YAML, for recall against reference documents.")
+    parser.add_argument("--workdir", help="Directory for the temporary stores (default: system temp).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON output file.")
+    args = parser.parse_args()
+
+    report = run_benchmark(sizes=args.sizes, models=args.models, index_types=args.index_types, k=args.k,
+                           n_queries=args.queries, corpus_path=args.corpus, questions_file=args.questions,
+                           seed=args.seed, workdir=args.workdir)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
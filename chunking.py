@@ -1,11 +1,52 @@
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from semantic_chunkers import StatisticalChunker
-from langchain_huggingface import HuggingFaceEmbeddings
-from semantic_router.encoders import HuggingFaceEncoder
+"""
+Découpage des documents en chunks.
 
+Deux modes :
+- par nombre de caractères : chaque chunk est coupé sur le meilleur séparateur disponible
+  (paragraphe, ligne, espace), comme avec RecursiveCharacterTextSplitter, mais le texte n'est
+  parcouru que par positions (str.rfind) et chaque chunk n'est copié qu'une fois, par une tranche
+  du texte du document. Les documents peuvent être répartis sur un pool de processus, créé
+  pour l'appel ou partagé par tous les lots d'une indexation ;
+- sémantique : le texte est découpé en phrases, vectorisées en une seule passe par lots avec le
+  modèle d'embedding de l'index. Une frontière de chunk est placée là où une phrase ressemble peu
+  aux précédentes (similarité cosinus parmi les plus faibles du document), dans des limites de
+  taille. Le vecteur de chaque chunk est la moyenne de ceux de ses phrases, pondérée par leur
+  longueur (ou, au choix, un nouvel embedding du chunk) : semantic_split_documents renvoie les
+  chunks avec leurs vecteurs, que l'indexation ajoute tels quels à l'index, sans second passage
+  du corpus dans le modèle.
+
+Dans les deux modes, les métadonnées de chaque chunk indiquent sa position dans le document
+(`start_index`, `end_index`) et l'identifiant du document (`parent_id`, empreinte de son texte) :
+les chunks voisins d'un même document se retrouvent et se fusionnent sans stocker le texte deux fois.
+"""
+import os
+import re
+import hashlib
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 from langchain.schema import Document
 
-def split_documents(documents, chunk_size=500, chunk_overlap=50, semantic_chunking=True):
+from embedding_models import get_embedding_model, DEFAULT_EMBEDDING_MODEL
+from vector_store import embed_texts, DEFAULT_EMBEDDING_BATCH_SIZE
+from tracing import span
+
+SEMANTIC_MIN_CHUNK_CHARS = 300
+SEMANTIC_MAX_CHUNK_CHARS = 1200
+SEMANTIC_SPLIT_PERCENTILE = 20  # les transitions les moins similaires d'un document (en %) sont des frontières
+SEMANTIC_WINDOW = 2             # phrases précédentes auxquelles chaque phrase est comparée
+CHUNK_EMBEDDINGS = ("pool", "embed")
+SEPARATORS = ("\n\n", "\n", " ")  # par ordre de préférence ; à défaut, coupe au caractère
+
+# Fin de phrase, paragraphe, ou début d'élément de liste
+_SENTENCE_BREAK_RE = re.compile(r"(?<=[.!?…])\s+|\n\s*\n|\n(?=\s*[-•*–]\s)")
+_NON_SPACE_RE = re.compile(r"\S")
+_SPACE_RE = re.compile(r"\s")
+
+
+def split_documents(documents, chunk_size=500, chunk_overlap=50, semantic_chunking=True,
+                    model_name=DEFAULT_EMBEDDING_MODEL, workers=1, executor=None):
     """
     Divise les documents en segments (chunks) pour une analyse plus fine.
 
@@ -13,40 +54,240 @@ def split_documents(documents, chunk_size=500, chunk_overlap=50, semantic_chunki
     - documents (List[Document]): Liste d'objets Document à diviser.
     - chunk_size (int): Taille maximale de chaque chunk (en caractères).
     - chunk_overlap (int): Nombre de caractères de chevauchement entre les chunks.
+    - semantic_chunking (bool): Découpage sémantique (sinon, par nombre de caractères).
+    - model_name (str): Modèle d'embedding du découpage sémantique.
+    - workers (int | None): Nombre de processus du découpage par caractères (1 : séquentiel,
+      None : nombre de cœurs), démarrés pour cet appel.
+    - executor (concurrent.futures.ProcessPoolExecutor, optional): Pool de processus existant, à
+      utiliser à la place de `workers` : un appelant qui découpe plusieurs lots (indexation) ne
+      démarre ses processus qu'une fois.
 
     Returns:
     - List[Document]: Liste de nouveaux objets Document segmentés.
     """
-    # Initialisation du text splitter avec les paramètres fournis
     if semantic_chunking:
-        # Initialize the semantic chunker
-        encoder = HuggingFaceEncoder(name="sentence-transformers/all-MiniLM-L6-v2")
-        text_splitter = StatisticalChunker(encoder=encoder)
-
-        # Extract text from Document objects
-        texts = [doc.page_content for doc in documents]
-
-        # Perform semantic chunking
-        chunked_texts = text_splitter(texts)  # List of lists of Chunks
-
-        # Convert Chunk objects to Document objects
-        chunked_documents = []
-        for doc, chunks in zip(documents, chunked_texts):
-            for chunk in chunks:
-                if hasattr(chunk, "splits") and isinstance(chunk.splits, list):
-                    chunked_documents.append(
-                        Document(
-                            page_content="".join(chunk.splits),
-                            metadata=doc.metadata
-                        )
-                    )
-        return chunked_documents
-    else:
-        # Use default character-based splitting
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-        return text_splitter.split_documents(documents)
+        # Pour indexer les chunks, semantic_split_documents renvoie aussi leurs vecteurs
+        return semantic_split_documents(documents, model_name=model_name)[0]
+    with span("chunk", documents=len(documents), semantic=False) as chunk_span:
+        split = partial(split_text_offsets, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        texts = [document.page_content for document in documents]
+        workers = min(workers or os.cpu_count() or 1, len(texts))
+        parallel = len(texts) > 1 and (executor is not None or workers > 1)
+        if parallel and executor is not None:
+            # Seuls les textes partent vers les processus ; ils renvoient des positions, pas des chaînes
+            document_spans = list(executor.map(split, texts))
+        elif parallel:
+            with ProcessPoolExecutor(max_workers=workers) as call_executor:
+                document_spans = list(call_executor.map(split, texts, chunksize=max(1, len(texts) // (4 * workers))))
+        else:
+            document_spans = [split(text) for text in texts]
+        chunks = [chunk for document, spans in zip(documents, document_spans)
+                  for chunk in _chunks_from_spans(document, spans.tolist())]
+        chunk_span.set(chunks=len(chunks), parallel=parallel)
+    return chunks
+
+
+def document_id(document):
+    """
+    Identifiant d'un document, d'après son texte : celui auquel se rapportent les positions de ses chunks.
+    """
+    return hashlib.blake2b(document.page_content.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def _chunks_from_spans(document, spans):
+    parent_id = document_id(document)
+    text = document.page_content
+    return [Document(page_content=text[start:end],
+                     metadata={**document.metadata, "start_index": start, "end_index": end, "parent_id": parent_id})
+            for start, end in spans]
+
+
+def split_text_offsets(text, chunk_size=500, chunk_overlap=50):
+    """
+    Découpe un texte en chunks d'au plus `chunk_size` caractères, repérés par leur position.
+
+    Chaque chunk se termine sur le premier séparateur de SEPARATORS trouvé avant la limite
+    (le plus loin possible), et le suivant reprend environ `chunk_overlap` caractères avant,
+    au début d'un mot. Les espaces de début et de fin des chunks sont exclus.
+
+    Parameters:
+    - text (str): Le texte.
+    - chunk_size (int): Taille maximale d'un chunk, en caractères.
+    - chunk_overlap (int): Chevauchement entre deux chunks consécutifs, en caractères.
+
+    Returns:
+    - np.ndarray: Début et fin de chaque chunk dans `text`, int64 de forme (nombre de chunks, 2).
+    """
+    if chunk_overlap >= chunk_size:
+        raise ValueError(f"chunk_overlap ({chunk_overlap}) doit être inférieur à chunk_size ({chunk_size}).")
+    spans = []
+    length = len(text)
+    match = _NON_SPACE_RE.search(text)
+    start = match.start() if match else length
+    while start < length:
+        limit = start + chunk_size
+        if limit >= length:
+            end = length
+        else:
+            end = limit
+            for separator in SEPARATORS:
+                # Couper après le chevauchement, pour que le chunk suivant commence plus loin que celui-ci
+                cut = text.rfind(separator, start + chunk_overlap + 1, limit)
+                if cut > 0:
+                    end = cut
+                    break
+        stop = end
+        while stop > start and text[stop - 1].isspace():
+            stop -= 1
+        if stop > start:
+            spans.append((start, stop))
+        if end >= length:
+            break
+
+        # Début du chunk suivant : `chunk_overlap` caractères avant la fin, ramené au début d'un mot
+        next_start = end - chunk_overlap
+        if chunk_overlap and not text[next_start - 1].isspace():
+            space = _SPACE_RE.search(text, next_start, end)
+            next_start = space.start() if space else end
+        match = _NON_SPACE_RE.search(text, next_start)
+        start = match.start() if match else length
+    return np.asarray(spans, dtype=np.int64).reshape(-1, 2)
+
+
+def split_sentences(text, max_chars=SEMANTIC_MAX_CHUNK_CHARS):
+    """
+    Découpe un texte en phrases, repérées par leur position dans le texte.
+
+    Parameters:
+    - text (str): Le texte.
+    - max_chars (int): Les phrases plus longues sont coupées en morceaux de cette taille au plus,
+      sur un espace si possible.
+
+    Returns:
+    - List[Tuple[int, int]]: Début et fin de chaque phrase dans `text`, sans les espaces qui l'entourent.
+    """
+    spans = []
+    start = 0
+    for match in [*_SENTENCE_BREAK_RE.finditer(text), None]:
+        end = match.start() if match else len(text)
+        # Retirer les espaces de début et de fin de la phrase
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        while end - start > max_chars:
+            cut = text.rfind(" ", start + 1, start + max_chars)
+            cut = cut if cut > start else start + max_chars
+            spans.append((start, cut))
+            start = cut
+            while start < end and text[start].isspace():
+                start += 1
+        if end > start:
+            spans.append((start, end))
+        if match:
+            start = match.end()
+    return spans
+
+
+def _boundaries(embeddings, spans, min_chars, max_chars):
+    """
+    Regroupe les phrases consécutives d'un document en chunks.
+
+    Returns:
+    - List[int]: Indice de la première phrase de chaque chunk.
+    """
+    count = len(spans)
+    if count == 1:
+        return [0]
+    # Similarité de chaque phrase avec la moyenne des SEMANTIC_WINDOW phrases précédentes
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    unit = embeddings / np.maximum(norms, 1e-12)
+    cumulative = np.vstack([np.zeros((1, unit.shape[1]), dtype=unit.dtype), np.cumsum(unit, axis=0)])
+    ends = np.arange(1, count)
+    starts = np.maximum(0, ends - SEMANTIC_WINDOW)
+    context = cumulative[ends] - cumulative[starts]
+    context /= np.maximum(np.linalg.norm(context, axis=1, keepdims=True), 1e-12)
+    similarities = np.einsum("ij,ij->i", context, unit[1:])
+    threshold = np.percentile(similarities, SEMANTIC_SPLIT_PERCENTILE)
+
+    firsts = [0]
+    for i in range(1, count):
+        first_start = spans[firsts[-1]][0]
+        if spans[i][1] - first_start > max_chars \
+                or (similarities[i - 1] <= threshold and spans[i - 1][1] - first_start >= min_chars):
+            firsts.append(i)
+    return firsts
+
+
+def semantic_split_documents(documents, model_name=DEFAULT_EMBEDDING_MODEL, min_chunk_chars=SEMANTIC_MIN_CHUNK_CHARS,
+                             max_chunk_chars=SEMANTIC_MAX_CHUNK_CHARS, chunk_embeddings="pool",
+                             batch_size=DEFAULT_EMBEDDING_BATCH_SIZE):
+    """
+    Découpage sémantique des documents, qui renvoie aussi le vecteur de chaque chunk.
+
+    Les phrases de tous les documents sont vectorisées en un seul appel par lots. Chaque chunk
+    garde le texte d'origine, de sa première à sa dernière phrase, et sa position dans le document
+    (métadonnées `start_index`, `end_index` et `parent_id`).
 
+    Parameters:
+    - documents (List[Document]): Liste d'objets Document à diviser.
+    - model_name (str): Modèle d'embedding, celui de la base vectorielle qui recevra les chunks.
+    - min_chunk_chars (int): Taille en dessous de laquelle un chunk n'est pas coupé sur un changement de sujet.
+    - max_chunk_chars (int): Taille maximale d'un chunk, en caractères.
+    - chunk_embeddings (str): "pool" pour la moyenne pondérée des vecteurs des phrases, "embed" pour
+      vectoriser à nouveau les chunks de plusieurs phrases (plus fidèle, mais un second passage).
+    - batch_size (int): Nombre de phrases vectorisées par appel au modèle.
+
+    Returns:
+    - tuple:
+        - List[Document]: Les chunks.
+        - np.ndarray: Leurs vecteurs, float32, de forme (nombre de chunks, dimension).
+    """
+    if chunk_embeddings not in CHUNK_EMBEDDINGS:
+        raise ValueError(f"chunk_embeddings doit valoir l'une de {CHUNK_EMBEDDINGS}, reçu : {chunk_embeddings!r}")
+    embedding_function = get_embedding_model(model_name)
 
+    with span("chunk", documents=len(documents), semantic=True) as chunk_span:
+        document_spans = [split_sentences(document.page_content, max_chunk_chars) for document in documents]
+        sentences = [document.page_content[start:end]
+                     for document, spans in zip(documents, document_spans) for start, end in spans]
+        sentence_embeddings = embed_texts(embedding_function, sentences, batch_size=batch_size)
+
+        chunks, chunk_firsts, offset = [], [], 0
+        for document, spans in zip(documents, document_spans):
+            if not spans:
+                continue
+            firsts = _boundaries(sentence_embeddings[offset:offset + len(spans)], spans,
+                                 min_chunk_chars, max_chunk_chars)
+            chunks.extend(_chunks_from_spans(document, [(spans[first][0], spans[last - 1][1])
+                                                        for first, last in zip(firsts, firsts[1:] + [len(spans)])]))
+            chunk_firsts.extend(offset + first for first in firsts)
+            offset += len(spans)
+
+        embeddings = _pool(sentence_embeddings, np.asarray(chunk_firsts, dtype=np.int64),
+                           np.asarray([len(sentence) for sentence in sentences], dtype=np.float32))
+        if chunk_embeddings == "embed":
+            counts = np.diff(np.append(chunk_firsts, len(sentences)))
+            multi = np.flatnonzero(counts > 1)
+            if len(multi):
+                embeddings[multi] = embed_texts(embedding_function, [chunks[i].page_content for i in multi],
+                                                batch_size=batch_size)
+        chunk_span.set(sentences=len(sentences), chunks=len(chunks))
+    return chunks, embeddings
+
+
+def _pool(sentence_embeddings, firsts, weights):
+    """
+    Moyenne des vecteurs des phrases de chaque chunk, pondérée par leur longueur, ramenée à la
+    norme moyenne de ces vecteurs (un chunk d'une seule phrase garde exactement son vecteur).
+    """
+    if not len(firsts):
+        return np.empty((0, sentence_embeddings.shape[1]), dtype=np.float32)
+    sums = np.add.reduceat(sentence_embeddings * weights[:, None], firsts, axis=0)
+    total_weights = np.add.reduceat(weights, firsts)
+    norms = np.add.reduceat(np.linalg.norm(sentence_embeddings, axis=1) * weights, firsts) / total_weights
+    pooled = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+    return np.ascontiguousarray(pooled * norms[:, None], dtype=np.float32)
 
 
 def main():
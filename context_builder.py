@@ -0,0 +1,236 @@
+"""
+Assembly of the retrieved chunks into the context of the prompt.
+
+Every token of context is paid for in Ollama's prompt evaluation (prefill) before the first
+token of the answer. The builder therefore:
+- drops chunks that repeat another one (identical, contained in it, or near-identical);
+- merges chunks of the same source that follow each other, removing the text they share
+  (character chunks overlap by `chunk_overlap` characters);
+- replaces the repr of the metadata dict with a one-line header (title, source, date);
+- stops at a token budget, measured with the LLM's tokenizer when it can be loaded, and
+  estimated from the text length otherwise.
+
+Sources are emitted in the order of their best-ranked chunk, so the budget goes to the most
+relevant ones first.
+"""
+import re
+import logging
+
+from embedding_models import get_tokenizer
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Ungated copy of the Llama 3.2 tokenizer, the one of Ollama's default llama3.2 model
+DEFAULT_TOKENIZER = "unsloth/Llama-3.2-1B-Instruct"
+DEFAULT_MAX_TOKENS = 1500
+CHARS_PER_TOKEN = 4          # fallback estimate, a rough average for French text
+NEAR_DUPLICATE_JACCARD = 0.9
+MIN_OVERLAP_CHARS = 20       # shorter common prefixes/suffixes are coincidences, not splitter overlap
+MAX_OVERLAP_CHARS = 400
+MIN_SECTION_TOKENS = 32      # a section cut shorter than this is dropped instead
+
+_WORD_RE = re.compile(r"\w+")
+_unavailable_tokenizers = {}
+
+
+def count_tokens(text, tokenizer_name=DEFAULT_TOKENIZER):
+    """
+    Counts the LLM tokens of a text with the model's tokenizer, or estimates them from its
+    length if the tokenizer cannot be loaded (the failure is remembered).
+    """
+    if tokenizer_name and tokenizer_name not in _unavailable_tokenizers:
+        try:
+            tokenizer = get_tokenizer(tokenizer_name)
+        except Exception as e:
+            _unavailable_tokenizers[tokenizer_name] = e
+            logger.warning(f"Tokenizer '{tokenizer_name}' unavailable, token counts are estimated: {e}")
+        else:
+            return len(tokenizer.encode(text, add_special_tokens=False))
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def format_header(metadata, number):
+    """
+    Returns the one-line header of a source in the context: number, title, file and date.
+    """
+    parts = [str(metadata[key]) for key in ("title", "source", "date")
+             if metadata.get(key) and not str(metadata[key]).endswith(("non défini", "non définie"))]
+    return f"[{number}] " + " | ".join(parts) if parts else f"[{number}]"
+
+
+def _normalized(text):
+    return " ".join(text.split()).casefold()
+
+
+def _overlap(left, right):
+    # Length of the longest suffix of `left` that is a prefix of `right`
+    for size in range(min(len(left), len(right), MAX_OVERLAP_CHARS), MIN_OVERLAP_CHARS - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def _shingles(text):
+    words = _WORD_RE.findall(text)
+    return {tuple(words[i:i + 3]) for i in range(max(1, len(words) - 2))}
+
+
+def deduplicate(documents):
+    """
+    Drops chunks that are identical to, contained in, or nearly identical to (Jaccard similarity
+    of their word trigrams >= NEAR_DUPLICATE_JACCARD) a better-ranked chunk. A chunk that contains
+    better-ranked ones replaces them, at the rank of the best of them.
+
+    Parameters:
+    - documents (List[Document]): Chunks, best first.
+
+    Returns:
+    - List[Document]: The remaining chunks, best first.
+    """
+    kept = []  # (document, normalized text, word trigrams)
+    for document in documents:
+        text = _normalized(document.page_content)
+        if not text:
+            continue
+        shingles = _shingles(text)
+        if any(text in other_text or (shingles and len(shingles & other_shingles) / len(shingles | other_shingles)
+                                      >= NEAR_DUPLICATE_JACCARD)
+               for _, other_text, other_shingles in kept):
+            continue
+        covered = [i for i, (_, other_text, _) in enumerate(kept) if other_text in text]
+        entry = (document, text, shingles)
+        if covered:
+            for i in reversed(covered[1:]):
+                del kept[i]
+            kept[covered[0]] = entry
+        else:
+            kept.append(entry)
+    return [document for document, _, _ in kept]
+
+
+def merge_adjacent(documents):
+    """
+    Groups chunks by source and merges those that follow each other in the document.
+
+    When the splitter recorded the `start_index` of the chunks, chunks whose spans overlap or
+    touch (one starts exactly where the other ends, so the text runs on in the document) are
+    merged. Chunks separated by any gap stay separate passages, joined by "[...]" in the
+    context, even when the gap is only whitespace: the splitters strip whitespace at chunk
+    edges, and the positions alone cannot tell skipped whitespace from skipped text.
+    Without positions, two chunks are merged when the end of one is the start of the other
+    (splitter overlap). Either way, the shared text appears once.
+
+    Parameters:
+    - documents (List[Document]): Chunks, best first.
+
+    Returns:
+    - List[Tuple[dict, List[str]]]: (metadata of the source, text passages) pairs, in the order
+      of each source's best chunk.
+    """
+    groups = {}
+    for document in documents:
+        source = document.metadata.get("source_path") or document.metadata.get("source")
+        groups.setdefault(source, []).append(document)
+
+    sections = []
+    for source_documents in groups.values():
+        if all(isinstance(document.metadata.get("start_index"), int) for document in source_documents):
+            passages = _merge_by_position(source_documents)
+        else:
+            passages = _merge_by_overlap(source_documents)
+        sections.append((source_documents[0].metadata, passages))
+    return sections
+
+
+def _merge_by_position(documents):
+    passages, end = [], None
+    for document in sorted(documents, key=lambda document: document.metadata["start_index"]):
+        start = document.metadata["start_index"]
+        text = document.page_content
+        if end is not None and start <= end:
+            passages[-1] += text[end - start:]
+        else:
+            passages.append(text)
+        end = max(end or 0, start + len(text))
+    return [passage.strip() for passage in passages]
+
+
+def _merge_by_overlap(documents):
+    passages = []
+    for document in documents:
+        text = document.page_content.strip()
+        # A chunk can join two passages (the one before it and the one after it): merge until stable
+        while True:
+            for i, passage in enumerate(passages):
+                overlap = _overlap(passage, text)
+                if overlap:
+                    text = passage + text[overlap:]
+                    break
+                overlap = _overlap(text, passage)
+                if overlap:
+                    text = text + passage[overlap:]
+                    break
+            else:
+                break
+            del passages[i]
+        passages.append(text)
+    return passages
+
+
+def _truncate(block, max_tokens, tokenizer_name):
+    # Longest prefix of the block that fits in max_tokens with its " [...]" mark. Token counts
+    # are not proportional to the length, so the cut point is found by binary search.
+    low, high = 0, len(block)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(block[:middle].rstrip() + " [...]", tokenizer_name) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return block[:low].rstrip() + " [...]" if low else ""
+
+
+def build_context(documents, max_tokens=DEFAULT_MAX_TOKENS, tokenizer_name=DEFAULT_TOKENIZER):
+    """
+    Builds the context of the prompt from retrieved chunks, within a token budget.
+
+    Parameters:
+    - documents (List[Document]): Retrieved chunks, best first.
+    - max_tokens (int, optional): Token budget of the context (None for no limit).
+    - tokenizer_name (str): Hugging Face tokenizer used to count tokens.
+
+    Returns:
+    - str: The context, one section per source, each with a compact header.
+    """
+    with span("context_build", chunks=len(documents)) as context_span:
+        unique = deduplicate(documents)
+        sections = merge_adjacent(unique)
+
+        blocks, used_tokens, dropped = [], 0, 0
+        for number, (metadata, passages) in enumerate(sections, start=1):
+            # Sections after the first are counted with the blank line that separates them
+            separator = "\n\n" if blocks else ""
+            block = format_header(metadata, number) + "\n" + "\n[...]\n".join(passages)
+            block_tokens = count_tokens(separator + block, tokenizer_name)
+            if max_tokens is not None and used_tokens + block_tokens > max_tokens:
+                remaining = max_tokens - used_tokens - (count_tokens(separator, tokenizer_name) if separator else 0)
+                dropped = len(sections) - number + 1
+                if blocks and remaining < MIN_SECTION_TOKENS:
+                    break
+                block = _truncate(block, remaining, tokenizer_name)
+                if block:
+                    blocks.append(block)
+                break
+            blocks.append(block)
+            used_tokens += block_tokens
+
+        context = "\n\n".join(blocks)
+        if max_tokens is not None and blocks:
+            # Tokens can merge across the joins: measure the context itself, and cut its end if needed
+            used_tokens = count_tokens(context, tokenizer_name)
+            if used_tokens > max_tokens:
+                context = _truncate(context, max_tokens, tokenizer_name)
+                used_tokens = count_tokens(context, tokenizer_name)
+        context_span.set(unique=len(unique), sections=len(sections), tokens=used_tokens, truncated=dropped)
+    return context
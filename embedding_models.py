@@ -0,0 +1,150 @@
+"""
+Process-wide registry of embedding models (and of the cross-encoder used for reranking and
+the tokenizer used to budget the prompt).
+
+Loading a sentence-transformers model reads hundreds of MB of weights from disk and takes
+seconds. The chunker, the indexer and the query path all ask this registry for their model,
+so each (model, device) pair is loaded once per process and then shared.
+"""
+import time
+import logging
+import threading
+
+from langchain_huggingface import HuggingFaceEmbeddings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+# Multilingual MiniLM cross-encoder trained on mMARCO: small enough for CPU inference, and handles French
+DEFAULT_CROSS_ENCODER_MODEL = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+
+_models = {}
+_loading_locks = {}  # one lock per model key: loading a model does not block lookups of the others
+_lock = threading.Lock()
+
+
+def normalize_model_name(model_name):
+    """
+    Returns the full Hugging Face name of a sentence-transformers model, so that
+    "all-MiniLM-L6-v2" and "sentence-transformers/all-MiniLM-L6-v2" share one registry entry.
+    """
+    return model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+
+
+def _get_or_load(kind, model_name, device, loader):
+    # Only sentence-transformers embedding models may be named without their organisation
+    key = (kind, normalize_model_name(model_name) if kind == "embeddings" else model_name, device)
+    with _lock:
+        model = _models.get(key)
+        if model is not None:
+            return model
+        loading_lock = _loading_locks.setdefault(key, threading.Lock())
+    # Weights load outside the registry lock, so that a slow load (a warm-up in the background)
+    # only makes the callers of the same model wait
+    with loading_lock:
+        with _lock:
+            model = _models.get(key)
+        if model is None:
+            start_time = time.perf_counter()
+            model = loader(key[1])
+            with _lock:
+                _models[key] = model
+            logger.info(f"Loaded {kind} model '{key[1]}' (device={device or 'auto'}) "
+                        f"in {time.perf_counter() - start_time:.2f}s")
+    return model
+
+
+def get_embedding_model(model_name=DEFAULT_EMBEDDING_MODEL, device=None):
+    """
+    Returns the shared HuggingFaceEmbeddings for a model, loading it on first use.
+
+    Parameters:
+    - model_name (str): Sentence embedding model.
+    - device (str, optional): Torch device ("cpu", "cuda", ...). Defaults to the library's choice.
+
+    Returns:
+    - HuggingFaceEmbeddings: The embedding function.
+    """
+    def load(name):
+        model_kwargs = {"device": device} if device else {}
+        return HuggingFaceEmbeddings(model_name=name, model_kwargs=model_kwargs)
+
+    return _get_or_load("embeddings", model_name, device, load)
+
+
+def get_cross_encoder(model_name=DEFAULT_CROSS_ENCODER_MODEL, device="cpu", max_length=512):
+    """
+    Returns the shared sentence-transformers CrossEncoder used to rerank retrieved chunks.
+
+    Parameters:
+    - model_name (str): Cross-encoder model.
+    - device (str, optional): Torch device. Defaults to the CPU.
+    - max_length (int): Maximum length of a (question, chunk) pair, in tokens.
+
+    Returns:
+    - CrossEncoder: The model.
+    """
+    from sentence_transformers import CrossEncoder
+
+    def load(name):
+        return CrossEncoder(name, device=device, max_length=max_length)
+
+    return _get_or_load("cross_encoder", model_name, device, load)
+
+
+def get_tokenizer(model_name):
+    """
+    Returns the shared Hugging Face tokenizer of a model, used to count prompt tokens.
+
+    Parameters:
+    - model_name (str): Hugging Face model whose tokenizer is loaded (only the tokenizer files
+      are downloaded).
+
+    Returns:
+    - PreTrainedTokenizerBase: The tokenizer.
+    """
+    from transformers import AutoTokenizer
+
+    return _get_or_load("tokenizer", model_name, None, AutoTokenizer.from_pretrained)
+
+
+def loaded_models():
+    """
+    Returns the (kind, model name, device) keys of the models currently loaded.
+    """
+    with _lock:
+        return list(_models)
+
+
+def clear_models():
+    """
+    Drops every loaded model (they are freed once no vector store references them).
+    """
+    with _lock:
+        _models.clear()
+
+
+def warm_up(model_name=DEFAULT_EMBEDDING_MODEL, device=None, cross_encoder_model=None):
+    """
+    Loads the models ahead of the first request and runs one encoding through them,
+    so the first query does not pay for weight loading and lazy initialisation.
+
+    Parameters:
+    - model_name (str): Sentence embedding model.
+    - device (str, optional): Torch device.
+    - cross_encoder_model (str, optional): Also load this reranking cross-encoder.
+
+    Returns:
+    - HuggingFaceEmbeddings: The warmed-up embedding function.
+    """
+    start_time = time.perf_counter()
+    embedding_function = get_embedding_model(model_name, device)
+    embedding_function.embed_query("warm-up")
+    if cross_encoder_model:
+        try:
+            get_cross_encoder(cross_encoder_model).predict([("warm-up", "warm-up")], show_progress_bar=False)
+        except Exception as e:
+            # Reranking is optional: the query path falls back to the retrieval order
+            logger.warning(f"Could not warm up cross-encoder '{cross_encoder_model}': {e}")
+    logger.info(f"Embedding models warmed up in {time.perf_counter() - start_time:.2f}s")
+    return embedding_function
@@ -0,0 +1,317 @@
+"""
+FAISS index types available for the vector store.
+
+- flat: exact brute-force search (IndexFlatL2). Latency grows linearly with the number of chunks.
+- ivf_flat: inverted lists over k-means cells; `nprobe` cells are scanned per query.
+- ivf_pq: inverted lists with product-quantized vectors; much smaller, slightly less accurate.
+- hnsw: hierarchical navigable small-world graph; `ef_search` controls the query-time beam width.
+
+Approximate indexes are trained on a random sample of the vectors. When the corpus is too
+small to train the requested index, a flat index is built instead.
+"""
+import math
+import time
+import logging
+
+import faiss
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+DEFAULT_INDEX_PARAMS = {
+    "nlist": None,          # IVF cells; None -> 4 * sqrt(number of vectors)
+    "nprobe": 8,            # IVF cells scanned per query
+    "pq_m": None,           # PQ sub-quantizers; None -> dimension / 8 (or the closest divisor)
+    "pq_nbits": 8,          # bits per PQ code
+    "hnsw_m": 32,           # HNSW neighbours per node
+    "ef_construction": 40,  # HNSW beam width while building
+    "ef_search": 64,        # HNSW beam width at query time
+}
+
+# k-means needs a few dozen points per centroid to train reliably
+MIN_POINTS_PER_CENTROID = 39
+MAX_TRAINING_POINTS_PER_CENTROID = 256
+ADD_BATCH_SIZE = 65536
+# Filtered searches over at most this many vectors compare them all instead of using the index
+EXACT_SEARCH_LIMIT = 4096
+
+
+def _default_pq_m(dimension):
+    target = max(1, dimension // 8)
+    divisors = [m for m in range(1, dimension + 1) if dimension % m == 0]
+    return min(divisors, key=lambda m: abs(m - target))
+
+
+def resolve_index_params(index_type, dimension, n_vectors, params=None):
+    """
+    Fills in default parameters and falls back to a flat index when the corpus is too small.
+
+    Parameters:
+    - index_type (str): One of INDEX_TYPES.
+    - dimension (int): Vector dimension.
+    - n_vectors (int): Number of vectors that will be indexed (and sampled for training).
+    - params (dict, optional): Overrides for DEFAULT_INDEX_PARAMS.
+
+    Returns:
+    - tuple: (index_type actually used, resolved params)
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}'. Expected one of {INDEX_TYPES}.")
+
+    resolved = {**DEFAULT_INDEX_PARAMS, **(params or {})}
+    if index_type in ("ivf_flat", "ivf_pq"):
+        if resolved["nlist"] is None:
+            resolved["nlist"] = max(1, int(4 * math.sqrt(n_vectors)))
+        resolved["nlist"] = min(resolved["nlist"], n_vectors // MIN_POINTS_PER_CENTROID)
+        if resolved["nlist"] < 1:
+            logger.warning(f"Only {n_vectors} vectors: too few to train '{index_type}', using a flat index.")
+            return "flat", resolved
+    if index_type == "ivf_pq":
+        if resolved["pq_m"] is None:
+            resolved["pq_m"] = _default_pq_m(dimension)
+        if dimension % resolved["pq_m"]:
+            raise ValueError(f"pq_m={resolved['pq_m']} must divide the vector dimension {dimension}.")
+        if n_vectors < MIN_POINTS_PER_CENTROID * 2 ** resolved["pq_nbits"]:
+            logger.warning(f"Only {n_vectors} vectors: too few to train product quantization, using ivf_flat.")
+            return "ivf_flat", resolved
+    return index_type, resolved
+
+
+def build_index(index_type, dimension, params):
+    """
+    Builds an empty (untrained) FAISS index of the given type.
+
+    Parameters:
+    - index_type (str): One of INDEX_TYPES.
+    - dimension (int): Vector dimension.
+    - params (dict): Resolved parameters (see resolve_index_params).
+
+    Returns:
+    - faiss.Index: The index.
+    """
+    if index_type == "flat":
+        return faiss.IndexFlatL2(dimension)
+    if index_type == "ivf_flat":
+        return faiss.index_factory(dimension, f"IVF{params['nlist']},Flat")
+    if index_type == "ivf_pq":
+        return faiss.index_factory(dimension, f"IVF{params['nlist']},PQ{params['pq_m']}x{params['pq_nbits']}")
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, params["hnsw_m"])
+        index.hnsw.efConstruction = params["ef_construction"]
+        return index
+    raise ValueError(f"Unknown index type '{index_type}'. Expected one of {INDEX_TYPES}.")
+
+
+def _extract_ivf(index):
+    """
+    Returns the IVF part of an index with its concrete type (IndexIVFFlat, IndexIVFPQ), or None.
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    return faiss.downcast_index(ivf) if ivf is not None else None
+
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    """
+    Sets query-time parameters on an index (ignored when they do not apply to its type).
+    """
+    ivf = _extract_ivf(index)
+    if ivf is not None and nprobe is not None:
+        ivf.nprobe = min(int(nprobe), ivf.nlist)
+    if isinstance(index, faiss.IndexHNSW) and ef_search is not None:
+        index.hnsw.efSearch = int(ef_search)
+
+
+def describe_index(index):
+    """
+    Describes the type and parameters of a FAISS index, as stored in metadata.json.
+
+    Returns:
+    - dict: {"type": ..., and the parameters relevant to that type}
+    """
+    ivf = _extract_ivf(index)
+    if ivf is not None:
+        if isinstance(ivf, faiss.IndexIVFPQ):
+            return {"type": "ivf_pq", "nlist": ivf.nlist, "nprobe": ivf.nprobe,
+                    "pq_m": ivf.pq.M, "pq_nbits": ivf.pq.nbits}
+        return {"type": "ivf_flat", "nlist": ivf.nlist, "nprobe": ivf.nprobe}
+    if isinstance(index, faiss.IndexHNSW):
+        return {"type": "hnsw", "hnsw_m": index.hnsw.nb_neighbors(1),
+                "ef_construction": index.hnsw.efConstruction, "ef_search": index.hnsw.efSearch}
+    return {"type": "flat"}
+
+
+def supports_stable_ids(index):
+    """
+    Whether removing vectors keeps the labels of the remaining ones (IVF indexes).
+    Flat indexes renumber their vectors on removal; HNSW indexes cannot remove vectors.
+    """
+    return _extract_ivf(index) is not None
+
+
+def reconstruct_vectors(index, labels):
+    """
+    Returns the stored vectors for the given labels (approximate for PQ indexes).
+    """
+    labels = np.asarray(labels, dtype=np.int64)
+    if isinstance(index, faiss.IndexFlat) and np.array_equal(labels, np.arange(index.ntotal)):
+        return index.reconstruct_n(0, index.ntotal)
+    ivf = _extract_ivf(index)
+    if ivf is not None:
+        ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+    return index.reconstruct_batch(labels)
+
+
+def search_with_selector(index, queries, k, labels, exact_limit=EXACT_SEARCH_LIMIT):
+    """
+    Searches only among the given labels.
+
+    Small label sets are searched exactly over their reconstructed vectors: an approximate index
+    would otherwise return fewer than k results when the allowed vectors are outside the scanned
+    IVF cells or the explored HNSW neighbourhood. Larger sets are searched with a FAISS ID selector,
+    with the index's own nprobe / ef_search.
+
+    Parameters:
+    - index (faiss.Index): The index.
+    - queries (np.ndarray): float32 array of shape (n, dimension).
+    - k (int): Number of results per query.
+    - labels (np.ndarray): Allowed labels.
+    - exact_limit (int): Largest label set searched exactly.
+
+    Returns:
+    - tuple: (distances, labels) arrays of shape (n, k), padded with -1 labels like index.search.
+    """
+    labels = np.asarray(labels, dtype=np.int64)
+    if len(labels) <= exact_limit:
+        vectors = reconstruct_vectors(index, labels)
+        distances = ((queries[:, None, :] - vectors[None, :, :]) ** 2).sum(axis=2)
+        top = np.argsort(distances, axis=1, kind="stable")[:, :k]
+        found_distances = np.full((len(queries), k), np.finfo(np.float32).max, dtype=np.float32)
+        found_labels = np.full((len(queries), k), -1, dtype=np.int64)
+        found_distances[:, :top.shape[1]] = np.take_along_axis(distances, top, axis=1)
+        found_labels[:, :top.shape[1]] = labels[top]
+        return found_distances, found_labels
+
+    selector = faiss.IDSelectorBatch(labels)
+    ivf = _extract_ivf(index)
+    if ivf is not None:
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    elif isinstance(index, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    return index.search(queries, k, params=params)
+
+
+def create_index(index_type, vectors, params=None, labels=None, seed=0):
+    """
+    Builds, trains and fills an index of the requested type.
+
+    Parameters:
+    - index_type (str): One of INDEX_TYPES.
+    - vectors (np.ndarray): float32 array of shape (n, dimension).
+    - params (dict, optional): Overrides for DEFAULT_INDEX_PARAMS.
+    - labels (np.ndarray, optional): int64 labels for IVF indexes (defaults to 0..n-1).
+    - seed (int): Random seed of the training sample.
+
+    Returns:
+    - faiss.Index: The filled index.
+    """
+    n_vectors, dimension = vectors.shape
+    index_type, params = resolve_index_params(index_type, dimension, n_vectors, params)
+    index = build_index(index_type, dimension, params)
+
+    if not index.is_trained:
+        start_time = time.perf_counter()
+        n_centroids = params["nlist"]
+        if index_type == "ivf_pq":
+            n_centroids = max(n_centroids, 2 ** params["pq_nbits"])
+        sample_size = min(n_vectors, MAX_TRAINING_POINTS_PER_CENTROID * n_centroids)
+        sample = vectors
+        if sample_size < n_vectors:
+            sample = vectors[np.random.default_rng(seed).choice(n_vectors, sample_size, replace=False)]
+        index.train(sample)
+        logger.info(f"Trained {index_type} index on {sample_size} vectors in {time.perf_counter() - start_time:.2f}s")
+
+    for start in range(0, n_vectors, ADD_BATCH_SIZE):
+        batch = vectors[start:start + ADD_BATCH_SIZE]
+        if labels is not None and supports_stable_ids(index):
+            index.add_with_ids(batch, np.asarray(labels[start:start + ADD_BATCH_SIZE], dtype=np.int64))
+        else:
+            index.add(batch)
+
+    set_search_params(index, nprobe=params["nprobe"], ef_search=params["ef_search"])
+    return index
+
+
+def compare_index_types(vectors, index_types=INDEX_TYPES, params=None, k=10, n_queries=100, seed=0):
+    """
+    Compares recall and latency of each index type against the exact flat index.
+
+    Queries are sampled from the indexed vectors themselves, so no extra embedding is needed.
+
+    Parameters:
+    - vectors (np.ndarray): float32 array of shape (n, dimension).
+    - index_types (Iterable[str]): Index types to compare.
+    - params (dict, optional): Overrides for DEFAULT_INDEX_PARAMS, shared by all types.
+    - k (int): Number of neighbours retrieved per query.
+    - n_queries (int): Number of sampled queries.
+    - seed (int): Random seed of the query sample.
+
+    Returns:
+    - List[dict]: One row per index type with the type actually built, build time (s),
+      mean query latency (ms) and recall@k relative to the flat index.
+    """
+    n_vectors = vectors.shape[0]
+    k = min(k, n_vectors)
+    query_ids = np.random.default_rng(seed).choice(n_vectors, min(n_queries, n_vectors), replace=False)
+    queries = np.ascontiguousarray(vectors[query_ids])
+
+    reference = create_index("flat", vectors)
+    _, truth = reference.search(queries, k)
+
+    rows = []
+    for index_type in index_types:
+        start_time = time.perf_counter()
+        index = create_index(index_type, vectors, params, seed=seed)
+        build_time = time.perf_counter() - start_time
+
+        latencies = []
+        found = np.empty_like(truth)
+        for i, query in enumerate(queries):
+            start_time = time.perf_counter()
+            _, found[i:i + 1] = index.search(query.reshape(1, -1), k)
+            latencies.append(time.perf_counter() - start_time)
+
+        hits = sum(len(set(found[i]) & set(truth[i])) for i in range(len(queries)))
+        rows.append({
+            "requested_type": index_type,
+            **describe_index(index),
+            "build_s": build_time,
+            "latency_ms": 1000 * float(np.mean(latencies)),
+            f"recall@{k}": hits / (k * len(queries)),
+        })
+        logger.info(f"{rows[-1]}")
+    return rows
+
+
+def main():
+    """
+    Prints the recall-versus-latency comparison for the vectors of an existing vector store.
+    """
+    import os
+    import sys
+
+    directory_path = sys.argv[1] if len(sys.argv) > 1 else ".vector_store"
+    index = faiss.read_index(os.path.join(directory_path, "index.faiss"))
+    vectors = reconstruct_vectors(index, np.arange(index.ntotal))
+    print(f"{index.ntotal} vectors of dimension {index.d} loaded from {directory_path}")
+    for row in compare_index_types(np.ascontiguousarray(vectors, dtype=np.float32)):
+        recall = next(value for key, value in row.items() if key.startswith("recall@"))
+        print(f"{row['requested_type']:>9} -> {row['type']:<9} build {row['build_s']:7.2f}s  "
+              f"latency {row['latency_ms']:7.3f}ms  recall {recall:.3f}")
+
+
+if __name__ == "__main__":
+    main()
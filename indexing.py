@@ -0,0 +1,314 @@
+"""
+Indexation incrémentale d'un dossier de documents.
+
+Un manifeste (manifest.json) est enregistré à côté de l'index FAISS. Il conserve, pour chaque
+fichier indexé, son empreinte SHA-256, sa date de modification, sa taille et les identifiants
+des chunks qu'il a produits. Lors d'une reconstruction, seuls les fichiers nouveaux ou modifiés
+sont extraits, découpés et vectorisés ; les chunks des fichiers supprimés ou modifiés sont retirés
+de l'index et du docstore, et la base est mise à jour sur place.
+
+Fonctions principales :
+- load_manifest / save_manifest: Lecture et écriture du manifeste.
+- diff_directory: Compare le contenu d'un dossier avec le manifeste.
+- iter_chunk_batches: Découpe un flux de documents par lots bornés.
+- iter_update_vector_store: Met à jour la base en flux, lot par lot (base interrogeable après chaque lot).
+- update_vector_store: Met à jour (ou crée) la base vectorielle à partir d'un dossier.
+"""
+import os
+import json
+import logging
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from chunking import split_documents, semantic_split_documents
+from preprocessing import (iter_documents, list_supported_files, compute_file_hash,
+                           EXTRACTION_CACHE_DIRNAME, EXTRACTION_TIMEOUT)
+from faiss_indexes import describe_index, resolve_index_params
+from vector_store import (create_empty_vector_store, load_vector_store, save_vector_store,
+                          vector_store_exists, add_chunks_to_vector_store,
+                          remove_chunks_from_vector_store, convert_vector_store_index, saved_index_config)
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = "manifest.json"
+MANIFEST_VERSION = 1
+DEFAULT_BATCH_DOCUMENTS = 16
+
+
+def load_manifest(directory_path=".vector_store"):
+    """
+    Charge le manifeste d'une base vectorielle.
+
+    Parameters:
+    - directory_path (str): Dossier de la base vectorielle.
+
+    Returns:
+    - dict | None: Le manifeste, ou None s'il n'existe pas ou est illisible.
+    """
+    manifest_path = os.path.join(directory_path, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Manifeste illisible ({manifest_path}) : {e}")
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def save_manifest(manifest, directory_path=".vector_store"):
+    """
+    Enregistre le manifeste de manière atomique à côté de l'index.
+
+    Parameters:
+    - manifest (dict): Le manifeste à enregistrer.
+    - directory_path (str): Dossier de la base vectorielle.
+    """
+    os.makedirs(directory_path, exist_ok=True)
+    manifest_path = os.path.join(directory_path, MANIFEST_FILENAME)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+def diff_directory(source_path, manifest_files):
+    """
+    Compare les fichiers supportés d'un dossier avec les entrées du manifeste.
+
+    Un fichier dont la date de modification et la taille n'ont pas changé est considéré
+    inchangé sans relire son contenu ; sinon son empreinte est recalculée.
+
+    Parameters:
+    - source_path (str): Dossier à indexer.
+    - manifest_files (dict): Entrées "files" du manifeste précédent.
+
+    Returns:
+    - tuple:
+        - added (dict): Fichiers nouveaux, chemin -> entrée (hash, mtime, size).
+        - changed (dict): Fichiers modifiés, chemin -> nouvelle entrée.
+        - removed (List[str]): Fichiers présents dans le manifeste mais plus sur le disque.
+        - unchanged (dict): Fichiers inchangés, chemin -> entrée du manifeste (mtime mis à jour).
+    """
+    added, changed, unchanged = {}, {}, {}
+    current_paths = list_supported_files(source_path)
+
+    for file_path in current_paths:
+        stat = os.stat(file_path)
+        previous = manifest_files.get(file_path)
+        if previous and previous["mtime"] == stat.st_mtime and previous["size"] == stat.st_size:
+            unchanged[file_path] = previous
+            continue
+
+        entry = {"hash": compute_file_hash(file_path), "mtime": stat.st_mtime, "size": stat.st_size}
+        if previous is None:
+            added[file_path] = entry
+        elif previous["hash"] != entry["hash"]:
+            changed[file_path] = entry
+        else:
+            # Fichier touché mais contenu identique : on garde ses chunks
+            unchanged[file_path] = {**previous, "mtime": entry["mtime"]}
+
+    current = set(current_paths)
+    removed = [file_path for file_path in manifest_files if file_path not in current]
+    return added, changed, removed, unchanged
+
+
+def iter_chunk_batches(documents, batch_size=DEFAULT_BATCH_DOCUMENTS, semantic_chunking=True,
+                       model_name="all-MiniLM-L6-v2", executor=None):
+    """
+    Regroupe un flux de documents par lots et découpe chaque lot en chunks.
+
+    Parameters:
+    - documents (Iterable[Document]): Flux de documents (par exemple iter_documents).
+    - batch_size (int): Nombre de documents par lot.
+    - semantic_chunking (bool): Découpage sémantique (voir chunking.semantic_split_documents)
+      ou par nombre de caractères.
+    - model_name (str): Modèle d'embedding de la base, avec lequel le découpage sémantique
+      vectorise les chunks.
+    - executor (ProcessPoolExecutor, optional): Pool de processus du découpage par caractères,
+      partagé par tous les lots (voir chunking.split_documents).
+
+    Yields:
+    - tuple: (documents du lot, chunks non vides du lot, vecteurs des chunks ou None)
+    """
+    batch = []
+    for document in documents:
+        batch.append(document)
+        if len(batch) >= batch_size:
+            yield (batch, *_split_batch(batch, semantic_chunking, model_name, executor))
+            batch = []
+    if batch:
+        yield (batch, *_split_batch(batch, semantic_chunking, model_name, executor))
+
+
+def _split_batch(documents, semantic_chunking, model_name, executor=None):
+    if semantic_chunking:
+        # Les vecteurs des chunks viennent des phrases déjà vectorisées pour le découpage
+        return semantic_split_documents(documents, model_name=model_name)
+    chunks = split_documents(documents, semantic_chunking=False, executor=executor)
+    return [chunk for chunk in chunks if chunk.page_content.strip()], None
+
+
+def iter_update_vector_store(source_path, model_name="all-MiniLM-L6-v2", save_path=".vector_store",
+                             semantic_chunking=True, workers=1, timeout=EXTRACTION_TIMEOUT,
+                             batch_size=DEFAULT_BATCH_DOCUMENTS, index_type=None, index_params=None):
+    """
+    Met à jour la base vectorielle d'un dossier en ne traitant que les fichiers modifiés, en flux.
+
+    Extraction, découpage, embedding et ajout à l'index s'enchaînent par lots de `batch_size`
+    documents : seule une fenêtre bornée de documents et de vecteurs est en mémoire à un instant
+    donné, et la base produite après chaque lot est déjà interrogeable.
+
+    Si aucune base ou aucun manifeste n'existe, ou si le modèle d'embedding a changé,
+    la base est entièrement reconstruite. La base et le manifeste sont enregistrés à la fin.
+
+    Pendant une reconstruction, les vecteurs sont ajoutés à un index exact (flat) ; l'index
+    approché demandé (`index_type`) est entraîné et construit une fois tous les lots ajoutés.
+    Sans `index_type`, la base garde le type d'index enregistré dans son metadata.json.
+
+    Parameters:
+    - source_path (str): Dossier contenant les documents.
+    - model_name (str): Modèle d'embedding à utiliser.
+    - save_path (str): Dossier de la base vectorielle et du manifeste.
+    - semantic_chunking (bool): Mode de découpage transmis à split_documents.
+    - workers (int | None): Nombre de processus d'extraction (voir load_documents) et de découpage.
+    - timeout (float, optional): Durée maximale d'extraction d'un fichier, en secondes (None : pas de limite).
+    - batch_size (int): Nombre de documents traités par lot.
+    - index_type (str, optional): Type d'index FAISS (voir faiss_indexes.INDEX_TYPES). Par défaut,
+      celui de la base existante (flat pour une nouvelle base). L'index n'est converti que si
+      le type demandé, une fois adapté à la taille de la base, diffère du type actuel.
+    - index_params (dict, optional): Paramètres de l'index (voir faiss_indexes.DEFAULT_INDEX_PARAMS).
+
+    Yields:
+    - tuple:
+        - vector_store (FAISS): La base vectorielle, à jour jusqu'au dernier lot traité.
+        - stats (dict): Nombre de fichiers ajoutés, modifiés, supprimés, inchangés, traités
+          (files_done / files_total) et de chunks ajoutés/retirés.
+    """
+    source_path = os.path.abspath(source_path)
+    manifest = load_manifest(save_path)
+
+    rebuild = (
+        manifest is None
+        or manifest.get("model_name") != model_name
+        or manifest.get("semantic_chunking") != semantic_chunking
+        or not vector_store_exists(save_path)
+    )
+    vector_store = None
+    if not rebuild:
+        vector_store = load_vector_store(directory_path=save_path, mmap=False)
+        # La base a pu être réécrite hors indexation incrémentale : le manifeste ne fait alors plus foi
+        store_ids = set(vector_store.index_to_docstore_id.values())
+        manifest_ids = {chunk_id for entry in manifest["files"].values() for chunk_id in entry["chunk_ids"]}
+        if manifest_ids != store_ids:
+            logger.info("Manifeste désynchronisé de la base vectorielle, reconstruction complète.")
+            rebuild = True
+    previous_files = {} if rebuild else manifest["files"]
+
+    added, changed, removed, unchanged = diff_directory(source_path, previous_files)
+    new_entries = {**added, **changed}
+    stats = {
+        "added": len(added),
+        "changed": len(changed),
+        "removed": len(removed),
+        "unchanged": len(unchanged),
+        "files_done": 0,
+        "files_total": len(new_entries),
+        "chunks_added": 0,
+        "chunks_removed": 0,
+    }
+    logger.info(f"Indexation incrémentale : {stats}")
+
+    if index_type is None and rebuild:
+        # La base reconstruite reprend la configuration d'index enregistrée ; nlist est recalculé
+        # pour la nouvelle taille de la base
+        saved_config = saved_index_config(save_path) or {"type": "flat"}
+        index_type = saved_config["type"]
+        index_params = {key: value for key, value in saved_config.items() if key not in ("type", "nlist")}
+
+    if rebuild:
+        vector_store = create_empty_vector_store(model_name=model_name)
+    else:
+        stale_ids = [chunk_id
+                     for file_path in list(changed) + removed
+                     for chunk_id in previous_files[file_path]["chunk_ids"]]
+        stats["chunks_removed"] = remove_chunks_from_vector_store(vector_store, stale_ids)
+    yield vector_store, stats
+
+    # Les fichiers dont l'extraction échoue ne sont pas inscrits au manifeste : ils seront retentés
+    indexed_entries = {}
+    documents = iter_documents(list(new_entries), workers=workers, timeout=timeout,
+                               cache_dir=os.path.join(save_path, EXTRACTION_CACHE_DIRNAME),
+                               file_hashes={file_path: entry["hash"] for file_path, entry in new_entries.items()})
+    # Un seul pool de découpage pour toute l'indexation : les lots sont trop petits pour amortir
+    # le démarrage de processus à chaque lot
+    executor = None
+    if not semantic_chunking and workers != 1 and new_entries:
+        executor = ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+    try:
+        for batch_documents, batch_chunks, batch_embeddings in iter_chunk_batches(documents, batch_size,
+                                                                                    semantic_chunking, model_name,
+                                                                                    executor):
+            chunks_by_file = {document.metadata["source_path"]: [] for document in batch_documents}
+            for chunk in batch_chunks:
+                chunks_by_file[chunk.metadata["source_path"]].append(chunk)
+
+            batch_ids = []
+            for file_path, file_chunks in chunks_by_file.items():
+                chunk_ids = [uuid.uuid4().hex for _ in file_chunks]
+                indexed_entries[file_path] = {**new_entries[file_path], "chunk_ids": chunk_ids}
+                batch_ids.extend(chunk_ids)
+            add_chunks_to_vector_store(vector_store, batch_chunks, batch_ids, embeddings=batch_embeddings)
+
+            stats["files_done"] = len(indexed_entries)
+            stats["chunks_added"] += len(batch_ids)
+            yield vector_store, stats
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    if vector_store.index.ntotal == 0:
+        raise ValueError("Aucun chunk valide généré à partir des documents.")
+
+    if index_type is not None:
+        # Les petites bases se rabattent sur un index plus simple : comparer au type réellement construit
+        resolved_type, resolved_params = resolve_index_params(index_type, vector_store.index.d,
+                                                              vector_store.index.ntotal, index_params)
+        if describe_index(vector_store.index)["type"] != resolved_type:
+            convert_vector_store_index(vector_store, resolved_type, resolved_params)
+
+    save_vector_store(vector_store, model_name, save_path)
+    save_manifest({
+        "version": MANIFEST_VERSION,
+        "model_name": model_name,
+        "semantic_chunking": semantic_chunking,
+        "source_path": source_path,
+        "files": {**unchanged, **indexed_entries},
+    }, save_path)
+
+    logger.info(f"Base vectorielle mise à jour dans {save_path} : {stats}")
+
+
+def update_vector_store(source_path, model_name="all-MiniLM-L6-v2", save_path=".vector_store",
+                        semantic_chunking=True, workers=1, timeout=EXTRACTION_TIMEOUT, index_type=None,
+                        index_params=None):
+    """
+    Met à jour la base vectorielle d'un dossier en ne traitant que les fichiers modifiés.
+
+    Les paramètres sont ceux de iter_update_vector_store.
+
+    Returns:
+    - tuple:
+        - vector_store (FAISS): La base vectorielle à jour.
+        - stats (dict): Nombre de fichiers ajoutés, modifiés, supprimés, inchangés et de chunks ajoutés/retirés.
+    """
+    for vector_store, stats in iter_update_vector_store(source_path, model_name=model_name, save_path=save_path,
+                                                        semantic_chunking=semantic_chunking,
+                                                        workers=workers, timeout=timeout,
+                                                        index_type=index_type, index_params=index_params):
+        pass
+    return vector_store, stats
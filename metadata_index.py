@@ -0,0 +1,283 @@
+"""
+Metadata index over chunks, used to restrict a search to a period or a set of documents.
+
+Chunks carry `source`, `title` and `date` metadata (see preprocessing.process_files). The index
+keeps them as NumPy columns aligned with the FAISS labels, so a filter is resolved with a few
+vectorized comparisons into the labels allowed for the search, which FAISS then restricts to with
+an ID selector (see faiss_indexes.search_with_selector) instead of ranking the whole archive.
+
+Filters are plain dicts:
+
+    {"date_from": "2024-09", "date_to": "2024-09-30", "sources": ["CR_CA_2024.pdf"], "titles": ["budget"]}
+
+- date_from / date_to (str or date): inclusive bounds, as YYYY, YYYY-MM, YYYY-MM-DD or a French
+  month and year ("septembre 2024"). A chunk whose date is unknown never matches a date filter.
+- sources (str or list of str): file names of the documents to search, ignoring case.
+- titles (str or list of str): a chunk matches if its title contains one of the values, ignoring case.
+
+The index is saved next to the FAISS index as a NumPy archive (metadata_index.npz).
+"""
+import re
+import calendar
+import datetime
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+METADATA_INDEX_FILENAME = "metadata_index.npz"
+METADATA_INDEX_FORMAT = 1
+FILTER_KEYS = ("date_from", "date_to", "sources", "titles")
+UNKNOWN_DATE = 0
+
+_FRENCH_MONTHS = {
+    "janvier": 1, "fevrier": 2, "février": 2, "mars": 3, "avril": 4, "mai": 5, "juin": 6, "juillet": 7,
+    "aout": 8, "août": 8, "septembre": 9, "octobre": 10, "novembre": 11, "decembre": 12, "décembre": 12,
+}
+_ISO_DATE_RE = re.compile(r"^\s*(\d{4})(?:-(\d{1,2})(?:-(\d{1,2}))?)?")
+_MONTH_YEAR_RE = re.compile(r"^\s*(?:\d{1,2}(?:er)?\s+)?([a-zéû]+)\s+(\d{4})", re.IGNORECASE)
+
+
+def parse_date_range(value):
+    """
+    Parses a date of any precision into the range of days it covers.
+
+    Parameters:
+    - value (str | datetime.date): "2024", "2024-09", "2024-09-12", "septembre 2024",
+      "12 septembre 2024" or a date.
+
+    Returns:
+    - tuple | None: (first day, last day) as proleptic ordinals, or None if the value is not a date.
+    """
+    if isinstance(value, datetime.date):
+        return value.toordinal(), value.toordinal()
+    if not isinstance(value, str):
+        return None
+    year = month = day = None
+    match = _ISO_DATE_RE.match(value)
+    if match:
+        year, month, day = (int(group) if group else None for group in match.groups())
+    else:
+        match = _MONTH_YEAR_RE.match(value)
+        if not match or match.group(1).lower() not in _FRENCH_MONTHS:
+            return None
+        year, month = int(match.group(2)), _FRENCH_MONTHS[match.group(1).lower()]
+    try:
+        if day is not None:
+            date = datetime.date(year, month, day).toordinal()
+            return date, date
+        if month is not None:
+            return (datetime.date(year, month, 1).toordinal(),
+                    datetime.date(year, month, calendar.monthrange(year, month)[1]).toordinal())
+        return datetime.date(year, 1, 1).toordinal(), datetime.date(year, 12, 31).toordinal()
+    except ValueError:
+        return None
+
+
+def _as_list(values):
+    if values is None:
+        return []
+    if isinstance(values, str):
+        return [values]
+    return list(values)
+
+
+def normalize_filters(filters):
+    """
+    Validates filters and returns them in a canonical, hashable form (None when empty),
+    suitable as a cache key.
+    """
+    if not filters:
+        return None
+    unknown = set(filters) - set(FILTER_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown filters {sorted(unknown)}. Expected some of {FILTER_KEYS}.")
+    normalized = []
+    for key in FILTER_KEYS:
+        value = filters.get(key)
+        if key in ("date_from", "date_to"):
+            if value is None or value == "":
+                continue
+            date_range = parse_date_range(value)
+            if date_range is None:
+                raise ValueError(f"Invalid date for '{key}': {value!r}")
+            normalized.append((key, date_range[0] if key == "date_from" else date_range[1]))
+        else:
+            values = tuple(sorted({str(item).casefold() for item in _as_list(value) if str(item).strip()}))
+            if values:
+                normalized.append((key, values))
+    return tuple(normalized) or None
+
+
+def matches(metadata, filters):
+    """
+    Whether a chunk's metadata satisfies filters. Same semantics as MetadataIndex.select, for
+    searches that filter documents one by one (LangChain's `filter` argument).
+    """
+    filters = dict(normalize_filters(filters) or ())
+    if "date_from" in filters or "date_to" in filters:
+        date_range = parse_date_range(metadata.get("date"))
+        if date_range is None:
+            return False
+        if date_range[1] < filters.get("date_from", date_range[1]) \
+                or date_range[0] > filters.get("date_to", date_range[0]):
+            return False
+    if "sources" in filters and str(metadata.get("source", "")).casefold() not in filters["sources"]:
+        return False
+    if "titles" in filters:
+        title = str(metadata.get("title", "")).casefold()
+        if not any(wanted in title for wanted in filters["titles"]):
+            return False
+    return True
+
+
+class MetadataIndex:
+    """
+    Date, source and title columns of the chunks of a vector store, aligned with their FAISS labels.
+    """
+
+    def __init__(self):
+        self.doc_ids = np.empty(0, dtype=str)
+        self.labels = np.empty(0, dtype=np.int64)
+        self.date_start = np.empty(0, dtype=np.int32)
+        self.date_end = np.empty(0, dtype=np.int32)
+        self.source_codes = np.empty(0, dtype=np.int32)
+        self.title_codes = np.empty(0, dtype=np.int32)
+        self.sources = []  # code -> source
+        self.titles = []   # code -> title
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def add(self, ids, labels, metadatas):
+        """
+        Indexes chunks.
+
+        Parameters:
+        - ids (List[str]): Docstore ids.
+        - labels (List[int]): FAISS labels, one per id.
+        - metadatas (List[dict]): Chunk metadata, one per id.
+        """
+        if not len(ids):
+            return
+        date_ranges = [parse_date_range(metadata.get("date")) or (UNKNOWN_DATE, UNKNOWN_DATE)
+                       for metadata in metadatas]
+        source_index = {source: code for code, source in enumerate(self.sources)}
+        title_index = {title: code for code, title in enumerate(self.titles)}
+        source_codes = [source_index.setdefault(str(metadata.get("source", "")), len(source_index))
+                        for metadata in metadatas]
+        title_codes = [title_index.setdefault(str(metadata.get("title", "")), len(title_index))
+                       for metadata in metadatas]
+        self.sources = sorted(source_index, key=source_index.get)
+        self.titles = sorted(title_index, key=title_index.get)
+
+        self.doc_ids = np.concatenate([self.doc_ids, np.asarray(ids, dtype=str)])
+        self.labels = np.concatenate([self.labels, np.asarray(labels, dtype=np.int64)])
+        self.date_start = np.concatenate([self.date_start, np.asarray([r[0] for r in date_ranges], dtype=np.int32)])
+        self.date_end = np.concatenate([self.date_end, np.asarray([r[1] for r in date_ranges], dtype=np.int32)])
+        self.source_codes = np.concatenate([self.source_codes, np.asarray(source_codes, dtype=np.int32)])
+        self.title_codes = np.concatenate([self.title_codes, np.asarray(title_codes, dtype=np.int32)])
+
+    def indexed_sources(self):
+        """
+        Returns the sources of the indexed chunks, sorted (removed documents excluded).
+        """
+        return sorted(self.sources[code] for code in np.unique(self.source_codes))
+
+    def _keep(self, keep):
+        for column in ("doc_ids", "labels", "date_start", "date_end", "source_codes", "title_codes"):
+            setattr(self, column, getattr(self, column)[keep])
+
+    def remove(self, ids):
+        """
+        Removes chunks from the index. Unknown ids are ignored.
+        """
+        ids = list(ids)
+        if ids and len(self):
+            self._keep(~np.isin(self.doc_ids, np.asarray(ids, dtype=str)))
+
+    def relabel(self, index_to_docstore_id):
+        """
+        Updates the labels after the FAISS index renumbered its vectors (removal from a flat
+        index, rebuild). Chunks that are no longer in the mapping are dropped.
+        """
+        label_of = {doc_id: label for label, doc_id in index_to_docstore_id.items()}
+        labels = np.asarray([label_of.get(doc_id, -1) for doc_id in self.doc_ids.tolist()], dtype=np.int64)
+        self.labels = labels
+        if (labels < 0).any():
+            self._keep(labels >= 0)
+
+    @staticmethod
+    def _vocabulary_mask(vocabulary, wanted, substring):
+        # Vocabularies hold one entry per distinct source or title: matched once, then broadcast to the chunks
+        if substring:
+            return np.asarray([any(value in entry.casefold() for value in wanted) for entry in vocabulary], dtype=bool)
+        return np.asarray([entry.casefold() in wanted for entry in vocabulary], dtype=bool)
+
+    def select(self, filters):
+        """
+        Resolves filters into the chunks they allow.
+
+        Parameters:
+        - filters (dict): See the module docstring.
+
+        Returns:
+        - tuple: (labels, docstore ids) of the matching chunks, as NumPy arrays.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for key, value in normalize_filters(filters) or ():
+            if key == "date_from":
+                mask &= (self.date_end >= value) & (self.date_start != UNKNOWN_DATE)
+            elif key == "date_to":
+                mask &= (self.date_start <= value) & (self.date_start != UNKNOWN_DATE)
+            elif key == "sources":
+                mask &= self._vocabulary_mask(self.sources, value, substring=False)[self.source_codes]
+            elif key == "titles":
+                mask &= self._vocabulary_mask(self.titles, value, substring=True)[self.title_codes]
+        return self.labels[mask], self.doc_ids[mask]
+
+    @classmethod
+    def from_store(cls, docstore_items, index_to_docstore_id):
+        """
+        Builds an index from (docstore id, Document) pairs and the FAISS label mapping.
+        """
+        label_of = {doc_id: label for label, doc_id in index_to_docstore_id.items()}
+        items = [(doc_id, doc) for doc_id, doc in docstore_items if doc_id in label_of]
+        index = cls()
+        index.add([doc_id for doc_id, _ in items], [label_of[doc_id] for doc_id, _ in items],
+                  [doc.metadata for _, doc in items])
+        return index
+
+    def save(self, path):
+        """
+        Writes the index to a NumPy archive.
+        """
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                format=np.array(METADATA_INDEX_FORMAT),
+                doc_ids=self.doc_ids,
+                labels=self.labels,
+                date_start=self.date_start,
+                date_end=self.date_end,
+                source_codes=self.source_codes,
+                title_codes=self.title_codes,
+                sources=np.array(self.sources, dtype=str),
+                titles=np.array(self.titles, dtype=str),
+            )
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads an index written by `save`.
+        """
+        with np.load(path, allow_pickle=False) as archive:
+            if int(archive["format"]) != METADATA_INDEX_FORMAT:
+                raise ValueError(f"Unsupported metadata index format in {path}: {int(archive['format'])}")
+            index = cls()
+            for column in ("doc_ids", "labels", "date_start", "date_end", "source_codes", "title_codes"):
+                setattr(index, column, archive[column])
+            index.sources = archive["sources"].tolist()
+            index.titles = archive["titles"].tolist()
+        return index
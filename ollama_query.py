@@ -1,35 +1,513 @@
 
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+
 import requests
 import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from tracing import start_span
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OLLAMA_URL = "http://localhost:11434"
+DEFAULT_MODEL = "llama3.2"
+CONNECT_TIMEOUT = 5        # secondes pour établir la connexion
+READ_TIMEOUT = 300         # secondes sans aucune donnée reçue (chargement du modèle compris)
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.5       # attentes de 0.5s, 1s, 2s... entre les tentatives
+MAX_CONCURRENCY = 4        # requêtes simultanées vers Ollama, par processus
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+METRICS_HISTORY = 1000
+# Garder le modèle chargé entre les questions, et un contexte de même taille pour tous les appels :
+# Ollama recharge le modèle quand num_ctx change, et ne réutilise le cache KV du préfixe commun
+# des prompts (message système) que si le modèle reste en mémoire
+DEFAULT_KEEP_ALIVE = "30m"
+DEFAULT_NUM_CTX = 4096
+
+
+class _OllamaMetrics:
+    """
+    Construction des requêtes, enregistrement et résumé des métriques d'appel, communs aux clients
+    synchrone et asynchrone (pour ce dernier, `stream` et `chat_stream` renvoient des générateurs
+    asynchrones).
+    """
+
+    def _record(self, stats, final_chunk, generate_span, total_time, record_metrics=True):
+        """
+        Complète les métriques d'un appel avec les compteurs renvoyés par Ollama dans son dernier
+        message (durées en nanosecondes) :
+        - total_time (s): latence mesurée côté client.
+        - eval_count / eval_duration (s): tokens générés et durée de génération.
+        - prompt_eval_count / prompt_eval_duration (s): tokens du prompt et durée de leur traitement.
+        - load_duration (s): temps de chargement du modèle.
+        - tokens_per_second: débit de génération.
+        - cancelled: présent (True) si le consommateur a abandonné le flux avant la fin.
+
+        Quand le début du prompt est déjà dans le cache KV d'Ollama, prompt_eval_count ne compte
+        que les tokens évalués au-delà du préfixe réutilisé.
+
+        Avec `record_metrics=False` (préchargement du modèle), l'appel n'entre pas dans metrics_summary.
+        """
+        stats["total_time"] = total_time
+        for key in ("eval_count", "prompt_eval_count"):
+            if key in final_chunk:
+                stats[key] = final_chunk[key]
+        for key in ("eval_duration", "prompt_eval_duration", "load_duration"):
+            if key in final_chunk:
+                stats[key] = final_chunk[key] / 1e9
+        if stats.get("eval_count") and stats.get("eval_duration"):
+            stats["tokens"] = stats["eval_count"]
+            stats["tokens_per_second"] = stats["eval_count"] / stats["eval_duration"]
+        if record_metrics:
+            self.metrics.append(dict(stats))
+        generate_span.set(**{key: value for key, value in stats.items() if value is not None})
+        generate_span.end(duration=total_time)
+        if stats["time_to_first_token"] is not None:
+            logger.info(f"Ollama : premier token en {stats['time_to_first_token']:.2f}s, "
+                        f"{stats['tokens']} tokens en {stats['total_time']:.2f}s")
+
+    def metrics_summary(self):
+        """
+        Résume les métriques des derniers appels.
+
+        Returns:
+        - dict: Nombre d'appels, latence moyenne et maximale (s), temps moyen jusqu'au premier
+          token (s), tokens générés et débit moyen (tokens/s), tokens de prompt évalués et durée
+          moyenne de leur évaluation (s).
+        """
+        calls = list(self.metrics)
+        if not calls:
+            return {"calls": 0}
+        first_tokens = [call["time_to_first_token"] for call in calls if call["time_to_first_token"] is not None]
+        eval_count = sum(call.get("eval_count", 0) for call in calls)
+        eval_duration = sum(call.get("eval_duration", 0) for call in calls)
+        prefills = [call["prompt_eval_duration"] for call in calls if "prompt_eval_duration" in call]
+        return {
+            "calls": len(calls),
+            "mean_latency": sum(call["total_time"] for call in calls) / len(calls),
+            "max_latency": max(call["total_time"] for call in calls),
+            "mean_time_to_first_token": sum(first_tokens) / len(first_tokens) if first_tokens else None,
+            "eval_count": eval_count,
+            "tokens_per_second": eval_count / eval_duration if eval_duration else None,
+            "prompt_eval_count": sum(call.get("prompt_eval_count", 0) for call in calls),
+            "mean_prompt_eval_duration": sum(prefills) / len(prefills) if prefills else None,
+        }
+
+    def _request(self, payload, model, options, keep_alive):
+        # Les options de l'appel complètent celles du client : num_ctx reste le même d'un appel à l'autre
+        return {
+            "model": model or self.model,
+            **payload,
+            "options": {**self.options, **(options or {})},
+            "keep_alive": keep_alive if keep_alive is not None else self.keep_alive,
+        }
 
-def ollama_query(prompt, model="llama3.2", api_url="http://localhost:11434/api/generate"):
+    def stream(self, prompt, model=None, options=None, stats=None, keep_alive=None):
+        """
+        Génère une réponse et la produit token par token, au fil de la génération (API /api/generate).
+
+        Parameters:
+        - prompt (str): La question ou la commande à exécuter.
+        - model (str, optional): Modèle à utiliser (par défaut, celui du client).
+        - options (dict, optional): Options de génération Ollama, ajoutées à celles du client
+          (température 0, num_ctx).
+        - stats (dict, optional): Complété avec les métriques de l'appel (voir `_record`).
+        - keep_alive (str | int, optional): Durée de maintien du modèle en mémoire après l'appel.
+
+        Yields:
+        - str: Les fragments de la réponse, dès leur réception.
+        """
+        data = self._request({"prompt": prompt}, model, options, keep_alive)
+        return self._stream("/api/generate", data, stats, len(prompt))
+
+    def chat_stream(self, messages, model=None, options=None, stats=None, keep_alive=None):
+        """
+        Génère une réponse à une conversation et la produit token par token (API /api/chat).
+
+        Le modèle de chat d'Ollama place le message système en tête du prompt : s'il ne change pas
+        d'un appel à l'autre, Ollama reprend son cache KV et n'évalue que les messages suivants.
+
+        Parameters:
+        - messages (List[dict]): Messages {"role": "system" | "user" | "assistant", "content": str}.
+        - model, options, stats, keep_alive: voir `stream`.
+
+        Yields:
+        - str: Les fragments de la réponse, dès leur réception.
+        """
+        data = self._request({"messages": messages}, model, options, keep_alive)
+        return self._stream("/api/chat", data, stats, sum(len(message["content"]) for message in messages))
+
+
+def _chunk_text(chunk):
+    """
+    Retourne le texte d'une ligne de réponse d'Ollama (/api/generate ou /api/chat).
+    """
+    if "message" in chunk:
+        return chunk["message"].get("content", "")
+    return chunk.get("response", "")
+
+
+def _parse_line(line):
+    """
+    Décode une ligne NDJSON d'Ollama et lève une erreur si le serveur en signale une.
+    """
+    chunk = json.loads(line)
+    if "error" in chunk:
+        raise RuntimeError(f"Erreur renvoyée par Ollama : {chunk['error']}")
+    return chunk
+
+
+class OllamaClient(_OllamaMetrics):
+    """
+    Client HTTP réutilisable pour l'API REST d'Ollama.
+
+    - Les connexions sont gardées ouvertes (keep-alive) dans un pool partagé par les appels.
+    - Chaque requête a un délai de connexion et un délai de lecture : une requête bloquée
+      échoue au lieu de figer tout un lot.
+    - Les erreurs de connexion et les statuts 429/5xx sont retentés un nombre limité de fois,
+      avec une attente croissante.
+    - Le nombre de requêtes simultanées est plafonné, pour ne pas saturer le serveur.
+    - Chaque appel enregistre ses métriques (latence, temps jusqu'au premier token, et
+      `eval_count`/`eval_duration` renvoyés par Ollama).
+    """
+
+    def __init__(self, base_url=DEFAULT_OLLAMA_URL, model=DEFAULT_MODEL, connect_timeout=CONNECT_TIMEOUT,
+                 read_timeout=READ_TIMEOUT, max_retries=MAX_RETRIES, backoff_factor=BACKOFF_FACTOR,
+                 max_concurrency=MAX_CONCURRENCY, keep_alive=DEFAULT_KEEP_ALIVE, num_ctx=DEFAULT_NUM_CTX):
+        """
+        Parameters:
+        - base_url (str): URL du serveur Ollama.
+        - model (str): Modèle utilisé par défaut.
+        - connect_timeout (float): Délai d'établissement de la connexion, en secondes.
+        - read_timeout (float): Délai maximal sans donnée reçue, en secondes.
+        - max_retries (int): Nombre maximal de nouvelles tentatives.
+        - backoff_factor (float): Facteur de l'attente exponentielle entre les tentatives.
+        - max_concurrency (int): Nombre maximal de requêtes simultanées.
+        - keep_alive (str | int): Durée de maintien du modèle en mémoire après chaque appel
+          ("30m", secondes, -1 pour toujours).
+        - num_ctx (int): Taille du contexte du modèle, en tokens, identique pour tous les appels.
+        """
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.keep_alive = keep_alive
+        self.options = {"temperature": 0, "num_ctx": num_ctx}
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_concurrency = max_concurrency
+        self.metrics = deque(maxlen=METRICS_HISTORY)
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+
+        retry = Retry(total=max_retries, connect=max_retries, read=max_retries, status=max_retries,
+                      backoff_factor=backoff_factor, status_forcelist=RETRY_STATUSES,
+                      allowed_methods=frozenset({"POST"}), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency, max_retries=retry)
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json"})
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _stream(self, endpoint, data, stats, prompt_bytes, span_name="generate", record_metrics=True):
+        stats = stats if stats is not None else {}
+        start_time = time.perf_counter()
+        stats.update(model=data["model"], time_to_first_token=None, total_time=None, tokens=0)
+        generate_span = start_span(span_name, model=data["model"], prompt_bytes=prompt_bytes)
+        final_chunk = {}
+        try:
+            with self._semaphore:
+                try:
+                    with self.session.post(f"{self.base_url}{endpoint}", json=data, timeout=self.timeout,
+                                           stream=True) as response:
+                        response.raise_for_status()  # Lève une exception si le statut HTTP est une erreur
+                        # Ollama envoie un objet JSON par ligne (NDJSON) : chaque ligne est décodée dès son arrivée
+                        for line in response.iter_lines():
+                            if not line:
+                                continue
+                            chunk = _parse_line(line)
+                            token = _chunk_text(chunk)
+                            if token:
+                                if stats["time_to_first_token"] is None:
+                                    stats["time_to_first_token"] = time.perf_counter() - start_time
+                                stats["tokens"] += 1
+                                yield token
+                            if chunk.get("done"):
+                                final_chunk = chunk
+                                break
+                except requests.exceptions.RequestException as e:
+                    raise RuntimeError(f"Erreur lors de la requête à Ollama : {e}")
+        except Exception as e:
+            generate_span.end(error=f"{type(e).__name__}: {e}")
+            raise
+        except BaseException:
+            # Abandoned by the consumer (generator closed or collected, Ctrl-C, Streamlit rerun):
+            # the partial generation is still recorded
+            stats["cancelled"] = True
+            self._record(stats, final_chunk, generate_span, time.perf_counter() - start_time,
+                         record_metrics=record_metrics)
+            raise
+        self._record(stats, final_chunk, generate_span, time.perf_counter() - start_time,
+                     record_metrics=record_metrics)
+
+    def generate(self, prompt, model=None, options=None, stats=None):
+        """
+        Génère une réponse complète.
+
+        Returns:
+        - str: La réponse générée, sans espaces superflus.
+        """
+        return "".join(self.stream(prompt, model=model, options=options, stats=stats)).strip()
+
+    def chat(self, messages, model=None, options=None, stats=None):
+        """
+        Génère une réponse complète à une conversation (voir `chat_stream`).
+
+        Returns:
+        - str: La réponse générée, sans espaces superflus.
+        """
+        return "".join(self.chat_stream(messages, model=model, options=options, stats=stats)).strip()
+
+    def warm_up(self, system=None, model=None):
+        """
+        Charge le modèle avant la première question et, avec `system`, évalue le message système
+        une première fois pour que les questions suivantes reprennent son cache KV.
+
+        Parameters:
+        - system (str, optional): Message système des futures conversations.
+        - model (str, optional): Modèle à charger (par défaut, celui du client).
+
+        Returns:
+        - dict: Les métriques de l'appel (load_duration, prompt_eval_duration...).
+        """
+        stats = {}
+        messages = [{"role": "system", "content": system}] if system else []
+        data = self._request({"messages": messages}, model, {"num_predict": 1}, None)
+        for _ in self._stream("/api/chat", data, stats, len(system or ""), span_name="llm_warm_up",
+                              record_metrics=False):
+            pass
+        return stats
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncOllamaClient(_OllamaMetrics):
+    """
+    Variante asyncio d'OllamaClient (httpx.AsyncClient), pour garder de nombreuses questions en
+    vol depuis un seul thread. Le sémaphore limite le nombre de générations simultanées : on le
+    règle sur la capacité parallèle du serveur (OLLAMA_NUM_PARALLEL).
+
+    Le client est lié à la boucle asyncio qui l'utilise : il s'emploie avec `async with`.
+    """
+
+    def __init__(self, base_url=DEFAULT_OLLAMA_URL, model=DEFAULT_MODEL, connect_timeout=CONNECT_TIMEOUT,
+                 read_timeout=READ_TIMEOUT, max_retries=MAX_RETRIES, backoff_factor=BACKOFF_FACTOR,
+                 max_concurrency=MAX_CONCURRENCY, keep_alive=DEFAULT_KEEP_ALIVE, num_ctx=DEFAULT_NUM_CTX):
+        """
+        Parameters: voir OllamaClient.
+        """
+        import httpx
+
+        self._httpx = httpx
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.keep_alive = keep_alive
+        self.options = {"temperature": 0, "num_ctx": num_ctx}
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_concurrency = max_concurrency
+        self.metrics = deque(maxlen=METRICS_HISTORY)
+        self._semaphore = asyncio.BoundedSemaphore(max_concurrency)
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def _stream(self, endpoint, data, stats, prompt_bytes):
+        # Générateur asynchrone : les erreurs de connexion et les statuts 429/5xx sont retentés
+        # tant qu'aucun token n'a été produit, avec une attente exponentielle
+        stats = stats if stats is not None else {}
+        start_time = time.perf_counter()
+        stats.update(model=data["model"], time_to_first_token=None, total_time=None, tokens=0)
+        generate_span = start_span("generate", model=data["model"], prompt_bytes=prompt_bytes)
+        final_chunk = {}
+        try:
+            async with self._semaphore:
+                for attempt in range(self.max_retries + 1):
+                    try:
+                        async with self.client.stream("POST", endpoint, json=data) as response:
+                            if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                                raise _RetryableStatus(response.status_code)
+                            response.raise_for_status()
+                            async for line in response.aiter_lines():
+                                if not line:
+                                    continue
+                                chunk = _parse_line(line)
+                                token = _chunk_text(chunk)
+                                if token:
+                                    if stats["time_to_first_token"] is None:
+                                        stats["time_to_first_token"] = time.perf_counter() - start_time
+                                    stats["tokens"] += 1
+                                    yield token
+                                if chunk.get("done"):
+                                    final_chunk = chunk
+                                    break
+                        break
+                    except (_RetryableStatus, self._httpx.TransportError) as e:
+                        if stats["tokens"] or attempt >= self.max_retries:
+                            raise RuntimeError(f"Erreur lors de la requête à Ollama : {e}")
+                        await asyncio.sleep(self.backoff_factor * 2 ** attempt)
+                    except self._httpx.HTTPError as e:
+                        raise RuntimeError(f"Erreur lors de la requête à Ollama : {e}")
+        except Exception as e:
+            generate_span.end(error=f"{type(e).__name__}: {e}")
+            raise
+        except BaseException:
+            # Abandoned by the consumer (generator closed, task cancelled): the partial generation is still recorded
+            stats["cancelled"] = True
+            self._record(stats, final_chunk, generate_span, time.perf_counter() - start_time)
+            raise
+        self._record(stats, final_chunk, generate_span, time.perf_counter() - start_time)
+
+    async def generate(self, prompt, model=None, options=None, stats=None):
+        """
+        Génère une réponse complète.
+
+        Returns:
+        - str: La réponse générée, sans espaces superflus.
+        """
+        tokens = [token async for token in self.stream(prompt, model=model, options=options, stats=stats)]
+        return "".join(tokens).strip()
+
+    async def chat(self, messages, model=None, options=None, stats=None):
+        """
+        Génère une réponse complète à une conversation.
+
+        Returns:
+        - str: La réponse générée, sans espaces superflus.
+        """
+        tokens = [token async for token in self.chat_stream(messages, model=model, options=options, stats=stats)]
+        return "".join(tokens).strip()
+
+
+class _RetryableStatus(Exception):
+    """
+    Statut HTTP transitoire (429/5xx) renvoyé par Ollama.
+    """
+
+    def __init__(self, status_code):
+        super().__init__(f"statut HTTP {status_code}")
+        self.status_code = status_code
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(base_url=None):
+    """
+    Retourne le client partagé pour un serveur Ollama (un par processus : les workers
+    d'extraction ne réutilisent pas les connexions du processus parent).
+
+    Parameters:
+    - base_url (str, optional): URL du serveur. Par défaut, la variable d'environnement
+      OLLAMA_HOST ou http://localhost:11434.
+
+    Returns:
+    - OllamaClient: Le client.
+    """
+    base_url = (base_url or os.environ.get("OLLAMA_HOST") or DEFAULT_OLLAMA_URL).rstrip("/")
+    if not base_url.startswith(("http://", "https://")):
+        base_url = f"http://{base_url}"
+    key = (os.getpid(), base_url)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = OllamaClient(base_url)
+        return _clients[key]
+
+
+def _base_url(api_url):
+    return api_url.split("/api/")[0] if api_url else None
+
+
+def ollama_stream(prompt, model=DEFAULT_MODEL, api_url=None, stats=None):
+    """
+    Interroge Ollama via une API REST locale et produit la réponse token par token, au fil de
+    la génération.
+
+    Parameters:
+    - prompt: La question ou la commande à exécuter.
+    - model: Le modèle Ollama à utiliser (par défaut : "llama3.2").
+    - api_url: L'URL de l'API Ollama (par défaut : celle du client partagé, voir get_client).
+    - stats (dict, optional): Dictionnaire complété avec `time_to_first_token` et `total_time`
+      (en secondes), `tokens` et les compteurs d'Ollama (`eval_count`, `eval_duration`...).
+
+    Yields:
+    - str: Les fragments de la réponse, dès leur réception.
+    """
+    return get_client(_base_url(api_url)).stream(prompt, model=model, stats=stats)
+
+
+def ollama_query(prompt, model=DEFAULT_MODEL, api_url=None, stats=None):
     """
     Interroge Ollama via une API REST locale.
-    
+
     Parameters:
     - prompt: La question ou la commande à exécuter.
     - model: Le modèle Ollama à utiliser (par défaut : "llama3.2").
-    - api_url: L'URL de l'API Ollama (par défaut : "http://localhost:11434/api/generate").
-    
+    - api_url: L'URL de l'API Ollama (par défaut : celle du client partagé, voir get_client).
+    - stats (dict, optional): Complété avec les métriques de l'appel.
+
     Returns:
     - La réponse générée par Ollama.
     """
-    headers = {
-        "Content-Type": "application/json"
-    }
-    data = {
-        "model": model,
-        "prompt": prompt,
-        "options": {"temperature": 0}
-    }
-    try:
-        response = requests.post(api_url, json=data, headers=headers)
-        response.raise_for_status()  # Lève une exception si le statut HTTP est une erreur
-        text = response.text.strip()
-        lines = text.split("\n")
-        tokens = list(map(lambda line: json.loads(line)["response"], lines))
-        formated = "".join(tokens)
-        answer = formated.strip()
-        return answer
-    except requests.exceptions.RequestException as e:
-        raise RuntimeError(f"Erreur lors de la requête à Ollama : {e}")
\ No newline at end of file
+    return get_client(_base_url(api_url)).generate(prompt, model=model, stats=stats)
+
+
+def ollama_chat_stream(messages, model=DEFAULT_MODEL, api_url=None, stats=None):
+    """
+    Interroge Ollama avec une conversation (API de chat) et produit la réponse token par token.
+
+    Parameters:
+    - messages (List[dict]): Messages {"role", "content"}, le message système en premier.
+    - model: Le modèle Ollama à utiliser (par défaut : "llama3.2").
+    - api_url: L'URL de l'API Ollama (par défaut : celle du client partagé, voir get_client).
+    - stats (dict, optional): Complété avec les métriques de l'appel (voir ollama_stream).
+
+    Yields:
+    - str: Les fragments de la réponse, dès leur réception.
+    """
+    return get_client(_base_url(api_url)).chat_stream(messages, model=model, stats=stats)
+
+
+def ollama_chat(messages, model=DEFAULT_MODEL, api_url=None, stats=None):
+    """
+    Interroge Ollama avec une conversation (API de chat).
+
+    Returns:
+    - str: La réponse générée par Ollama.
+    """
+    return get_client(_base_url(api_url)).chat(messages, model=model, stats=stats)
+
+
+def ollama_warm_up(system=None, model=DEFAULT_MODEL, api_url=None):
+    """
+    Charge le modèle et évalue le message système avant la première question (voir OllamaClient.warm_up).
+
+    Returns:
+    - dict: Les métriques de l'appel.
+    """
+    return get_client(_base_url(api_url)).warm_up(system=system, model=model)
@@ -1,3 +1,5 @@
 from .extract_txt import extract_content_from_txt
 from .extract_pdf import extract_content_from_pdf
-from .process_files import load_documents
+from .process_files import load_documents, iter_documents, list_supported_files, process_file
+from .parallel import extract_files, iter_extract_files, ExtractionResult, EXTRACTION_TIMEOUT
+from .cache import ExtractionCache, compute_file_hash, EXTRACTION_CACHE_DIRNAME
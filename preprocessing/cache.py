@@ -0,0 +1,127 @@
+import os
+import json
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+EXTRACTION_CACHE_DIRNAME = "extraction_cache"
+DEFAULT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+
+def compute_file_hash(file_path, block_size=1 << 20):
+    """
+    Calcule l'empreinte SHA-256 du contenu d'un fichier, lu par blocs.
+
+    Parameters:
+    - file_path (str): Chemin du fichier.
+    - block_size (int): Taille des blocs lus (en octets).
+
+    Returns:
+    - str: Empreinte hexadécimale.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    """
+    Cache disque des résultats d'extraction (dictionnaire `content` des extracteurs).
+
+    Chaque entrée est un fichier JSON nommé d'après l'empreinte du fichier source et la version
+    des extracteurs : un fichier inchangé n'est ni reparsé ni re-OCRisé, et changer la version
+    invalide toutes les entrées. La taille totale est plafonnée ; au-delà, les entrées les moins
+    récemment utilisées (date de modification, mise à jour à chaque lecture) sont supprimées.
+    """
+
+    def __init__(self, directory, version, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        """
+        Parameters:
+        - directory (str): Dossier du cache (créé si besoin).
+        - version (str | int): Version des extracteurs, incluse dans la clé.
+        - max_bytes (int): Taille maximale du cache, en octets.
+        """
+        self.directory = directory
+        self.version = str(version)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self.total_bytes = sum(entry.stat().st_size for entry in self._entries())
+
+    def _entries(self):
+        return [entry for entry in os.scandir(self.directory) if entry.name.endswith(".json")]
+
+    def key(self, file_path, file_hash=None):
+        """
+        Calcule la clé de cache d'un fichier : empreinte du contenu, extension et version.
+        L'empreinte n'est calculée que si elle n'est pas fournie (`file_hash`, voir compute_file_hash).
+        """
+        extension = file_path.split(".")[-1].lower()
+        return f"{file_hash or compute_file_hash(file_path)}-{extension}-v{self.version}"
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def contains(self, key):
+        """
+        Indique si une entrée existe pour une clé, sans la lire.
+        """
+        return os.path.exists(self._path(key))
+
+    def get(self, key):
+        """
+        Retourne le contenu mis en cache pour une clé, ou None.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                content = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        os.utime(path)  # Marque l'entrée comme récemment utilisée
+        self.hits += 1
+        return content
+
+    def put(self, key, content):
+        """
+        Enregistre un résultat d'extraction, puis applique le plafond de taille.
+        Les extractions en échec (erreurs sans aucun texte) ne sont pas mises en cache.
+        """
+        if content.get("errors") and not content.get("text"):
+            return
+        path = self._path(key)
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(content, f, ensure_ascii=False)
+            previous_size = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"Impossible de mettre en cache {key} : {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.total_bytes += os.path.getsize(path) - previous_size
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """
+        Supprime les entrées les moins récemment utilisées jusqu'à repasser sous le plafond.
+        """
+        entries = sorted(self._entries(), key=lambda entry: entry.stat().st_mtime)
+        self.total_bytes = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if self.total_bytes <= self.max_bytes:
+                break
+            size = entry.stat().st_size
+            try:
+                os.remove(entry.path)
+            except OSError:
+                continue
+            self.total_bytes -= size
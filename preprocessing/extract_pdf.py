@@ -1,10 +1,8 @@
-import io
 import logging
 
-import pytesseract
-from PIL import Image
 import fitz  # PyMuPDF
 
+from .ocr import ocr_pdf_images, DEFAULT_OCR_WORKERS
 
 from ollama_query import ollama_query # Fonction pour interroger Ollama
 
@@ -57,29 +55,29 @@ def infer_creation_date(text_content, filepath):
     return inferred_date
 
 
-def extract_content_from_pdf(file_path):
+def extract_content_from_pdf(file_path, ocr_workers=DEFAULT_OCR_WORKERS):
     """
     Extrait le contenu d'un fichier PDF, incluant :
     - Texte extrait des pages PDF.
-    - Texte extrait des images dans le PDF via OCR.
+    - Texte extrait des images dans le PDF via OCR (voir preprocessing.ocr pour les heuristiques).
     - Informations des métadonnées, y compris le titre et la date.
 
     Parameters:
     - file_path (str): Chemin vers le fichier PDF.
+    - ocr_workers (int): Nombre d'images OCRisées simultanément.
 
     Returns:
-    - dict: Contient le texte, les métadonnées, et les erreurs rencontrées.
+    - dict: Contient le texte, les métadonnées, les statistiques d'OCR et les erreurs rencontrées.
     """
-    content = {"text": "", "ocr_text": "", "metadata": {}, "errors": []}
+    content = {"text": "", "ocr_text": "", "metadata": {}, "stats": {}, "errors": []}
 
     try:
         # Charger le PDF avec PyMuPDF (fitz)
         doc = fitz.open(file_path)
 
         # Extraire le texte des pages
-        text_content = ""
-        for page in doc:
-            text_content += page.get_text()
+        page_texts = [page.get_text() for page in doc]
+        text_content = "".join(page_texts)
 
         content["text"] = text_content.strip()
 
@@ -89,7 +87,7 @@ def extract_content_from_pdf(file_path):
         content["metadata"] = metadata
 
         # Extraire et formater la date de création
-        page_1 = doc[0].get_text()
+        page_1 = page_texts[0] if page_texts else ""
         creation_date = extract_creation_date(page_1, metadata)
 
         # Ajout des valeurs calculées aux métadonnées
@@ -97,19 +95,9 @@ def extract_content_from_pdf(file_path):
         content["metadata"]["date"] = creation_date or "Date non définie"
 
         # Extraire les images et appliquer l'OCR
-        image_texts = []
-        for page_num, page in enumerate(doc):
-            for img_index, img in enumerate(page.get_images(full=True)):
-                try:
-                    xref = img[0]
-                    base_image = doc.extract_image(xref)
-                    image_bytes = base_image["image"]
-                    image = Image.open(io.BytesIO(image_bytes))
-                    ocr_text = pytesseract.image_to_string(image)
-                    image_texts.append(ocr_text)
-                except Exception as e:
-                    error_msg = f"Erreur lors de l'extraction d'une image à la page {page_num + 1}: {e}"
-                    content["errors"].append(error_msg)
+        image_texts, ocr_errors, ocr_stats = ocr_pdf_images(doc, page_texts, workers=ocr_workers)
+        content["errors"].extend(ocr_errors)
+        content["stats"] = {"pages": len(page_texts), **ocr_stats}
 
         content["ocr_text"] = "\n".join(image_texts)
 
@@ -0,0 +1,132 @@
+import io
+import os
+import math
+import time
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import pytesseract
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Seuils par défaut des heuristiques d'OCR
+MIN_IMAGE_SIDE = 64            # pixels : en dessous, icône ou puce
+MIN_IMAGE_PIXELS = 128 * 128   # surface minimale pour contenir du texte lisible
+MIN_IMAGE_ENTROPY = 2.0        # bits : image quasi uniforme (fond, filet, aplat)
+DENSE_PAGE_CHARS = 1500        # caractères : la couche texte de la page suffit
+DEFAULT_OCR_WORKERS = min(4, os.cpu_count() or 1)
+
+
+def image_entropy(image):
+    """
+    Calcule l'entropie de Shannon (en bits) de l'histogramme en niveaux de gris d'une image.
+
+    Parameters:
+    - image (PIL.Image.Image): Image à analyser.
+
+    Returns:
+    - float: Entropie entre 0 (image uniforme) et 8.
+    """
+    histogram = image.convert("L").histogram()
+    total = sum(histogram)
+    if not total:
+        return 0.0
+    return -sum((count / total) * math.log2(count / total) for count in histogram if count)
+
+
+def _ocr_image_bytes(image_bytes):
+    """
+    Applique Tesseract sur une image encodée.
+    """
+    return pytesseract.image_to_string(Image.open(io.BytesIO(image_bytes)))
+
+
+def ocr_pdf_images(doc, page_texts=None, workers=DEFAULT_OCR_WORKERS, min_side=MIN_IMAGE_SIDE,
+                   min_pixels=MIN_IMAGE_PIXELS, min_entropy=MIN_IMAGE_ENTROPY,
+                   dense_page_chars=DENSE_PAGE_CHARS):
+    """
+    Applique l'OCR aux images d'un PDF en évitant le travail inutile.
+
+    - Les pages dont la couche texte dépasse `dense_page_chars` caractères ne sont pas OCRisées.
+    - Chaque image n'est traitée qu'une fois, qu'elle soit répétée par référence (xref) ou par
+      contenu identique (logos, en-têtes répétés sur chaque page).
+    - Les images trop petites ou de trop faible entropie sont ignorées.
+    - Les images restantes sont OCRisées en parallèle ; Tesseract tourne dans un sous-processus,
+      un pool de threads suffit donc à occuper plusieurs cœurs.
+
+    Parameters:
+    - doc (fitz.Document): Document PDF ouvert.
+    - page_texts (List[str], optional): Texte déjà extrait de chaque page.
+    - workers (int): Nombre d'OCR simultanés.
+    - min_side (int): Largeur/hauteur minimale d'une image, en pixels.
+    - min_pixels (int): Surface minimale d'une image, en pixels.
+    - min_entropy (float): Entropie minimale de l'histogramme, en bits.
+    - dense_page_chars (int): Nombre de caractères au-delà duquel une page n'est pas OCRisée.
+
+    Returns:
+    - tuple:
+        - ocr_texts (List[str]): Textes OCR, dans l'ordre d'apparition des images.
+        - errors (List[str]): Erreurs rencontrées.
+        - stats (dict): Compteurs d'images (total, ocr, skipped, cached), de pages ignorées, et
+          durée de l'OCR en secondes (ocr_seconds).
+    """
+    start_time = time.perf_counter()
+    stats = {"images_total": 0, "images_ocr": 0, "images_skipped": 0, "images_cached": 0, "pages_skipped": 0}
+    errors = []
+    seen_xrefs = set()
+    seen_hashes = set()
+    to_ocr = []  # (page_num, image_bytes)
+
+    for page_num, page in enumerate(doc):
+        images = page.get_images(full=True)
+        stats["images_total"] += len(images)
+        page_text = page_texts[page_num] if page_texts is not None else page.get_text()
+        if len(page_text.strip()) >= dense_page_chars:
+            stats["pages_skipped"] += 1
+            stats["images_skipped"] += len(images)
+            continue
+
+        for img in images:
+            xref, width, height = img[0], img[2], img[3]
+            if xref in seen_xrefs:
+                stats["images_cached"] += 1
+                continue
+            seen_xrefs.add(xref)
+
+            if min(width, height) < min_side or width * height < min_pixels:
+                stats["images_skipped"] += 1
+                continue
+
+            try:
+                image_bytes = doc.extract_image(xref)["image"]
+                image_hash = hashlib.sha1(image_bytes).hexdigest()
+                if image_hash in seen_hashes:
+                    stats["images_cached"] += 1
+                    continue
+                seen_hashes.add(image_hash)
+
+                if image_entropy(Image.open(io.BytesIO(image_bytes))) < min_entropy:
+                    stats["images_skipped"] += 1
+                    continue
+            except Exception as e:
+                errors.append(f"Erreur lors de l'extraction d'une image à la page {page_num + 1}: {e}")
+                continue
+
+            to_ocr.append((page_num, image_bytes))
+
+    ocr_texts = []
+    if to_ocr:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = [executor.submit(_ocr_image_bytes, image_bytes) for _, image_bytes in to_ocr]
+            for (page_num, _), future in zip(to_ocr, futures):
+                try:
+                    ocr_texts.append(future.result())
+                    stats["images_ocr"] += 1
+                except Exception as e:
+                    errors.append(f"Erreur lors de l'OCR d'une image à la page {page_num + 1}: {e}")
+
+    stats["ocr_seconds"] = time.perf_counter() - start_time
+    logger.info(f"OCR : {stats}")
+    return ocr_texts, errors, stats
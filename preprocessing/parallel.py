@@ -0,0 +1,208 @@
+import os
+import time
+import multiprocessing
+from collections import deque
+from multiprocessing.connection import wait
+
+# Durée maximale d'extraction d'un fichier, en secondes : au-delà, le worker est arrêté et le
+# fichier marqué en erreur, sans bloquer le lot (timeout=None désactive cette limite)
+EXTRACTION_TIMEOUT = 600
+
+
+class ExtractionResult:
+    """
+    Résultat de l'extraction d'un fichier par le pool.
+
+    Attributes:
+    - index (int): Position du fichier dans la liste d'entrée.
+    - file_path (str): Chemin du fichier traité.
+    - content (dict | None): Dictionnaire retourné par l'extracteur, ou None en cas d'échec.
+    - error (str | None): Message d'erreur (exception, dépassement de délai ou crash du worker).
+    - duration (float): Durée de l'extraction en secondes.
+    """
+
+    def __init__(self, index, file_path, content=None, error=None, duration=0.0):
+        self.index = index
+        self.file_path = file_path
+        self.content = content
+        self.error = error
+        self.duration = duration
+
+    def __repr__(self):
+        status = "ok" if self.error is None else self.error
+        return f"ExtractionResult({self.file_path!r}, {self.duration:.2f}s, {status})"
+
+
+def pool_size(workers, count):
+    """
+    Nombre de processus effectivement lancés pour extraire `count` fichiers avec `workers`
+    (None : nombre de cœurs) ; 1 signifie une extraction dans le processus courant.
+    """
+    return max(1, min(workers or os.cpu_count() or 1, count))
+
+
+def _run_extraction(extract_fn, file_path):
+    """
+    Exécute l'extracteur sur un fichier et mesure sa durée.
+
+    Returns:
+    - tuple: (content, error, duration)
+    """
+    start = time.perf_counter()
+    try:
+        content, error = extract_fn(file_path), None
+    except Exception as e:
+        content, error = None, f"{type(e).__name__}: {e}"
+    return content, error, time.perf_counter() - start
+
+
+def _extraction_worker(conn, extract_fn):
+    """
+    Boucle d'un processus worker : reçoit des tâches (index, chemin) et renvoie leur résultat.
+    Un message None met fin au worker.
+    """
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        index, file_path = task
+        content, error, duration = _run_extraction(extract_fn, file_path)
+        conn.send((index, content, error, duration))
+    conn.close()
+
+
+class _Worker:
+    """
+    Processus worker et la tâche qui lui est actuellement confiée.
+    """
+
+    def __init__(self, ctx, extract_fn):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_extraction_worker, args=(child_conn, extract_fn), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.task = None
+        self.started = None
+
+    def assign(self, task):
+        self.task = task
+        self.started = time.perf_counter()
+        self.conn.send(task)
+
+    def release(self):
+        self.task = None
+        self.started = None
+
+    def stop(self, force=False):
+        if not force:
+            try:
+                self.conn.send(None)
+            except (OSError, BrokenPipeError):
+                force = True
+            else:
+                self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.conn.close()
+
+
+def iter_extract_files(file_paths, extract_fn, workers=None, timeout=EXTRACTION_TIMEOUT, max_pending=None):
+    """
+    Extrait le contenu d'une liste de fichiers, en parallèle sur plusieurs processus, et produit
+    les résultats au fil de l'eau dans l'ordre des fichiers.
+
+    Chaque fichier est traité par un worker dédié le temps de son extraction. Un fichier qui
+    dépasse `timeout` ou qui fait planter son worker (segfault de PyMuPDF/Tesseract, par exemple)
+    est marqué en erreur ; le worker est remplacé et le reste du lot continue.
+
+    Le pool ne prend pas plus de `max_pending` fichiers d'avance sur le consommateur : si celui-ci
+    (découpage, embedding) est plus lent, l'extraction attend au lieu d'accumuler les résultats.
+
+    Parameters:
+    - file_paths (Iterable[str]): Chemins des fichiers à extraire.
+    - extract_fn (Callable[[str], dict]): Fonction d'extraction, définie au niveau d'un module
+      pour pouvoir être transmise aux processus.
+    - workers (int, optional): Nombre de processus. Par défaut, le nombre de cœurs. Avec 1 worker,
+      l'extraction se fait dans un seul processus worker, ou dans le processus courant si
+      `timeout` est None.
+    - timeout (float, optional): Durée maximale d'extraction d'un fichier, en secondes
+      (None : pas de limite).
+    - max_pending (int, optional): Nombre maximal de fichiers extraits ou en cours d'extraction
+      non encore consommés. Par défaut, deux fois le nombre de workers.
+
+    Yields:
+    - ExtractionResult: Un résultat par fichier, dans l'ordre de `file_paths`.
+    """
+    file_paths = list(file_paths)
+    workers = pool_size(workers, len(file_paths))
+    if not file_paths:
+        return
+    if workers <= 1 and timeout is None:
+        for index, file_path in enumerate(file_paths):
+            content, error, duration = _run_extraction(extract_fn, file_path)
+            yield ExtractionResult(index, file_path, content, error, duration)
+        return
+
+    max_pending = max(max_pending or 2 * workers, workers)
+    ctx = multiprocessing.get_context()
+    done = {}  # index -> ExtractionResult, en attente d'être produit dans l'ordre
+    next_index = 0
+    pending = deque(enumerate(file_paths))
+    pool = [_Worker(ctx, extract_fn) for _ in range(workers)]
+
+    def replace(worker):
+        worker.stop(force=True)
+        pool[pool.index(worker)] = _Worker(ctx, extract_fn)
+
+    try:
+        while next_index < len(file_paths):
+            for worker in pool:
+                if worker.task is None and pending and pending[0][0] < next_index + max_pending:
+                    worker.assign(pending.popleft())
+
+            busy = {worker.conn: worker for worker in pool if worker.task}
+            for conn in wait(list(busy), timeout=0.5):
+                worker = busy[conn]
+                index, file_path = worker.task
+                try:
+                    _, content, error, duration = conn.recv()
+                    done[index] = ExtractionResult(index, file_path, content, error, duration)
+                    worker.release()
+                except (EOFError, OSError):
+                    duration = time.perf_counter() - worker.started
+                    worker.process.join(timeout=1)
+                    exitcode = worker.process.exitcode
+                    done[index] = ExtractionResult(index, file_path, error=f"Worker arrêté (code {exitcode})",
+                                                   duration=duration)
+                    replace(worker)
+
+            if timeout is not None:
+                now = time.perf_counter()
+                for worker in list(pool):
+                    if worker.task and now - worker.started > timeout:
+                        index, file_path = worker.task
+                        done[index] = ExtractionResult(index, file_path,
+                                                       error=f"Délai dépassé ({timeout}s)",
+                                                       duration=now - worker.started)
+                        replace(worker)
+
+            while next_index in done:
+                yield done.pop(next_index)
+                next_index += 1
+    finally:
+        for worker in pool:
+            worker.stop(force=worker.task is not None)
+
+
+def extract_files(file_paths, extract_fn, workers=None, timeout=EXTRACTION_TIMEOUT):
+    """
+    Version non incrémentale de iter_extract_files.
+
+    Returns:
+    - List[ExtractionResult]: Un résultat par fichier, dans l'ordre de `file_paths`.
+    """
+    return list(iter_extract_files(file_paths, extract_fn, workers=workers, timeout=timeout))
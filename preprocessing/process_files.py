@@ -1,13 +1,24 @@
 
 import os
+import logging
 import tempfile
+from functools import partial
 
 from langchain.schema import Document
 
+from tracing import record_span
+
 from .extract_pdf import extract_content_from_pdf
 from .extract_txt import extract_content_from_txt
+from .ocr import DEFAULT_OCR_WORKERS
+from .parallel import iter_extract_files, pool_size, ExtractionResult, EXTRACTION_TIMEOUT
+from .cache import ExtractionCache
+
+logger = logging.getLogger(__name__)
 
 
+# À incrémenter à chaque changement des extracteurs : invalide le cache d'extraction
+EXTRACTOR_VERSION = 2
 
 supported_extensions = {
     "pdf": extract_content_from_pdf,
@@ -24,84 +35,254 @@ supported_extensions = {
 def save_uploaded_file(uploaded_file):
     """
     Sauvegarde un fichier téléchargé dans un répertoire temporaire et retourne son chemin.
+    L'extension d'origine est conservée pour que l'extracteur puisse être choisi à partir du chemin.
     """
-    with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
+    suffix = os.path.splitext(uploaded_file.name)[1]
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
         tmp_file.write(uploaded_file.getbuffer())  # Sauvegarde le contenu du fichier téléchargé
         tmp_file_path = tmp_file.name
     return tmp_file_path
 
 
-def load_documents(source, is_directory=False):
+def resolve_file(file_path_or_obj, is_uploaded_file=False):
     """
-    Charge les documents depuis un dossier ou un fichier unique.
+    Retourne le chemin local et le nom d'affichage d'un fichier local ou uploadé.
+
+    Returns:
+    - tuple: (file_path, file_name)
+    """
+    if is_uploaded_file:
+        # Gérer les objets UploadedFile
+        file_path = save_uploaded_file(file_path_or_obj)  # Sauvegarde le fichier et retourne le chemin temporaire
+        file_name = file_path_or_obj.name
+    else:
+        # Gérer les fichiers locaux
+        file_path = file_path_or_obj  # Utilise directement le chemin du fichier local
+        file_name = os.path.basename(file_path)  # Extraire le nom du fichier local
+    return file_path, file_name
+
+
+def extract_file_content(file_path, ocr_workers=None):
+    """
+    Extrait le contenu d'un fichier avec l'extracteur correspondant à son extension.
 
     Parameters:
-    - source (str | List[UploadedFile]): Chemin du dossier, chemin d'un fichier unique, ou liste de fichiers uploadés.
-    - is_directory (bool): Indique si `source` est un dossier.
+    - file_path (str): Chemin du fichier.
+    - ocr_workers (int, optional): Nombre d'images OCRisées simultanément dans un PDF
+      (par défaut, DEFAULT_OCR_WORKERS).
 
     Returns:
-    - List[Document]: Liste d'objets Document contenant le texte extrait et les métadonnées.
+    - dict: Contenu retourné par l'extracteur (texte, métadonnées, erreurs).
+
+    Raises:
+    - ValueError: Si l'extension n'est pas prise en charge.
     """
-    # Liste pour stocker les documents extraits
-    documents = []
-
-    def process_file(file_path_or_obj, is_uploaded_file=False):
-        """
-        Traite un fichier donné (local ou UploadedFile Streamlit) : extrait le contenu et crée un objet Document.
-
-        Parameters:
-        - file_path_or_obj (str | UploadedFile): Chemin du fichier à traiter ou un objet UploadedFile.
-        - is_uploaded_file (bool): Indique si c'est un fichier Streamlit uploadé.
-
-        Returns:
-        - Document | None: L'objet Document créé, ou None en cas d'erreur ou si l'extension n'est pas supportée.
-        """
-        if is_uploaded_file:
-            # Gérer les objets UploadedFile
-            file_path = save_uploaded_file(file_path_or_obj)  # Sauvegarde le fichier et retourne le chemin temporaire
-            file_extension = file_path_or_obj.name.split(".")[-1].lower()
-            file_name = file_path_or_obj.name
-        else:
-            # Gérer les fichiers locaux
-            file_path = file_path_or_obj  # Utilise directement le chemin du fichier local
-            file_extension = file_path.split(".")[-1].lower()
-            file_name = os.path.basename(file_path)  # Extraire le nom du fichier local
-
-        # Obtenez l'extension du fichier
-
-        if file_extension in supported_extensions:
-            try:
-                # Utiliser l'extracteur approprié pour le fichier
-                extractor = supported_extensions[file_extension]
-                content = extractor(file_path)  # Passe le chemin temporaire ou local
-                return Document(
-                    page_content=content["text"],
-                    metadata={
-                        "source": file_name,
-                        "source_path": file_path,
-                        "title": content["metadata"].get("title", "Titre non défini"),
-                        "date": content["metadata"].get("date", "Date non définie"),
-                    },
-                )
-            except Exception as e:
-                print(f"Erreur lors du traitement du fichier {file_path}: {e}")
-        else:
-            print(f"Type de fichier non pris en charge : {file_path}")
-        return None
+    file_extension = file_path.split(".")[-1].lower()
+    if file_extension not in supported_extensions:
+        raise ValueError(f"Type de fichier non pris en charge : {file_path}")
+    extractor = supported_extensions[file_extension]
+    if ocr_workers is not None and extractor is extract_content_from_pdf:
+        return extractor(file_path, ocr_workers=ocr_workers)
+    return extractor(file_path)
+
+
+def ocr_workers_per_process(processes):
+    """
+    Nombre d'OCR simultanés de chaque processus d'extraction, quand `processes` extraient en
+    parallèle : chacun lance son propre pool de threads Tesseract, les cœurs sont donc partagés.
+    """
+    return max(1, min(DEFAULT_OCR_WORKERS, (os.cpu_count() or 1) // processes))
+
+
+def build_document(content, file_name, file_path):
+    """
+    Crée un objet Document à partir du contenu extrait d'un fichier.
+    """
+    return Document(
+        page_content=content["text"],
+        metadata={
+            "source": file_name,
+            "source_path": file_path,
+            "title": content["metadata"].get("title", "Titre non défini"),
+            "date": content["metadata"].get("date", "Date non définie"),
+        },
+    )
+
+
+def process_file(file_path_or_obj, is_uploaded_file=False):
+    """
+    Traite un fichier donné (local ou UploadedFile Streamlit) : extrait le contenu et crée un objet Document.
+
+    Parameters:
+    - file_path_or_obj (str | UploadedFile): Chemin du fichier à traiter ou un objet UploadedFile.
+    - is_uploaded_file (bool): Indique si c'est un fichier Streamlit uploadé.
+
+    Returns:
+    - Document | None: L'objet Document créé, ou None en cas d'erreur ou si l'extension n'est pas supportée.
+    """
+    file_path, file_name = resolve_file(file_path_or_obj, is_uploaded_file)
+
+    if is_supported_file(file_path):
+        try:
+            content = extract_file_content(file_path)  # Passe le chemin temporaire ou local
+            return build_document(content, file_name, file_path)
+        except Exception as e:
+            print(f"Erreur lors du traitement du fichier {file_path}: {e}")
+    else:
+        print(f"Type de fichier non pris en charge : {file_path}")
+    return None
+
+
+def is_supported_file(file_path):
+    """
+    Indique si l'extension du fichier correspond à un extracteur connu.
+    """
+    return file_path.split(".")[-1].lower() in supported_extensions
+
+
+def list_supported_files(directory):
+    """
+    Parcourt récursivement un dossier et retourne les chemins des fichiers pris en charge.
+
+    Parameters:
+    - directory (str): Chemin du dossier à parcourir.
+
+    Returns:
+    - List[str]: Chemins des fichiers supportés, triés pour un ordre stable.
+    """
+    file_paths = []
+    for root, _, files in os.walk(directory):
+        for file_name in files:
+            file_path = os.path.join(root, file_name)
+            if is_supported_file(file_path):
+                file_paths.append(file_path)
+    return sorted(file_paths)
+
+
+def record_extraction_spans(file_name, result, from_cache):
+    """
+    Enregistre les étapes d'extraction et d'OCR d'un fichier dans la trace. L'extraction a lieu
+    dans un processus worker : sa durée et ses compteurs sont repris du résultat.
+    """
+    content = result.content or {}
+    stats = content.get("stats") or {}
+    extract_span = record_span("extract", result.duration, file=file_name, from_cache=from_cache,
+                               bytes=len(content.get("text") or "") + len(content.get("ocr_text") or ""),
+                               pages=stats.get("pages", 0), images=stats.get("images_total", 0),
+                               error=result.error or "")
+    if "ocr_seconds" in stats and not from_cache:
+        record_span("ocr", stats["ocr_seconds"], file=file_name, images=stats.get("images_total", 0),
+                    images_ocr=stats.get("images_ocr", 0), images_skipped=stats.get("images_skipped", 0),
+                    images_cached=stats.get("images_cached", 0), pages_skipped=stats.get("pages_skipped", 0))
+    return extract_span
+
+
+def iter_documents(source, is_directory=False, workers=1, timeout=EXTRACTION_TIMEOUT, cache_dir=None,
+                   file_hashes=None):
+    """
+    Extrait les documents un par un, dans l'ordre des fichiers, au fur et à mesure de l'extraction.
+
+    L'extraction peut être répartie sur un pool de processus (`workers` > 1) : les fichiers sont
+    traités indépendamment, un fichier qui plante ou dépasse `timeout` est ignoré sans interrompre
+    le lot, et l'ordre des documents produits reste celui des fichiers d'entrée. Le pool ne prend
+    qu'une avance bornée sur le consommateur.
+
+    Avec `cache_dir`, le résultat de l'extraction est mis en cache sur disque, indexé par l'empreinte
+    du contenu du fichier et EXTRACTOR_VERSION : seuls les fichiers absents du cache sont extraits.
+
+    Parameters:
+    - source (str | List[str] | List[UploadedFile]): Chemin du dossier, chemin d'un fichier unique,
+      liste de chemins locaux ou liste de fichiers uploadés.
+    - is_directory (bool): Indique si `source` est un dossier.
+    - workers (int | None): Nombre de processus d'extraction (1 : séquentiel, None : nombre de cœurs).
+    - timeout (float, optional): Durée maximale d'extraction d'un fichier, en secondes. L'extraction
+      se fait alors dans des processus workers, même avec `workers` = 1 ; None pour extraire
+      dans le processus courant, sans limite.
+    - cache_dir (str, optional): Dossier du cache d'extraction.
+    - file_hashes (dict, optional): Empreintes déjà calculées (voir compute_file_hash), par chemin :
+      ces fichiers ne sont pas relus pour calculer leur clé de cache.
+
+    Yields:
+    - Document: Un objet Document par fichier extrait avec succès.
+    """
+    # Liste des fichiers à traiter : (chemin local, nom d'affichage)
+    files = []
 
     if is_directory:
         # Charger depuis un dossier
-        for root, _, files in os.walk(source):
-            for file_name in files:
-                file_path = os.path.join(root, file_name)
-                document = process_file(file_path, is_uploaded_file=False)
-                if document:
-                    documents.append(document)
+        for root, _, file_names in os.walk(source):
+            for file_name in file_names:
+                files.append((os.path.join(root, file_name), file_name))
     else:
-        # Charger depuis une liste de fichiers téléchargés
-        documents = [process_file(file_obj, is_uploaded_file=True) for file_obj in source]
+        # Charger depuis un chemin unique, une liste de chemins ou une liste de fichiers téléchargés
+        if isinstance(source, str):
+            source = [source]
+        for file_obj in source:
+            files.append(resolve_file(file_obj, is_uploaded_file=not isinstance(file_obj, str)))
+
+    supported_files = []
+    for file_path, file_name in files:
+        if is_supported_file(file_path):
+            supported_files.append((file_path, file_name))
+        else:
+            print(f"Type de fichier non pris en charge : {file_path}")
+
+    file_paths = [file_path for file_path, _ in supported_files]
+    cache = ExtractionCache(cache_dir, EXTRACTOR_VERSION) if cache_dir else None
+    file_hashes = file_hashes or {}
+    cache_keys = [cache.key(file_path, file_hashes.get(file_path)) for file_path in file_paths] if cache else []
+
+    # Seuls les fichiers absents du cache passent par le pool d'extraction
+    missing = [index for index in range(len(file_paths)) if not cache or not cache.contains(cache_keys[index])]
+    extract_fn = extract_file_content
+    processes = pool_size(workers, len(missing))
+    if processes > 1:
+        extract_fn = partial(extract_file_content, ocr_workers=ocr_workers_per_process(processes))
+    extracted = iter_extract_files([file_paths[index] for index in missing], extract_fn,
+                                   workers=workers, timeout=timeout)
+
+    extracted_count, total_duration = 0, 0.0
+    missing_set = set(missing)
+    for index, (file_path, file_name) in enumerate(supported_files):
+        from_cache = False
+        if index in missing_set:
+            result = next(extracted)
+        else:
+            content = cache.get(cache_keys[index])
+            if content is not None:
+                result, from_cache = ExtractionResult(index, file_path, content), True
+            else:
+                # Entrée évincée entre-temps : extraction directe
+                result = next(iter_extract_files([file_path], extract_file_content, workers=1))
+        if cache and not from_cache and result.error is None:
+            cache.put(cache_keys[index], result.content)
+
+        total_duration += result.duration
+        logger.info(f"Extraction de {file_path} en {result.duration:.2f}s")
+        record_extraction_spans(file_name, result, from_cache)
+        if result.error:
+            print(f"Erreur lors du traitement du fichier {file_path}: {result.error}")
+            continue
+        extracted_count += 1
+        yield build_document(result.content, file_name, file_path)
 
-    return documents
+    if cache:
+        logger.info(f"Cache d'extraction : {cache.hits} succès, {cache.misses} échecs")
+    logger.info(f"{extracted_count}/{len(file_paths)} fichiers extraits (temps cumulé : {total_duration:.2f}s)")
+
+
+def load_documents(source, is_directory=False, workers=1, timeout=EXTRACTION_TIMEOUT, cache_dir=None):
+    """
+    Charge les documents depuis un dossier ou un fichier unique.
+
+    Les paramètres sont ceux de iter_documents, qui permet de traiter les documents sans tous
+    les garder en mémoire.
+
+    Returns:
+    - List[Document]: Liste d'objets Document contenant le texte extrait et les métadonnées.
+    """
+    return list(iter_documents(source, is_directory=is_directory, workers=workers,
+                               timeout=timeout, cache_dir=cache_dir))
 
 
 def main():
@@ -0,0 +1,201 @@
+"""
+Caches for repeated questions.
+
+- Query embeddings, keyed by embedding model and normalized query text.
+- Top-k retrieval results, keyed by normalized query text, search type, k, metadata filters and
+  index version.
+
+Both caches are LRU with an optional TTL and are shared by the whole process, so they survive
+Streamlit reruns and the per-question retrieval chains. A retrieval result is only reused for the
+index version it was computed on: any rebuild or update of the index changes the version
+(see vector_store.index_version), and the entries of that store's previous version are dropped.
+Versions are unique per store, so several stores (the uploaded files and the folder, say) share
+the cache without evicting each other's entries.
+"""
+import re
+import time
+import weakref
+import threading
+import logging
+from collections import OrderedDict
+
+from vector_store import index_version, hybrid_search, filtered_similarity_search
+from metadata_index import normalize_filters, matches
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+QUERY_EMBEDDING_CACHE_SIZE = 1024
+RETRIEVAL_CACHE_SIZE = 256
+DEFAULT_TTL = None  # seconds; None keeps entries until evicted
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache with an optional time-to-live and hit/miss counters.
+    """
+
+    def __init__(self, max_entries, ttl=DEFAULT_TTL):
+        """
+        Parameters:
+        - max_entries (int): Number of entries kept before evicting the least recently used.
+        - ttl (float, optional): Lifetime of an entry in seconds.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (expiry, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[0] is None or entry[0] > time.monotonic()):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        expiry = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries[key] = (expiry, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, predicate):
+        """
+        Removes the entries whose key matches a predicate.
+        """
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """
+        Returns the hit/miss counters and the hit rate.
+        """
+        lookups = self.hits + self.misses
+        return {"entries": len(self), "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+query_embedding_cache = LRUCache(QUERY_EMBEDDING_CACHE_SIZE)
+retrieval_cache = LRUCache(RETRIEVAL_CACHE_SIZE)
+_store_versions = weakref.WeakKeyDictionary()  # vector store -> index version its entries were cached for
+_versions_lock = threading.Lock()
+
+
+def normalize_query(query):
+    """
+    Normalizes a question for use as a cache key: trimmed, case-folded, single spaces.
+    """
+    return re.sub(r"\s+", " ", query).strip().casefold()
+
+
+def cache_stats():
+    """
+    Returns the counters of both caches.
+    """
+    return {"query_embeddings": query_embedding_cache.stats(), "retrieval": retrieval_cache.stats()}
+
+
+def clear_caches():
+    query_embedding_cache.clear()
+    retrieval_cache.clear()
+
+
+def _model_key(embedding_function):
+    return getattr(embedding_function, "model_name", None) or id(embedding_function)
+
+
+def embed_query(embedding_function, query):
+    """
+    Embeds a question, reusing the vector of an identical earlier question.
+    """
+    key = (_model_key(embedding_function), normalize_query(query))
+    embedding = query_embedding_cache.get(key)
+    if embedding is None:
+        embedding = embedding_function.embed_query(query)
+        query_embedding_cache.put(key, embedding)
+    return embedding
+
+
+class CachedRetriever:
+    """
+    Drop-in replacement for `vector_store.as_retriever(...)` whose `invoke` goes through the caches.
+
+    Besides the LangChain search types, "hybrid" fuses FAISS and BM25 results
+    (see vector_store.hybrid_search). Metadata filters (see metadata_index) restrict every
+    search to a period or a set of documents.
+    """
+
+    def __init__(self, vector_store, search_type="similarity", search_kwargs=None, filters=None):
+        self.vector_store = vector_store
+        self.search_type = search_type
+        self.search_kwargs = dict(search_kwargs or {})
+        self.filters = filters
+        normalize_filters(filters)  # Invalid filters fail here rather than at the first question
+        self._retriever = None
+        if search_type not in ("similarity", "hybrid"):
+            self._retriever = vector_store.as_retriever(search_type=search_type, search_kwargs=self.search_kwargs)
+
+    def _search(self, query, filters):
+        if self._retriever is not None:
+            if not filters:
+                return self._retriever.invoke(query)
+            # LangChain filters the candidates of an unrestricted search one by one, on their metadata:
+            # all chunks are candidates, or a selective filter would leave fewer than k of them
+            search_kwargs = {**self.search_kwargs, "filter": lambda metadata: matches(metadata, filters),
+                             "fetch_k": self.vector_store.index.ntotal}
+            return self.vector_store.as_retriever(search_type=self.search_type,
+                                                  search_kwargs=search_kwargs).invoke(query)
+        embedding = embed_query(self.vector_store.embedding_function, query)
+        if self.search_type == "hybrid":
+            return hybrid_search(self.vector_store, query, embedding=embedding, filters=filters, **self.search_kwargs)
+        if filters:
+            return filtered_similarity_search(self.vector_store, embedding, filters=filters, **self.search_kwargs)
+        return self.vector_store.similarity_search_by_vector(embedding, **self.search_kwargs)
+
+    def invoke(self, query, filters=None):
+        """
+        Returns the documents relevant to a question.
+
+        Parameters:
+        - query (str): The question.
+        - filters (dict, optional): Metadata filters for this question, instead of the retriever's.
+
+        Returns:
+        - List[Document]: The retrieved documents.
+        """
+        filters = filters if filters is not None else self.filters
+        version = index_version(self.vector_store)
+        with _versions_lock:
+            previous = _store_versions.get(self.vector_store)
+            _store_versions[self.vector_store] = version
+        if previous is not None and previous != version:
+            # This store's index was rebuilt or updated: its results for the old version can no longer hit
+            retrieval_cache.discard(lambda key: key[0] == previous)
+        key = (version, self.search_type, repr(sorted(self.search_kwargs.items())), normalize_filters(filters),
+               normalize_query(query))
+        with span("retrieve", search_type=self.search_type, k=self.search_kwargs.get("k", 0)) as retrieve_span:
+            documents = retrieval_cache.get(key)
+            retrieve_span.set(cache_hit=documents is not None)
+            if documents is None:
+                documents = self._search(query, filters)
+                retrieval_cache.put(key, documents)
+            retrieve_span.set(results=len(documents))
+        logger.debug(f"Query caches: {cache_stats()}")
+        return list(documents)
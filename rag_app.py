@@ -4,16 +4,20 @@ import streamlit as st
 from rag_pipeline import (
     build_context_from_docs,
     normalize_path,
-    create_retrieval_qa_chain,
+    QueryEngine,
     get_initial_prompt,  # Import de la fonction pour gérer le contexte
 )
 from rag_test import load_questions_with_headers
-from vector_store import create_vector_store, load_vector_store
-from chunking import split_documents
-from preprocessing import load_documents
-import time
-
-# Classe Document pour garantir la compatibilité avec split_documents
+from vector_store import create_vector_store, load_vector_store, get_metadata_index
+from chunking import semantic_split_documents
+from preprocessing import load_documents, EXTRACTION_CACHE_DIRNAME
+from indexing import iter_update_vector_store
+from rag_cli import EXTRACTION_WORKERS, EXTRACTION_TIMEOUT
+from embedding_models import warm_up, DEFAULT_CROSS_ENCODER_MODEL
+from tracing import listening
+from answer_cache import AnswerCache, ANSWER_CACHE_FILENAME
+
+# Classe Document pour garantir la compatibilité avec semantic_split_documents
 class Document:
     def __init__(self, page_content, metadata):
         self.page_content = page_content
@@ -22,6 +26,15 @@ class Document:
 
 
 
+@st.cache_resource(show_spinner="Réveil des modèles d'embedding...")
+def load_embedding_models():
+    """
+    Charge et préchauffe les modèles d'embedding une seule fois pour tout le serveur Streamlit,
+    au lieu de les recharger à chaque rerun ou pour chaque session.
+    """
+    return warm_up(cross_encoder_model=DEFAULT_CROSS_ENCODER_MODEL)
+
+
 def main():
     # Chargement du banner et titre
     banner_path = str(Path('Images') / "Banniere_ragnar.webp")
@@ -31,6 +44,8 @@ def main():
     st.image(banner_rune_path, use_container_width=True)
     st.markdown("### Déposez vos parchemins ou chargez la base des runes existantes.", unsafe_allow_html=True)
 
+    load_embedding_models()
+
     # Initialisation des états
     if "documents" not in st.session_state:
         st.session_state.documents = []
@@ -38,6 +53,8 @@ def main():
         st.session_state.vector_store = None
     if "chat_history" not in st.session_state:
         st.session_state.chat_history = []
+    if "query_engine" not in st.session_state:
+        st.session_state.query_engine = None
 
     # Contexte interne
     context = """
@@ -82,41 +99,83 @@ def main():
         if folder_path:
             folder_path = normalize_path(folder_path)
 
-        if uploaded_files or folder_path:
+        if folder_path and not uploaded_files:
+            # Indexation incrémentale : seuls les fichiers nouveaux ou modifiés sont traités
+            with progress_placeholder.container():
+                st.markdown("### 🛠️ Forge en cours...")
+                progress_bar = st.progress(0)
+            try:
+                # La base est mise à jour lot par lot : la progression reflète les fichiers indexés
+                for vector_store, stats in iter_update_vector_store(
+                    folder_path, save_path=save_path,
+                    workers=EXTRACTION_WORKERS, timeout=EXTRACTION_TIMEOUT,
+                ):
+                    if stats["files_total"]:
+                        progress_bar.progress(int(100 * stats["files_done"] / stats["files_total"]))
+                st.session_state.vector_store = vector_store
+                progress_bar.progress(100)
+                st.success(
+                    "⚡ Les runes ont été gravées dans la pierre ! La base des connaissances est prête. "
+                    f"({stats['added']} ajoutés, {stats['changed']} modifiés, "
+                    f"{stats['removed']} supprimés, {stats['unchanged']} inchangés)"
+                )
+            except Exception as e:
+                st.error(f"Une erreur s'est produite lors de la création de nouvelles runes : {e}")
+                return
+            finally:
+                progress_placeholder.empty()
+
+        elif uploaded_files:
             try:
                 with progress_placeholder.container():
                     st.markdown("### 🛠️ Forge en cours...")
                     progress_bar = st.progress(0)
 
-                documents = load_documents(
-                    uploaded_files if uploaded_files else folder_path,
-                    is_directory=bool(folder_path),
-                )
+                # Chaque fichier extrait fait avancer la barre jusqu'à 50 %
+                extracted = []
+                def on_span(finished):
+                    if finished.name == "extract":
+                        extracted.append(finished)
+                        progress_bar.progress(int(50 * len(extracted) / len(uploaded_files)))
+
+                with listening(on_span):
+                    documents = load_documents(
+                        uploaded_files, is_directory=False,
+                        workers=EXTRACTION_WORKERS, timeout=EXTRACTION_TIMEOUT,
+                        cache_dir=os.path.join(save_path, EXTRACTION_CACHE_DIRNAME),
+                    )
                 st.session_state.documents = documents
-                progress_bar.progress(30)
+                progress_bar.progress(50)
 
             except Exception as e:
                 st.error(f"An error occurred while processing the files: {e}")
                 return
 
-        if not st.session_state.documents:
-            st.warning("No supported documents found.")
-        else:
-            chunks = split_documents(st.session_state.documents)
-            progress_bar.progress(60)
-
-            try:
-                vector_store = create_vector_store(chunks, save_path=save_path)
-                st.session_state.vector_store = vector_store
-                progress_bar.progress(100)
-                st.success("⚡ Les runes ont été gravées dans la pierre ! La base des connaissances est prête.")
-                progress_placeholder.empty()
-
-            except Exception as e:
-                st.error(f"Une erreur s'est produite lors de la création de nouvelles runes : {e}")
-                return
-            finally:
-                progress_placeholder.empty()
+            if not st.session_state.documents:
+                st.warning("No supported documents found.")
+            else:
+                chunks, embeddings = semantic_split_documents(st.session_state.documents)
+                progress_bar.progress(60)
+
+                try:
+                    # Les étapes de création de la base font avancer la barre jusqu'à 100 %
+                    stage_progress = {"embed": 90, "index": 95, "save": 100}
+                    def on_span(finished):
+                        if finished.name in stage_progress:
+                            progress_bar.progress(stage_progress[finished.name])
+
+                    with listening(on_span):
+                        vector_store = create_vector_store(chunks, save_path=save_path, embeddings=embeddings)
+                    st.session_state.vector_store = vector_store
+                    progress_bar.progress(100)
+                    st.success("⚡ Les runes ont été gravées dans la pierre ! La base des connaissances est prête.")
+                    progress_placeholder.empty()
+
+                except Exception as e:
+                    st.error(f"Une erreur s'est produite lors de la création de nouvelles runes : {e}")
+                    return
+                finally:
+                    progress_placeholder.empty()
 
     # Bouton Load Existing DB
     if load_db_clicked:
@@ -125,12 +184,12 @@ def main():
                 st.markdown("### 🔮 Invocation en cours...")
                 progress_bar = st.progress(0)
             try:
-                chunks = []
-                vector_store = load_vector_store(directory_path=save_path)
+                # La progression suit les étapes réelles du chargement (modèle, index, docstore)
+                vector_store = load_vector_store(
+                    directory_path=save_path,
+                    progress=lambda fraction, stage: progress_bar.progress(int(100 * fraction)),
+                )
                 st.session_state.vector_store = vector_store
-                for i in range(1, 101, 10):
-                    progress_bar.progress(i)
-                    time.sleep(0.05)
                 st.success("🌌 La base de données ancestrale est invoquée avec succès !")
             except Exception as e:
                 st.error(f"Une erreur s'est produite lors de l'invocation des runes existantes : {e}")
@@ -142,6 +201,14 @@ def main():
     # Interface de chat
     
     if st.session_state.vector_store:
+        # Une seule chaîne par base chargée : elle n'est reconstruite que si la base change
+        engine = st.session_state.query_engine
+        if engine is None or engine.vector_store is not st.session_state.vector_store:
+            answer_cache = AnswerCache(os.path.join(save_path, ANSWER_CACHE_FILENAME), st.session_state.vector_store)
+            engine = QueryEngine(st.session_state.vector_store, initial_context=context, answer_cache=answer_cache)
+            engine.warm_up()  # Le modèle d'Ollama se charge pendant la saisie de la première question
+            st.session_state.query_engine = engine
+
         st.image(banner_rune_path, use_container_width=True)
         st.markdown("### Posez votre question aux runes")
 
@@ -155,6 +222,16 @@ def main():
         selected_question = st.selectbox("Ou choisissez une incantation rituelle :", [""] + all_questions)
         st.image(banner_rune_path, use_container_width=True)
 
+        # Restreindre la recherche à une période ou à certains documents
+        with st.expander("🗓️ Filtrer les runes par date ou par document"):
+            period = st.date_input("Période", value=(), format="DD/MM/YYYY")
+            sources = st.multiselect("Documents", get_metadata_index(st.session_state.vector_store).indexed_sources())
+        filters = {}
+        if period:
+            filters.update(date_from=period[0], date_to=period[-1])
+        if sources:
+            filters["sources"] = sources
+
         with st.form("chat_form", clear_on_submit=True):
             user_input = st.text_input("Posez votre question:", value=selected_question if selected_question else "")
             submitted = st.form_submit_button("Envoyer")
@@ -164,13 +241,32 @@ def main():
 
                 with st.spinner("Les runes se consultent..."):
                     try:
-                        retriever, generate_answer = create_retrieval_qa_chain(
-                            st.session_state.vector_store,
-                            initial_context=context,
-                        )
-                        context_docs = retriever.invoke(user_input)
-                        context_retrieved = build_context_from_docs(context_docs)
-                        answer = generate_answer(user_input, context_retrieved)
+                        cached = engine.cached_answer(user_input, filters=filters or None)
+                        if cached is not None:
+                            # Question proche d'une question déjà traitée, sur des sources inchangées
+                            answer, context_docs = cached
+                            st.caption("Réponse reprise du cache des runes")
+                        else:
+                            context_docs = engine.retrieve(user_input, filters=filters or None)
+                            context_retrieved = build_context_from_docs(context_docs)
+                            # La réponse s'affiche au fil de la génération, puis rejoint l'historique
+                            stream_placeholder = st.empty()
+                            generation_stats = {}
+                            with stream_placeholder.container():
+                                answer = st.write_stream(
+                                    engine.generate_answer(user_input, context_retrieved, stream=True,
+                                                           stats=generation_stats)
+                                ).strip()
+                            stream_placeholder.empty()
+                            if generation_stats.get("time_to_first_token") is not None:
+                                st.caption(f"Premier token après {generation_stats['time_to_first_token']:.2f}s, "
+                                           f"réponse complète en {generation_stats['total_time']:.2f}s, "
+                                           f"{generation_stats.get('prompt_eval_count', 0)} tokens de prompt "
+                                           f"évalués en {generation_stats.get('prompt_eval_duration', 0):.2f}s")
+                            engine.remember_answer(user_input, answer, context_docs, filters=filters or None)
+                        cache_stats = engine.answer_cache.stats()
+                        st.caption(f"Cache des réponses : {cache_stats['hits']} succès, {cache_stats['misses']} échecs "
+                                   f"(taux {cache_stats['hit_rate']:.0%}), {cache_stats['entries']} réponses gardées")
 
                         st.session_state.chat_history.append({"role": "assistant", "message": answer})
 
@@ -10,10 +10,13 @@ Ce module permet à l'utilisateur de :
 Fonctions principales :
 - print_model_options: Affiche les modèles disponibles.
 - select_model: Permet à l'utilisateur de sélectionner un modèle pour les embeddings.
+- select_index_type: Permet à l'utilisateur de choisir le type d'index FAISS.
 - get_source_path: Demande un chemin de fichier ou dossier, avec option de chemin par défaut.
 - check_path_type: Vérifie si le chemin fourni est un fichier ou un dossier.
 - handle_documents: Charge et divise les documents en chunks.
 - create_vector_store_from_chunks: Crée la base vectorielle à partir des chunks.
+- iter_update_vector_store: Met à jour la base vectorielle d'un dossier de manière incrémentale, en flux.
+- create_query_engine: Construit la chaîne de questions-réponses de la session, avec son cache des réponses.
 - run_interactive_query: Permet à l'utilisateur de poser des questions et d'obtenir des réponses.
 - main: Fonction principale qui coordonne le processus.
 """
@@ -22,21 +25,34 @@ Fonctions principales :
 import os
 from pathlib import Path
 from rag_pipeline import (build_context_from_docs, normalize_path, 
-                          create_retrieval_qa_chain)
+                          QueryEngine)
 
 from vector_store import create_vector_store, load_vector_store, vector_store_exists
-from chunking import split_documents
-from preprocessing import load_documents
+from chunking import semantic_split_documents
+from preprocessing import load_documents, EXTRACTION_CACHE_DIRNAME, EXTRACTION_TIMEOUT
+from indexing import iter_update_vector_store
+from query_cache import cache_stats
+from answer_cache import AnswerCache, ANSWER_CACHE_FILENAME
+from tracing import summary, format_summary
+
+# Extraction parallèle : un processus par cœur (un fichier bloqué est abandonné après EXTRACTION_TIMEOUT)
+EXTRACTION_WORKERS = os.cpu_count()
+
+# Modèles d'embedding proposés : choix -> (nom du modèle, description)
+EMBEDDING_MODELS = {
+    "1": ("all-MiniLM-L6-v2", "Rapide, multilingue"),
+    "2": ("paraphrase-multilingual-mpnet-base-v2", "Multilingue, haute précision"),
+    "3": ("sentence-transformers/LaBSE", "Spécifique multilingue"),
+    "4": ("dangvantuan/sentence-camembert-large", "Français, expérimental"),
+}
 
 def print_model_options():
     """
     Affiche les options de modèles disponibles pour l'utilisateur.
     """
     print("Modèles disponibles :")
-    print("1. all-MiniLM-L6-v2 (Rapide, multilingue)")
-    print("2. paraphrase-multilingual-mpnet-base-v2 (Multilingue, haute précision)")
-    print("3. sentence-transformers/LaBSE (Spécifique multilingue)")
-    print("4. dangvantuan/sentence-camembert-large (Français, expérimental)")
+    for choice, (model_name, description) in EMBEDDING_MODELS.items():
+        print(f"{choice}. {model_name} ({description})")
 
 
 def select_model():
@@ -47,13 +63,24 @@ def select_model():
         str: Le nom du modèle sélectionné.
     """
     model_choice = input("Sélectionnez un modèle (1-4) : ").strip()
-    model_mapping = {
-        "1": "all-MiniLM-L6-v2",
-        "2": "paraphrase-multilingual-mpnet-base-v2",
-        "3": "sentence-transformers/LaBSE",
-        "4": "dangvantuan/sentence-camembert-large"
-    }
-    return model_mapping.get(model_choice, "all-MiniLM-L6-v2")
+    return EMBEDDING_MODELS.get(model_choice, EMBEDDING_MODELS["1"])[0]
+
+
+def select_index_type():
+    """
+    Permet à l'utilisateur de choisir le type d'index FAISS.
+
+    Returns:
+        str: Le type d'index sélectionné (voir faiss_indexes.INDEX_TYPES).
+    """
+    print("Types d'index disponibles :")
+    print("1. flat (Recherche exacte, adaptée aux petites bases)")
+    print("2. ivf_flat (Approchée, rapide sur plusieurs années d'archives)")
+    print("3. ivf_pq (Approchée et compressée, très grandes bases)")
+    print("4. hnsw (Approchée, graphe, latence la plus faible)")
+    index_choice = input("Sélectionnez un type d'index (1-4, défaut : 1) : ").strip()
+    index_mapping = {"1": "flat", "2": "ivf_flat", "3": "ivf_pq", "4": "hnsw"}
+    return index_mapping.get(index_choice, "flat")
 
 
 def get_source_path():
@@ -94,36 +121,68 @@ def check_path_type(source_path):
         raise ValueError("Le chemin fourni n'est ni un fichier ni un dossier valide.")
 
 
-def handle_documents(source_path, is_directory):
+def handle_documents(source_path, is_directory, cache_dir=None, model_name="all-MiniLM-L6-v2"):
     """
-    Charge les documents depuis le chemin donné, puis les divise en chunks.
+    Charge les documents depuis le chemin donné, puis les divise en chunks (découpage sémantique).
     
     Args:
         source_path (str): Le chemin des fichiers ou dossiers à traiter.
         is_directory (bool): Indique si le chemin est un dossier ou non.
+        cache_dir (str, optional): Dossier du cache d'extraction.
+        model_name (str): Modèle d'embedding de la base, qui vectorise aussi les chunks.
     
     Returns:
-        list: La liste des chunks générés à partir des documents.
+        tuple: La liste des chunks générés à partir des documents, et leurs vecteurs.
     """
-    documents = load_documents(source_path, is_directory=is_directory)
+    documents = load_documents(source_path, is_directory=is_directory,
+                               workers=EXTRACTION_WORKERS, timeout=EXTRACTION_TIMEOUT,
+                               cache_dir=cache_dir)
     if not documents:
         raise ValueError("Aucun document valide chargé.")
     
-    chunks = split_documents(documents)
+    chunks, embeddings = semantic_split_documents(documents, model_name=model_name)
     if not chunks:
         raise ValueError("Aucun chunk valide généré à partir des documents.")
     
-    return chunks
+    return chunks, embeddings
+
+
+def print_stage_summary():
+    """
+    Affiche le temps passé dans chaque étape du pipeline (extraction, OCR, chunking, embeddings...).
+    """
+    stages = summary(reset=True)
+    if stages:
+        print("\nTemps par étape :")
+        print(format_summary(stages))
+        print()
+
+
+def print_load_progress(fraction, stage):
+    """
+    Affiche l'avancement du chargement du vector store.
+    """
+    print(f"Chargement : {fraction:.0%} ({stage})")
+
+
+def create_query_engine(vector_store, vector_store_path):
+    """
+    Construit la chaîne de questions-réponses de la session, avec le cache des réponses
+    enregistré à côté du vector store, et précharge le modèle d'Ollama.
+    """
+    answer_cache = AnswerCache(os.path.join(vector_store_path, ANSWER_CACHE_FILENAME), vector_store)
+    engine = QueryEngine(vector_store, answer_cache=answer_cache)
+    engine.warm_up()  # Le modèle se charge pendant que l'utilisateur saisit sa première question
+    return engine
 
 
-def run_interactive_query(retriever, generate_answer):
+def run_interactive_query(engine):
     """
     Permet à l'utilisateur de poser des questions de manière interactive
     et d'obtenir des réponses basées sur les documents récupérés.
     
     Args:
-        retriever (object): L'objet de récupération de documents.
-        generate_answer (function): La fonction pour générer une réponse.
+        engine (QueryEngine): La chaîne de questions-réponses, construite une fois pour la session.
     """
     print("\nLe système est prêt. Vous pouvez poser vos questions.")
     print("Tapez 'exit' pour mettre fin au test.\n")
@@ -131,6 +190,15 @@ def run_interactive_query(retriever, generate_answer):
     while True:
         query = input("Entrez votre question : ").strip()
         if query.lower() == "exit":
+            stats = cache_stats()["retrieval"]
+            print(f"Cache de recherche : {stats['hits']} succès, {stats['misses']} échecs "
+                  f"(taux {stats['hit_rate']:.0%})")
+            if engine.answer_cache is not None:
+                stats = engine.answer_cache.stats()
+                print(f"Cache des réponses : {stats['hits']} succès, {stats['misses']} échecs "
+                      f"(taux {stats['hit_rate']:.0%}), {stats['invalidated']} invalidées, "
+                      f"{stats['entries']} enregistrées")
+            print_stage_summary()
             print("Fin du test. Merci d'avoir utilisé le système.")
             break
         if not query:
@@ -138,19 +206,38 @@ def run_interactive_query(retriever, generate_answer):
             continue
 
         try:
+            cached = engine.cached_answer(query)
+            if cached is not None:
+                answer, context_docs = cached
+                print(f"\nRéponse reprise du cache ({len(context_docs)} documents sources) : {answer}\n")
+                continue
+
             print("\nLancement de la recherche dans FAISS...")
-            context_docs = retriever.invoke(query)
+            context_docs = engine.retrieve(query)
 
             if not context_docs:
                 print("Aucun document pertinent trouvé.")
                 continue
             context_retrieved = build_context_from_docs(context_docs)
-            answer = generate_answer(query, context_retrieved)
             print(f"Documents récupérés : {len(context_docs)}")
             # context = "\n\n".join([doc.page_content for doc in context_docs])
             print(f"Contexte récupéré : {context_retrieved}")  # Limité à 200 caractères pour l'affichage
-            answer = generate_answer(query, context_retrieved)
-            print(f"Réponse générée : {answer}\n")
+            stats = {}
+            tokens = []
+            print("Réponse générée : ", end="", flush=True)
+            for token in engine.generate_answer(query, context_retrieved, stream=True, stats=stats):
+                print(token, end="", flush=True)
+                tokens.append(token)
+            print()
+            engine.remember_answer(query, "".join(tokens).strip(), context_docs)
+            if stats.get("time_to_first_token") is not None:
+                print(f"(premier token après {stats['time_to_first_token']:.2f}s, "
+                      f"réponse complète en {stats['total_time']:.2f}s)")
+            if stats.get("prompt_eval_duration") is not None:
+                # Les tokens du message système, repris du cache d'Ollama, ne sont pas réévalués
+                print(f"(prompt : {stats.get('prompt_eval_count', 0)} tokens évalués en "
+                      f"{stats['prompt_eval_duration']:.2f}s)")
+            print()
 
         except ValueError as e:
             print(f"Erreur lors de la recherche : {e}")
@@ -174,12 +261,12 @@ def main():
         
         if use_existing == 'o':
             try:
-                vector_store = load_vector_store(directory_path=vector_store_path)
+                vector_store = load_vector_store(directory_path=vector_store_path,
+                                                 progress=print_load_progress)
                 print("Vector store chargé avec succès.\n")
                 
                 # Passer directement à l'interrogation
-                retriever, generate_answer = create_retrieval_qa_chain(vector_store)
-                run_interactive_query(retriever, generate_answer)
+                run_interactive_query(create_query_engine(vector_store, vector_store_path))
                 return
 
             except RuntimeError as e:
@@ -192,6 +279,9 @@ def main():
 
     model_name = select_model()
     print(f"Modèle sélectionné : {model_name}\n")
+
+    index_type = select_index_type()
+    print(f"Type d'index sélectionné : {index_type}\n")
     
 
 
@@ -203,21 +293,40 @@ def main():
         print(e)
         return
 
-    try:
-        chunks = handle_documents(source_path, is_directory)
-    except ValueError as e:
-        print(e)
-        return
-
-    try:
-        vector_store = create_vector_store(chunks, model_name=model_name)
-    except RuntimeError as e:
-        print(e)
-        return
+    if is_directory:
+        # Seuls les fichiers nouveaux ou modifiés depuis la dernière indexation sont traités
+        try:
+            for vector_store, stats in iter_update_vector_store(source_path, model_name=model_name,
+                                                                save_path=vector_store_path,
+                                                                workers=EXTRACTION_WORKERS,
+                                                                timeout=EXTRACTION_TIMEOUT,
+                                                                index_type=index_type):
+                if stats["files_total"]:
+                    print(f"Fichiers indexés : {stats['files_done']}/{stats['files_total']} "
+                          f"({stats['chunks_added']} chunks)")
+        except (ValueError, RuntimeError) as e:
+            print(e)
+            return
+        print(f"Fichiers ajoutés : {stats['added']}, modifiés : {stats['changed']}, "
+              f"supprimés : {stats['removed']}, inchangés : {stats['unchanged']}\n")
+    else:
+        try:
+            chunks, embeddings = handle_documents(source_path, is_directory,
+                                                  cache_dir=os.path.join(vector_store_path, EXTRACTION_CACHE_DIRNAME),
+                                                  model_name=model_name)
+        except ValueError as e:
+            print(e)
+            return
 
-    retriever, generate_answer = create_retrieval_qa_chain(vector_store)
+        try:
+            vector_store = create_vector_store(chunks, model_name=model_name, save_path=vector_store_path,
+                                               index_type=index_type, embeddings=embeddings)
+        except RuntimeError as e:
+            print(e)
+            return
 
-    run_interactive_query(retriever, generate_answer)
+    print_stage_summary()
+    run_interactive_query(create_query_engine(vector_store, vector_store_path))
 
 
 if __name__ == '__main__':
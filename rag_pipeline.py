@@ -2,8 +2,18 @@
 from preprocessing import extract_content_from_pdf
 from preprocessing import extract_content_from_txt
 import os
+import json
+import asyncio
+import hashlib
+import logging
+import threading
 
-from ollama_query import ollama_query # Fonction pour interroger Ollama
+from ollama_query import ollama_chat, ollama_chat_stream, ollama_warm_up, DEFAULT_MODEL # Fonctions pour interroger Ollama
+from query_cache import CachedRetriever
+from metadata_index import normalize_filters
+from reranking import Reranker, RerankingRetriever, candidate_count
+from context_builder import build_context
+from tracing import span
 
 # Définir le contexte initial
 DEFAULT_CONTEXT = """
@@ -11,6 +21,19 @@ Ce système est conçu pour aider une association à gérer ses activités.
 Il fournit des réponses pertinentes basées sur les documents fournis. Veuillez vous assurer que vos réponses sont concises, utiles et alignées avec cet objectif.
 """
 
+# Consignes de réponse. Avec le contexte initial, elles forment le message système, identique d'une
+# question à l'autre : Ollama garde ce début de prompt dans son cache KV et n'évalue à chaque question
+# que les documents et la question, placés après lui
+ANSWER_INSTRUCTIONS = """
+Pour chaque question, des extraits de documents retrouvés d'après la requête te sont fournis.
+Utilise leur contenu pour répondre à la question.
+"""
+
+logger = logging.getLogger(__name__)
+
+# Taille maximale, en tokens du LLM, du contexte des documents inséré dans le prompt
+CONTEXT_MAX_TOKENS = 1500
+
 # Permettre la personnalisation du contexte
 def get_initial_prompt(user_context=None):
     """
@@ -47,7 +70,7 @@ def determine_optimal_k(documents, question, max_k=20, min_k=3):
     Détermine dynamiquement le nombre optimal de chunks (k) à prendre en compte.
 
     Parameters:
-    - documents (List[Document]): Liste des documents ou chunks disponibles.
+    - documents (int | List[Document]): Nombre de documents ou chunks disponibles, ou leur liste.
     - question (str): La question posée par l'utilisateur.
     - max_k (int): Nombre maximal de chunks à prendre en compte.
     - min_k (int): Nombre minimal de chunks à prendre en compte.
@@ -55,8 +78,11 @@ def determine_optimal_k(documents, question, max_k=20, min_k=3):
     Returns:
     - int: Nombre optimal de chunks à utiliser.
     """
+    # Un nombre évite de parcourir la liste des documents (ou le mapping SQLite) à chaque question
+    document_count = documents if isinstance(documents, int) else len(documents or ())
+
     # Gérer les cas où `documents` ou `question` est None
-    if documents is None or len(documents) == 0:
+    if document_count == 0:
         print("Aucun document fourni ou liste vide.")
         return min_k  # Retourne une valeur minimale par défaut
 
@@ -67,10 +93,10 @@ def determine_optimal_k(documents, question, max_k=20, min_k=3):
         question_length = len(question.split())
 
     # Ajuster k en fonction de la taille des documents
-    if len(documents) < min_k:
-        return len(documents)
-    elif len(documents) <= max_k:
-        return len(documents)
+    if document_count < min_k:
+        return document_count
+    elif document_count <= max_k:
+        return document_count
     else:
         if question_length <= 10:  # Question courte et spécifique
             return min_k
@@ -79,76 +105,330 @@ def determine_optimal_k(documents, question, max_k=20, min_k=3):
         else:  # Question longue ou exploratoire
             return max_k
         
-def build_context_from_docs(context_docs):
+def build_context_from_docs(context_docs, max_tokens=CONTEXT_MAX_TOKENS):
     """
-    Builds a context string from the retrieved documents, including metadata.
+    Builds a context string from the retrieved documents, with a compact header per source.
+
+    Duplicate and overlapping chunks are removed, adjacent chunks of a source are merged, and
+    the context is cut to a token budget (see context_builder).
 
     Args:
-        context_docs (list): List of documents retrieved, each with `page_content` and `metadata` attributes.
+        context_docs (list): List of documents retrieved, best first, each with `page_content` and `metadata` attributes.
+        max_tokens (int, optional): Token budget of the context (None for no limit).
 
     Returns:
         str: A formatted string combining document metadata and content.
     """
-    return "\n\n".join(
-        [
-            f"Metadata: {doc.metadata}\nContent: {doc.page_content}" 
-            for doc in context_docs
+    return build_context(context_docs, max_tokens=max_tokens)
+
+
+def build_system_prompt(initial_context=None):
+    """
+    Construit le message système : le contexte initial puis les consignes de réponse.
+    """
+    return get_initial_prompt(initial_context).strip() + "\n\n" + ANSWER_INSTRUCTIONS.strip()
+
+
+def build_messages(query, context, initial_context=None):
+    """
+    Construit les messages envoyés à l'API de chat d'Ollama : le message système, fixe, puis les
+    documents et la question, qui changent à chaque question.
+
+    Parameters:
+    - query (str): La question posée par l'utilisateur.
+    - context (str): Le contexte fourni par les documents récupérés.
+    - initial_context (str, optional): Contexte initial (par défaut : DEFAULT_CONTEXT).
+
+    Returns:
+    - List[dict]: Les messages {"role", "content"}.
+    """
+    with span("prompt_build", context_bytes=len(context)) as prompt_span:
+        messages = [
+            {"role": "system", "content": build_system_prompt(initial_context)},
+            {"role": "user", "content": f"Voici les fichiers qui ont été retrouvés d'après la requête :\n{context}\n\n"
+                                        f"Question : {query}"},
         ]
-    )
+        prompt_span.set(bytes=sum(len(message["content"]) for message in messages))
+    return messages
+
+
+def build_retriever(vector_store, search_type="hybrid", k=5, filters=None, rerank=True):
+    """
+    Construit le retriever des chaînes de questions-réponses.
+
+    Avec `rerank`, un ensemble de candidats plus large est récupéré puis réordonné par un
+    cross-encoder, qui ne garde que les k meilleurs documents dans la limite de CONTEXT_MAX_TOKENS.
+    Si le cross-encoder ne peut pas être chargé, les documents sont utilisés dans l'ordre de la recherche.
+
+    Parameters:
+    - vector_store (FAISS): La base vectorielle.
+    - search_type (str): Type de recherche ("hybrid", "similarity", ...).
+    - k (int): Nombre de documents transmis au LLM.
+    - filters (dict, optional): Filtres de métadonnées (voir metadata_index).
+    - rerank (bool): Réordonner les candidats avec le cross-encoder.
+
+    Returns:
+    - CachedRetriever | RerankingRetriever: Le retriever, dont `invoke(question)` renvoie les documents.
+    """
+    reranker = Reranker() if rerank else None
+    if reranker is not None and reranker.available():
+        candidates = CachedRetriever(vector_store, search_type=search_type,
+                                     search_kwargs={"k": candidate_count(k)}, filters=filters)
+        return RerankingRetriever(candidates, reranker, top_n=k, max_tokens=CONTEXT_MAX_TOKENS)
+    # (les embeddings de questions et les résultats sont mis en cache pour les questions répétées)
+    return CachedRetriever(vector_store, search_type=search_type, search_kwargs={"k": k}, filters=filters)
+
+
+class QueryEngine:
+    """
+    Chaîne de questions-réponses d'une session, construite une fois par vector store chargé.
+
+    Le retriever de chaque valeur de k est créé à la première question qui l'utilise puis
+    réutilisé, et le choix de k ne dépend que du nombre de vecteurs de l'index : une question
+    ne coûte que sa recherche et une seule génération.
+
+    Avec un cache des réponses (AnswerCache), une question proche d'une question déjà traitée
+    reprend sa réponse et ses sources sans recherche ni génération (voir cached_answer).
+    """
+
+    def __init__(self, vector_store, initial_context=None, search_type="hybrid", k=None, filters=None,
+                 rerank=True, max_k=20, min_k=3, answer_cache=None):
+        """
+        Parameters:
+        - vector_store (FAISS): La base vectorielle utilisée pour la récupération des documents pertinents.
+        - initial_context (str, optional): Contexte initial pour guider les réponses générées.
+        - search_type (str): Type de recherche utilisé (par défaut : "hybrid", qui fusionne la recherche
+          vectorielle et BM25 ; "similarity" pour la recherche vectorielle seule).
+        - k (int, optional): Nombre de documents à récupérer ; déterminé pour chaque question si None.
+        - filters (dict, optional): Filtres de métadonnées par défaut (voir metadata_index).
+        - rerank (bool): Réordonner un ensemble de candidats plus large avec un cross-encoder.
+        - max_k (int): Nombre maximal de documents quand k est déterminé par question.
+        - min_k (int): Nombre minimal de documents quand k est déterminé par question.
+        - answer_cache (AnswerCache, optional): Cache sémantique des réponses générées.
+        """
+        # Assurez-vous que k est un entier positif
+        if k is not None and (not isinstance(k, int) or k <= 0):
+            raise ValueError(f"Le paramètre 'k' doit être un entier positif. Valeur reçue : {k}")
+        normalize_filters(filters)  # Des filtres invalides échouent ici plutôt qu'à la première question
+        self.vector_store = vector_store
+        self.initial_context = get_initial_prompt(initial_context)
+        self.search_type = search_type
+        self.k = k
+        self.filters = filters
+        self.rerank = rerank
+        self.max_k = max_k
+        self.min_k = min_k
+        self.answer_cache = answer_cache
+        self._retrievers = {}  # k -> retriever
+
+    def choose_k(self, question):
+        """
+        Retourne le nombre de documents à récupérer pour une question.
+        """
+        if self.k is not None:
+            return self.k
+        return determine_optimal_k(self.vector_store.index.ntotal, question, max_k=self.max_k, min_k=self.min_k)
+
+    def retriever(self, k):
+        """
+        Retourne le retriever qui renvoie k documents, en le créant à sa première utilisation.
+        """
+        retriever = self._retrievers.get(k)
+        if retriever is None:
+            retriever = build_retriever(self.vector_store, search_type=self.search_type, k=k,
+                                        filters=self.filters, rerank=self.rerank)
+            self._retrievers[k] = retriever
+        return retriever
+
+    def retrieve(self, question, filters=None, k=None):
+        """
+        Récupère les documents pertinents pour une question.
+
+        Parameters:
+        - question (str): La question posée par l'utilisateur.
+        - filters (dict, optional): Filtres de cette question, à la place de ceux du moteur.
+        - k (int, optional): Nombre de documents ; déterminé d'après la question si None.
+
+        Returns:
+        - List[Document]: Les documents retenus, du plus pertinent au moins pertinent.
+        """
+        k = k if k is not None else self.choose_k(question)
+        return self.retriever(k).invoke(question, filters=filters if filters is not None else self.filters)
+
+    def _answer_scope(self, question, filters):
+        # Réglages dont dépend une réponse : elle n'est reprise que pour des réglages identiques
+        prompt_key = hashlib.blake2b(self.initial_context.encode("utf-8"), digest_size=8).hexdigest()
+        return json.dumps([DEFAULT_MODEL, prompt_key, self.search_type, self.rerank, self.choose_k(question),
+                           normalize_filters(filters if filters is not None else self.filters)])
+
+    def cached_answer(self, question, filters=None):
+        """
+        Cherche dans le cache la réponse d'une question similaire, générée avec les mêmes réglages
+        et dont les documents sources n'ont pas changé.
+
+        Parameters:
+        - question (str): La question posée par l'utilisateur.
+        - filters (dict, optional): Filtres de cette question, à la place de ceux du moteur.
 
+        Returns:
+        - tuple | None: (réponse, documents sources), ou None si le cache n'a pas de réponse.
+        """
+        if self.answer_cache is None:
+            return None
+        return self.answer_cache.get(question, self._answer_scope(question, filters))
+
+    def remember_answer(self, question, answer, context_docs, filters=None):
+        """
+        Enregistre une réponse générée dans le cache, avec les documents dont elle est issue.
+        """
+        if self.answer_cache is not None:
+            self.answer_cache.put(question, answer, context_docs, self._answer_scope(question, filters))
+
+    def generate_answer(self, query, context, stream=False, stats=None):
+        """
+        Génère une réponse avec l'API de chat d'Ollama : le message système (contexte initial et consignes), puis le contexte des documents et la question.
+
+        Parameters:
+        - query (str): La question posée par l'utilisateur.
+        - context (str): Le contexte fourni par les documents récupérés.
+        - stream (bool): Produit la réponse token par token au lieu de l'attendre en entier.
+        - stats (dict, optional): Complété avec le temps jusqu'au premier token (mode stream).
+
+        Returns:
+        - str | Iterator[str]: La réponse générée, ou ses fragments au fil de l'eau si `stream`.
+        """
+        messages = build_messages(query, context, self.initial_context)
+        if stream:
+            return ollama_chat_stream(messages, stats=stats)
+        try:
+            return ollama_chat(messages, stats=stats)
+        except RuntimeError as e:
+            raise RuntimeError(f"Error generating answer: {e}")
+
+    def warm_up(self, background=True):
+        """
+        Charge le modèle d'Ollama et évalue le message système avant la première question, qui
+        n'attend alors ni le chargement ni l'évaluation de ce début de prompt.
+
+        Parameters:
+        - background (bool): Précharger dans un thread, sans retarder l'affichage.
 
-def create_retrieval_qa_chain(vector_store, initial_context=None, search_type="similarity", k=None, question=None):
+        Returns:
+        - threading.Thread | dict | None: Le thread, ou les métriques de l'appel (None si Ollama
+          n'a pas répondu).
+        """
+        def run():
+            try:
+                stats = ollama_warm_up(build_system_prompt(self.initial_context))
+            except RuntimeError as e:
+                logger.warning(f"Préchargement du modèle Ollama impossible : {e}")
+                return None
+            logger.debug(f"Modèle Ollama préchargé en {stats['total_time']:.2f}s")
+            return stats
+
+        if not background:
+            return run()
+        thread = threading.Thread(target=run, name="ollama-warm-up", daemon=True)
+        thread.start()
+        return thread
+
+
+def create_retrieval_qa_chain(vector_store, initial_context=None, search_type="hybrid", k=None, question=None,
+                              filters=None, rerank=True):
     """
     Crée une chaîne de récupération et de génération de réponses en utilisant un store vectoriel FAISS.
     Ajuste dynamiquement le nombre de chunks (k).
 
+    Pour une session de plusieurs questions, préférer un QueryEngine, qui choisit k à chaque question
+    sans reconstruire la chaîne.
+
     Parameters:
     - vector_store (FAISS): La base vectorielle utilisée pour la récupération des documents pertinents.
     - initial_context (str, optional): Contexte initial pour guider les réponses générées.
-    - search_type (str): Type de recherche utilisé (par défaut : "similarity").
+    - search_type (str): Type de recherche utilisé (par défaut : "hybrid", qui fusionne la recherche
+      vectorielle et BM25 ; "similarity" pour la recherche vectorielle seule).
     - k (int): Nombre de documents à récupérer (par défaut : 5).
+    - filters (dict, optional): Restreint la recherche par date, source ou titre, par exemple
+      {"date_from": "2024-09", "date_to": "2024-09", "sources": ["CR_CA"]} (voir metadata_index).
+    - rerank (bool): Réordonner un ensemble de candidats plus large avec un cross-encoder.
 
     Returns:
     - tuple: 
         - retriever (Callable): Fonction pour récupérer les documents les plus pertinents.
         - generate_answer (Callable): Fonction pour générer une réponse basée sur une question et un contexte.
     """
-    # Récupérer le contexte initial ou utiliser celui par défaut
-    initial_context = get_initial_prompt(initial_context)
+    engine = QueryEngine(vector_store, initial_context=initial_context, search_type=search_type, k=k,
+                         filters=filters, rerank=rerank)
 
     # Déterminer dynamiquement le nombre de chunks si `k` n'est pas défini
     if k is None:
-        if question:
-            k = determine_optimal_k(vector_store.docstore._dict.values(), question)
-        else:
-            k = 5  # Valeur par défaut si aucune question n'est fournie
+        k = engine.choose_k(question) if question else 5  # Valeur par défaut si aucune question n'est fournie
+
+    return engine.retriever(k), engine.generate_answer
 
-    # Assurez-vous que k est un entier positif
+
+def create_async_retrieval_qa_chain(vector_store, client, search_type="hybrid", k=5, filters=None, rerank=True):
+    """
+    Variante asyncio de create_retrieval_qa_chain, pour traiter plusieurs questions en parallèle.
+
+    La recherche FAISS (calcul, qui libère le GIL) s'exécute dans un thread ; la génération
+    passe par un AsyncOllamaClient, dont le sémaphore borne le nombre de requêtes en vol.
+
+    Parameters:
+    - vector_store (FAISS): La base vectorielle utilisée pour la récupération des documents pertinents.
+    - client (AsyncOllamaClient): Client Ollama asynchrone.
+    - search_type (str): Type de recherche utilisé (par défaut : "hybrid").
+    - k (int): Nombre de documents à récupérer.
+    - filters (dict, optional): Restreint la recherche par date, source ou titre (voir metadata_index).
+    - rerank (bool): Réordonner un ensemble de candidats plus large avec un cross-encoder.
+
+    Returns:
+    - tuple:
+        - aretrieve (Callable): Coroutine qui récupère les documents pertinents pour une question.
+        - agenerate_answer (Callable): Coroutine qui génère une réponse (ou un générateur
+          asynchrone de tokens si `stream=True`).
+    """
     if not isinstance(k, int) or k <= 0:
         raise ValueError(f"Le paramètre 'k' doit être un entier positif. Valeur reçue : {k}")
 
-    # Configurer le retriever avec les paramètres spécifiés
-    retriever = vector_store.as_retriever(search_type=search_type, search_kwargs={"k": k})
+    retriever = build_retriever(vector_store, search_type=search_type, k=k, filters=filters, rerank=rerank)
 
-    def generate_answer(query, context):
-        """
-        Génère une réponse en interrogeant Ollama avec un prompt contenant le contexte initial, le contexte des documents, et la question.
+    async def aretrieve(query, filters=None):
+        return await asyncio.to_thread(retriever.invoke, query, filters)
 
-        Parameters:
-        - query (str): La question posée par l'utilisateur.
-        - context (str): Le contexte fourni par les documents récupérés.
+    async def agenerate_answer(query, context, stream=False, stats=None):
+        messages = build_messages(query, context)
+        if stream:
+            return client.chat_stream(messages, stats=stats)
+        return await client.chat(messages, stats=stats)
 
-        Returns:
-        - str: La réponse générée.
-        """
-        prompt = f"""
-        Voici les fichiers qui ont été retrouvés d'après la requête: {context}
-        Utilise leur contenu pour répondre à cette question: {query}
-        Réponse:
-        """
+    return aretrieve, agenerate_answer
+
+
+async def answer_questions_async(vector_store, questions, client, k=5):
+    """
+    Répond à une liste de questions avec plusieurs générations en vol à la fois.
+
+    Parameters:
+    - vector_store (FAISS): La base vectorielle.
+    - questions (List[str]): Les questions.
+    - client (AsyncOllamaClient): Client Ollama asynchrone (sa limite de concurrence s'applique).
+    - k (int): Nombre de documents à récupérer par question.
+
+    Returns:
+    - List[dict]: Pour chaque question, dans l'ordre : `question`, `context_docs`, `answer`,
+      `stats` (métriques de génération) et `error` (message, ou None).
+    """
+    aretrieve, agenerate_answer = create_async_retrieval_qa_chain(vector_store, client, k=k)
+
+    async def answer(question):
+        result = {"question": question, "context_docs": [], "answer": None, "stats": {}, "error": None}
         try:
-            return ollama_query(prompt)
-        except RuntimeError as e:
-            raise RuntimeError(f"Error generating answer: {e}")
+            result["context_docs"] = await aretrieve(question)
+            context = build_context_from_docs(result["context_docs"])
+            result["answer"] = await agenerate_answer(question, context, stats=result["stats"])
+        except (ValueError, RuntimeError) as e:
+            result["error"] = str(e)
+        return result
 
-    return retriever, generate_answer
\ No newline at end of file
+    return await asyncio.gather(*(answer(question) for question in questions))
@@ -1,19 +1,28 @@
 import yaml
 from datetime import datetime
 import os
+import json
+import asyncio
+import argparse
+from functools import lru_cache
 from rag_pipeline import (
-    create_retrieval_qa_chain,
+    build_context_from_docs,
+    create_async_retrieval_qa_chain,
     normalize_path
 )
-from vector_store import create_vector_store
-from preprocessing import load_documents
-from chunking import split_documents
-from ollama_query import ollama_query
+from indexing import update_vector_store
+from ollama_query import ollama_query, AsyncOllamaClient
 from langchain.schema import Document
 from tqdm import tqdm
 import time
 import re
 
+QUESTIONS_FILE = "/Users/sebastienstagno/ICAM/Machine Learning/ragnar/docs_references/evaluation/questions.yaml"
+METHOD_FILE = "/Users/sebastienstagno/ICAM/Machine Learning/ragnar/docs_references/evaluation/methode.md"
+DEFAULT_SOURCE_PATH = "/Users/sebastienstagno/ICAM/Machine Learning/ragnar/dev_data"
+CHECKPOINT_FILENAME = "results.jsonl"
+DEFAULT_EVALUATION_WORKERS = 4  # questions évaluées simultanément (à aligner sur OLLAMA_NUM_PARALLEL)
+
 def load_questions_with_headers(file_path):
     """
     Charge les questions à partir d'un fichier texte, en conservant les en-têtes.
@@ -66,15 +75,11 @@ def load_questions_from_yaml(yaml_file):
     return questions
 
     
-def evaluate_answer_by_llama(question, answer):
+def build_auto_evaluation_prompt(question, answer):
     """
-    Demande à Llama d'auto-évaluer sa réponse générée.
-
-    :param question: La question posée
-    :param answer: La réponse générée
-    :return: La note d'évaluation sur une échelle de 1 à 20 et l'explication.
+    Crée le prompt demandant à Llama d'auto-évaluer sa réponse générée.
     """
-    prompt = f"""
+    return f"""
     Voici la réponse générée à la question suivante : {question}
     La réponse générée est : {answer}
 
@@ -89,8 +94,25 @@ def evaluate_answer_by_llama(question, answer):
     - Explication : [une explication détaillée de ta note]
     """
 
-    evaluation = ollama_query(prompt)
-    
+
+def evaluate_answer_by_llama(question, answer):
+    """
+    Demande à Llama d'auto-évaluer sa réponse générée.
+
+    :param question: La question posée
+    :param answer: La réponse générée
+    :return: La note d'évaluation sur une échelle de 1 à 20 et l'explication.
+    """
+    evaluation = ollama_query(build_auto_evaluation_prompt(question, answer))
+    return parse_auto_evaluation(question, evaluation)
+
+
+def parse_auto_evaluation(question, evaluation):
+    """
+    Extrait la note et l'explication de l'auto-évaluation renvoyée par Llama.
+
+    :return: La note d'évaluation sur une échelle de 1 à 20 et l'explication.
+    """
     # Séparer la note et l'explication dans la réponse
     try:
         note_part, explanation = evaluation.split('Explication :')
@@ -109,14 +131,22 @@ def evaluate_answer_by_llama(question, answer):
         return 0, "Erreur dans l'évaluation"
 
 
+@lru_cache(maxsize=None)
+def load_evaluation_method(method_file=METHOD_FILE):
+    """
+    Lit la méthodologie d'évaluation une seule fois pour toute la campagne.
+    """
+    with open(method_file, "r", encoding="utf-8") as file:
+        return file.read()
+
+
 def generate_detailed_evaluation_prompt(question, generated_answer, expected_answer, used_docs, reference_docs):
     """
     Crée un prompt pour évaluer la réponse générée par le modèle Llama3.2, en se basant sur les critères du fichier .md.
     Ce prompt renvoie une évaluation complète (détaillée) de la réponse générée.
     """
     # Charger la méthodologie pour l'évaluation des réponses
-    with open("/Users/sebastienstagno/ICAM/Machine Learning/ragnar/docs_references/evaluation/methode.md", "r", encoding="utf-8") as file:
-        method_content = file.read()
+    method_content = load_evaluation_method()
 
     # Préparer la liste des documents utilisés et de référence
     used_document_titles = [doc.strip() for doc in used_docs]
@@ -196,36 +226,180 @@ def extract_metrics_from_evaluation_result(evaluation_result):
 
     return metrics
 
+def load_checkpoint(checkpoint_path):
+    """
+    Charge les résultats déjà enregistrés d'une campagne d'évaluation (une question par ligne).
+
+    :param checkpoint_path: Chemin du fichier JSONL de la campagne.
+    :return: La liste des résultats, dans l'ordre des questions. Une dernière ligne tronquée
+             (campagne interrompue pendant l'écriture) est ignorée.
+    """
+    records = []
+    if not os.path.exists(checkpoint_path):
+        return records
+    with open(checkpoint_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                print(f"Ligne incomplète ignorée dans '{checkpoint_path}'")
+    return sorted(records, key=lambda record: record["index"])
+
+
+async def evaluate_question(index, q, aretrieve, agenerate_answer, client):
+    """
+    Évalue une question : recherche des documents, génération de la réponse, puis les deux
+    évaluations par Llama (menées en parallèle). Chaque étape est chronométrée.
+
+    :return: Le résultat de la question, prêt à être enregistré, ou None si aucun document n'a été trouvé.
+    """
+    question = q["question"]
+    timings = {}
+
+    start = time.perf_counter()
+    context_docs = await aretrieve(question)
+    timings["retrieve"] = time.perf_counter() - start
+    if not context_docs:
+        print(f"Aucun document pertinent trouvé pour la question {index}.")
+        return None
+
+    # Préparer les informations sur les documents
+    document_titles = [doc.metadata.get('title', 'Titre inconnu') for doc in context_docs]
+    document_dates = [doc.metadata.get('date', 'Date inconnue') for doc in context_docs]
+    document_info = "\n".join([f"- {title} ({date})" for title, date in zip(document_titles, document_dates)])
+
+    start = time.perf_counter()
+    # Même contexte que l'application : dédoublonné, fusionné et limité en tokens
+    context = build_context_from_docs(context_docs)
+    generation_stats = {}
+    generated_answer = await agenerate_answer(question, context, stats=generation_stats)
+    timings["generate"] = time.perf_counter() - start
+
+    # Auto-évaluation et évaluation détaillée sont indépendantes : elles partent ensemble
+    start = time.perf_counter()
+    auto_evaluation_result, detailed_evaluation = await asyncio.gather(
+        client.generate(build_auto_evaluation_prompt(question, generated_answer)),
+        client.generate(generate_detailed_evaluation_prompt(question, generated_answer, q["expected_answer"],
+                                                            document_titles, q["documents"])),
+    )
+    timings["judge"] = time.perf_counter() - start
+    auto_evaluation, auto_explanation = parse_auto_evaluation(question, auto_evaluation_result)
+
+    return {
+        "index": index,
+        "question": question,
+        "auto_evaluation": auto_evaluation,
+        "auto_explanation": auto_explanation,
+        "generated_answer": generated_answer,
+        "expected_answer": q["expected_answer"],
+        "evaluation_result": detailed_evaluation,
+        "document_info": document_info,
+        "timings": timings,
+        "generation_tokens": generation_stats.get("eval_count"),
+        **extract_metrics_from_evaluation_result(detailed_evaluation),
+    }
+
+
+async def run_evaluation(vector_store, questions, checkpoint_path, workers=DEFAULT_EVALUATION_WORKERS):
+    """
+    Évalue les questions en parallèle et enregistre chaque résultat dès qu'il est prêt dans le
+    fichier JSONL de la campagne. Les questions déjà présentes dans ce fichier sont ignorées :
+    une campagne interrompue reprend là où elle s'était arrêtée.
+
+    :param vector_store: La base vectorielle interrogée.
+    :param questions: Les questions chargées par load_questions_from_yaml.
+    :param checkpoint_path: Fichier JSONL des résultats.
+    :param workers: Nombre de questions (et de requêtes Ollama) traitées simultanément.
+    :return: Le nombre de questions en échec lors de cette exécution.
+    """
+    done = {record["index"] for record in load_checkpoint(checkpoint_path)}
+    todo = [(i, q) for i, q in enumerate(questions, 1) if i not in done]
+    if done:
+        print(f"Reprise de la campagne : {len(done)} questions déjà évaluées, {len(todo)} restantes.")
+
+    failures = 0
+    semaphore = asyncio.Semaphore(workers)
+    async with AsyncOllamaClient(max_concurrency=workers) as client:
+        aretrieve, agenerate_answer = create_async_retrieval_qa_chain(vector_store, client)
+        with open(checkpoint_path, "a", encoding="utf-8") as checkpoint, \
+                tqdm(total=len(questions), initial=len(done), desc="Traitement des questions") as progress:
+
+            async def evaluate(i, q):
+                nonlocal failures
+                async with semaphore:
+                    try:
+                        record = await evaluate_question(i, q, aretrieve, agenerate_answer, client)
+                    except (ValueError, RuntimeError) as e:
+                        print(f"Erreur pour la question {i} : {e}")
+                        failures += 1
+                        record = None
+                if record is not None:
+                    checkpoint.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    checkpoint.flush()
+                progress.update(1)
+
+            await asyncio.gather(*(evaluate(i, q) for i, q in todo))
+        print(f"Appels Ollama : {client.metrics_summary()}")
+    return failures
+
+
+def write_evaluation_file(evaluation_file, timestamp, evaluation_results):
+    """
+    Écrit le rapport détaillé lisible de la campagne à partir des résultats enregistrés.
+    """
+    with open(evaluation_file, "w", encoding="utf-8") as eval_f:
+        eval_f.write(f"Évaluation réalisée le : {timestamp}\n\n")
+        for result in evaluation_results:
+            eval_f.write(f"Question {result['index']}: {result['question']}\n")
+            eval_f.write(f"Réponse générée : {result['generated_answer']}\n")
+            eval_f.write(f"Réponse attendue : {result['expected_answer']}\n")
+            eval_f.write(f"Documents utilisés : {result['document_info']}\n")
+            eval_f.write(f"Évaluation par Llama (auto-évaluation) : {result['auto_evaluation']} - {result['auto_explanation']}\n")
+            eval_f.write(f"Évaluation complète par Llama : {result['evaluation_result']}\n")
+            eval_f.write(f"Exactitude : {result['accuracy']:.2f}%\n")
+            eval_f.write(f"Complétude : {result['completeness']:.2f}%\n")
+            eval_f.write(f"Clarté : {result['clarity']:.2f}%\n")
+            eval_f.write(f"Pertinence : {result['relevance']:.2f}%\n")
+            eval_f.write(f"Utilisation des bons documents : {result['doc_matching']:.2f}%\n")
+            timings = result["timings"]
+            eval_f.write(f"Durées : recherche {timings['retrieve']:.2f}s, génération {timings['generate']:.2f}s, "
+                         f"évaluation {timings['judge']:.2f}s\n\n")
+
+
 def create_summary_report(evaluation_file, evaluation_results):
     """
     Crée un fichier récapitulatif contenant l'évaluation globale, les notes par métrique et le score global.
     
     :param evaluation_file: Le fichier où enregistrer l'évaluation détaillée.
-    :param evaluation_results: Les résultats d'évaluation contenant les notes pour chaque question et chaque critère.
+    :param evaluation_results: Les résultats d'évaluation contenant les notes pour chaque question et chaque critère
+                               (tels qu'enregistrés dans le fichier JSONL de la campagne).
     """
-    # Calcul de l'auto-évaluation globale, des moyennes et du score global
-    total_auto_eval = sum([result["auto_evaluation"] for result in evaluation_results])  # Maintenant on peut sommer les notes
-    total_accuracy = sum([result["accuracy"] for result in evaluation_results])
-    total_completeness = sum([result["completeness"] for result in evaluation_results])
-    total_clarity = sum([result["clarity"] for result in evaluation_results])
-    total_relevance = sum([result["relevance"] for result in evaluation_results])
-    total_doc_matching = sum([result["doc_matching"] for result in evaluation_results])
-
     num_questions = len(evaluation_results)
+    if not num_questions:
+        print("Aucun résultat à résumer.")
+        return
+
+    def average(key):
+        return sum(result[key] for result in evaluation_results) / num_questions
 
-    avg_auto_eval = total_auto_eval / num_questions
-    avg_accuracy = total_accuracy / num_questions
-    avg_completeness = total_completeness / num_questions
-    avg_clarity = total_clarity / num_questions
-    avg_relevance = total_relevance / num_questions
-    avg_doc_matching = total_doc_matching / num_questions
+    avg_auto_eval = average("auto_evaluation")
+    avg_accuracy = average("accuracy")
+    avg_completeness = average("completeness")
+    avg_clarity = average("clarity")
+    avg_relevance = average("relevance")
+    avg_doc_matching = average("doc_matching")
 
     global_score = (avg_accuracy + avg_completeness + avg_clarity + avg_relevance + avg_doc_matching) / 5
 
+    # Durée moyenne de chaque étape
+    avg_timings = {stage: sum(result["timings"][stage] for result in evaluation_results) / num_questions
+                   for stage in ("retrieve", "generate", "judge")}
+
     # Enregistrement des résultats dans le fichier récapitulatif
     summary_file = evaluation_file.replace("evaluation", "summary")
     with open(summary_file, "w", encoding="utf-8") as f:
         f.write(f"Récapitulatif de l'évaluation du RAG\n\n")
+        f.write(f"Questions évaluées : {num_questions}\n")
         f.write(f"Note moyenne de l'auto-évaluation : {avg_auto_eval:.2f}/20\n")
         f.write(f"Précision moyenne : {avg_accuracy:.2f}%\n")
         f.write(f"Complétude moyenne : {avg_completeness:.2f}%\n")
@@ -233,14 +407,26 @@ def create_summary_report(evaluation_file, evaluation_results):
         f.write(f"Pertinence moyenne : {avg_relevance:.2f}%\n")
         f.write(f"Utilisation des bons documents moyenne : {avg_doc_matching:.2f}%\n")
         f.write(f"Score global moyen : {global_score:.2f}%\n")
+        f.write(f"Durée moyenne de recherche : {avg_timings['retrieve']:.2f}s\n")
+        f.write(f"Durée moyenne de génération : {avg_timings['generate']:.2f}s\n")
+        f.write(f"Durée moyenne d'évaluation : {avg_timings['judge']:.2f}s\n")
     
     print(f"Résumé global enregistré dans '{summary_file}'")
 
 def main():
+    parser = argparse.ArgumentParser(description="Évaluation du RAG sur les questions de référence.")
+    parser.add_argument("--questions", default=QUESTIONS_FILE, help="Fichier YAML des questions.")
+    parser.add_argument("--source", help="Dossier contenant les documents.")
+    parser.add_argument("--workers", type=int, default=DEFAULT_EVALUATION_WORKERS,
+                        help="Nombre de questions évaluées simultanément.")
+    parser.add_argument("--resume", metavar="RUN_DIR",
+                        help="Dossier d'une campagne interrompue (results/run_...) à reprendre.")
+    args = parser.parse_args()
+
     print("=== Test du RAG ===")
 
     # Charger les questions
-    questions_file = "/Users/sebastienstagno/ICAM/Machine Learning/ragnar/docs_references/evaluation/questions.yaml"
+    questions_file = args.questions
     print(f"Chargement des questions depuis {questions_file}...")
     questions = load_questions_from_yaml(questions_file)
 
@@ -251,105 +437,43 @@ def main():
     print(f"{len(questions)} questions chargées avec succès.\n")
 
     # Chemin du dossier de documents
-    source_path = input("Entrez le chemin du dossier contenant les documents (laisser vide pour le chemin par défaut) : ").strip()
+    source_path = args.source
     if not source_path:
-        source_path = '/Users/sebastienstagno/ICAM/Machine Learning/ragnar/dev_data'
+        source_path = input("Entrez le chemin du dossier contenant les documents (laisser vide pour le chemin par défaut) : ").strip()
+    if not source_path:
+        source_path = DEFAULT_SOURCE_PATH
         print(f"Chemin par défaut utilisé : {source_path}")
 
-    print(f"Chargement des documents depuis {source_path}...")
-    documents = load_documents(source_path, is_directory=True)
-    if not documents:
-        print("Aucun document valide chargé.")
-        return
-    print(f"{len(documents)} documents chargés avec succès.")
-
-    # Créer les chunks à partir des documents
-    chunks = split_documents(documents)
-    if not chunks:
-        print("Aucun chunk valide généré.")
-        return
-    print(f"{len(chunks)} chunks générés.")
-
     try:
-        # Créer la base vectorielle FAISS
-        print("Création de la base vectorielle FAISS...")
-        vector_store = create_vector_store(chunks)
-        print("Base vectorielle FAISS créée avec succès.")
-    except RuntimeError as e:
+        # Mettre à jour la base vectorielle FAISS : à la reprise d'une campagne, rien n'est réindexé
+        print(f"Indexation des documents de {source_path}...")
+        vector_store, stats = update_vector_store(normalize_path(source_path))
+        print(f"Base vectorielle FAISS prête ({stats['added']} fichiers ajoutés, {stats['changed']} modifiés, "
+              f"{stats['unchanged']} inchangés).")
+    except (ValueError, RuntimeError) as e:
         print(f"Erreur lors de la création de la base vectorielle FAISS : {e}")
         return
 
-    # Créer la chaîne de récupération et de génération de réponses
-    retriever, generate_answer = create_retrieval_qa_chain(vector_store)
-    print("Chaîne de récupération et de génération de réponses prête.")
-
     # Préparer le répertoire de résultats
-    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    results_dir = os.path.join("results", f"run_{timestamp}")
+    if args.resume:
+        results_dir = args.resume
+        timestamp = os.path.basename(os.path.normpath(results_dir)).replace("run_", "")
+    else:
+        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        results_dir = os.path.join("results", f"run_{timestamp}")
     os.makedirs(results_dir, exist_ok=True)
-
-    evaluation_file = os.path.join(results_dir, f"evaluation_{timestamp}.txt")
-    with open(evaluation_file, "w", encoding="utf-8") as eval_f:
-        eval_f.write(f"Évaluation réalisée le : {timestamp}\n\n")
-
-    evaluation_results = []
+    checkpoint_path = os.path.join(results_dir, CHECKPOINT_FILENAME)
 
     # Lancement du traitement des questions
-    for i, q in tqdm(enumerate(questions, 1), total=len(questions), desc="Traitement des questions"):
-        question = q["question"]
-        expected_answer = q["expected_answer"]
-        reference_docs = q["documents"]
-
-        context_docs = retriever.invoke(question)
-        if not context_docs:
-            print(f"Aucun document pertinent trouvé pour la question {i}.")
-            continue
-
-        # Préparer les informations sur les documents
-        document_titles = [doc.metadata.get('title', 'Titre inconnu') for doc in context_docs]
-        document_dates = [doc.metadata.get('date', 'Date inconnue') for doc in context_docs]
-        document_info = "\n".join([f"- {title} ({date})" for title, date in zip(document_titles, document_dates)])
-
-        context = "\n".join([doc.page_content for doc in context_docs])
-        generated_answer = generate_answer(question, context)
-
-        # Obtenir l'auto-évaluation de la réponse
-        auto_evaluation, auto_explanation = evaluate_answer_by_llama(question, generated_answer)
-
-        # Obtenir les métriques de l'évaluation de la réponse générée par Llama
-        detailed_evaluation = ollama_query(generate_detailed_evaluation_prompt(question, generated_answer, expected_answer, document_titles, reference_docs))
-
-        # Extraire les métriques du résultat d'évaluation
-        metrics = extract_metrics_from_evaluation_result(detailed_evaluation)
-
-        # Ajouter toutes les métriques dans les résultats d'évaluation
-        evaluation_results.append({
-            "question": question,
-            "auto_evaluation": auto_evaluation,
-            "auto_explanation": auto_explanation,
-            "generated_answer": generated_answer,
-            "expected_answer": expected_answer,
-            "evaluation_result": detailed_evaluation,
-            "document_info": document_info,
-            **metrics  # Ajout des métriques directement
-        })
-
-        # Sauvegarde des résultats détaillés dans le fichier d'évaluation
-        with open(evaluation_file, "a", encoding="utf-8") as eval_f:
-            eval_f.write(f"Question {i}: {question}\n")
-            eval_f.write(f"Réponse générée : {generated_answer}\n")
-            eval_f.write(f"Réponse attendue : {expected_answer}\n")
-            eval_f.write(f"Documents utilisés : {document_info}\n")
-            eval_f.write(f"Évaluation par Llama (auto-évaluation) : {auto_evaluation} - {auto_explanation}\n")
-            eval_f.write(f"Évaluation complète par Llama : {detailed_evaluation}\n")
-            eval_f.write(f"Exactitude : {metrics['accuracy']:.2f}%\n")
-            eval_f.write(f"Complétude : {metrics['completeness']:.2f}%\n")
-            eval_f.write(f"Clarté : {metrics['clarity']:.2f}%\n")
-            eval_f.write(f"Pertinence : {metrics['relevance']:.2f}%\n")
-            eval_f.write(f"Utilisation des bons documents : {metrics['doc_matching']:.2f}%\n\n")
-
-    # Créer le fichier récapitulatif
+    failures = asyncio.run(run_evaluation(vector_store, questions, checkpoint_path, workers=args.workers))
+    if failures:
+        print(f"{failures} questions en échec : relancez avec --resume {results_dir} pour les reprendre.")
+
+    # Rapports détaillé et récapitulatif, construits à partir des résultats enregistrés
+    evaluation_results = load_checkpoint(checkpoint_path)
+    evaluation_file = os.path.join(results_dir, f"evaluation_{timestamp}.txt")
+    write_evaluation_file(evaluation_file, timestamp, evaluation_results)
     create_summary_report(evaluation_file, evaluation_results)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,175 @@
+"""
+Cross-encoder reranking of retrieved chunks.
+
+The first-stage retriever (FAISS, BM25) ranks chunks by comparing independent embeddings or
+terms. A cross-encoder reads the question and the chunk together and scores their relevance
+much more accurately, but costs one forward pass per pair: it is only applied to a candidate set
+a few times larger than the number of chunks sent to the LLM.
+
+Candidates are scored in batches on the CPU, and the scores are cached per (question, chunk), so
+a repeated question or a chunk seen again among the candidates is not re-scored. The best chunks
+are kept within a score threshold and a token budget, so the prompt gets fewer but better chunks.
+"""
+import time
+import hashlib
+import logging
+
+import numpy as np
+
+from embedding_models import get_cross_encoder, DEFAULT_CROSS_ENCODER_MODEL
+from query_cache import LRUCache, normalize_query
+from context_builder import count_tokens
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+RERANK_BATCH_SIZE = 32
+SCORE_CACHE_SIZE = 8192
+CANDIDATE_FACTOR = 4     # candidates retrieved per chunk kept
+MIN_CANDIDATES = 20
+MAX_CANDIDATES = 50
+
+score_cache = LRUCache(SCORE_CACHE_SIZE)
+_unavailable_models = {}  # model name -> loading error, so a missing model is not retried on every question
+
+
+def candidate_count(k, max_candidates=MAX_CANDIDATES):
+    """
+    Returns the number of candidates to retrieve for reranking when k chunks are kept.
+    """
+    return max(k, min(max(CANDIDATE_FACTOR * k, MIN_CANDIDATES), max_candidates))
+
+
+def _content_key(document):
+    return hashlib.blake2b(document.page_content.encode("utf-8"), digest_size=16).digest()
+
+
+class Reranker:
+    """
+    Scores (question, chunk) pairs with a cross-encoder and keeps the best chunks.
+    """
+
+    def __init__(self, model_name=DEFAULT_CROSS_ENCODER_MODEL, batch_size=RERANK_BATCH_SIZE, device="cpu"):
+        """
+        Parameters:
+        - model_name (str): Cross-encoder model.
+        - batch_size (int): Number of pairs scored per forward pass.
+        - device (str): Torch device.
+        """
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.device = device
+
+    @property
+    def model(self):
+        return get_cross_encoder(self.model_name, self.device)
+
+    def available(self):
+        """
+        Loads the model if needed and tells whether it could be loaded (a failure is remembered).
+        """
+        if self.model_name in _unavailable_models:
+            return False
+        try:
+            self.model
+        except Exception as e:
+            _unavailable_models[self.model_name] = e
+            logger.warning(f"Cross-encoder '{self.model_name}' unavailable, reranking disabled: {e}")
+            return False
+        return True
+
+    def score(self, query, documents):
+        """
+        Returns the relevance score of each document for a question. Only the pairs missing
+        from the score cache go through the model, in batches.
+
+        Parameters:
+        - query (str): The question.
+        - documents (List[Document]): The candidate chunks.
+
+        Returns:
+        - np.ndarray: float32 scores (higher is more relevant), one per document.
+        """
+        question_key = (self.model_name, normalize_query(query))
+        keys = [(question_key, _content_key(document)) for document in documents]
+        scores = np.empty(len(documents), dtype=np.float32)
+        missing = []
+        for i, key in enumerate(keys):
+            cached = score_cache.get(key)
+            if cached is None:
+                missing.append(i)
+            else:
+                scores[i] = cached
+        if missing:
+            start_time = time.perf_counter()
+            predicted = self.model.predict([(query, documents[i].page_content) for i in missing],
+                                           batch_size=self.batch_size, show_progress_bar=False,
+                                           convert_to_numpy=True)
+            for i, value in zip(missing, np.asarray(predicted, dtype=np.float32).reshape(-1)):
+                scores[i] = value
+                score_cache.put(keys[i], float(value))
+            logger.debug(f"Scored {len(missing)} pairs in {time.perf_counter() - start_time:.3f}s")
+        return scores
+
+    def rerank(self, query, documents, top_n=5, min_score=None, max_tokens=None):
+        """
+        Reorders candidate chunks by cross-encoder score and keeps the best ones.
+
+        Parameters:
+        - query (str): The question.
+        - documents (List[Document]): The candidate chunks.
+        - top_n (int): Maximum number of chunks kept.
+        - min_score (float, optional): Chunks scoring below this are dropped (the best one is
+          always kept, so the LLM still gets some context).
+        - max_tokens (int, optional): Stop adding chunks once their size would exceed this
+          many LLM tokens.
+
+        Returns:
+        - List[Tuple[Document, float]]: The kept chunks with their scores, best first.
+        """
+        with span("rerank", candidates=len(documents), model=self.model_name) as rerank_span:
+            hits_before = score_cache.hits
+            scores = self.score(query, documents) if documents else np.empty(0, dtype=np.float32)
+            rerank_span.set(cache_hits=score_cache.hits - hits_before)
+
+            kept, tokens = [], 0
+            for i in np.argsort(-scores, kind="stable")[:top_n]:
+                if kept and min_score is not None and scores[i] < min_score:
+                    break
+                document_tokens = count_tokens(documents[i].page_content)
+                if kept and max_tokens is not None and tokens + document_tokens > max_tokens:
+                    break
+                kept.append((documents[i], float(scores[i])))
+                tokens += document_tokens
+            rerank_span.set(kept=len(kept), tokens=tokens)
+        return kept
+
+
+class RerankingRetriever:
+    """
+    Retriever that reranks the candidates of another retriever (a CachedRetriever fetching
+    `candidate_count(top_n)` chunks) and returns the best ones.
+    """
+
+    def __init__(self, retriever, reranker, top_n=5, min_score=None, max_tokens=None):
+        self.retriever = retriever
+        self.reranker = reranker
+        self.top_n = top_n
+        self.min_score = min_score
+        self.max_tokens = max_tokens
+
+    def invoke(self, query, filters=None):
+        """
+        Returns the chunks relevant to a question, best first.
+
+        Parameters:
+        - query (str): The question.
+        - filters (dict, optional): Metadata filters passed to the first-stage retriever.
+
+        Returns:
+        - List[Document]: The kept chunks.
+        """
+        candidates = self.retriever.invoke(query, filters=filters)
+        return [document for document, _ in self.reranker.rerank(query, candidates, top_n=self.top_n,
+                                                                  min_score=self.min_score,
+                                                                  max_tokens=self.max_tokens)]
@@ -0,0 +1,268 @@
+"""
+Sparse BM25 index over chunk text, used next to the FAISS index for hybrid retrieval.
+
+Dense MiniLM embeddings match the meaning of a question but are weak on exact terms: names,
+dates, amounts ("forfaits électriques", "19 octobre"). BM25 scores the chunks sharing the
+question's terms, and `reciprocal_rank_fusion` merges both rankings.
+
+The inverted index maps each term to NumPy arrays of postings (chunk slot, term frequency), so a
+query is scored with a few vectorized operations per query term rather than a loop over chunks.
+It is saved next to the FAISS index as a NumPy archive (bm25.npz): nothing is pickled.
+"""
+import re
+import math
+import logging
+import unicodedata
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SPARSE_INDEX_FILENAME = "bm25.npz"
+SPARSE_INDEX_FORMAT = 1
+DEFAULT_K1 = 1.5
+DEFAULT_B = 0.75
+DEFAULT_RRF_K = 60
+
+_TOKEN_RE = re.compile(r"\w+")
+_COMBINING_RE = re.compile("[\\u0300-\\u036f]")
+
+# Most frequent French function words: they match nearly every chunk and only make postings longer
+STOPWORDS = frozenset("""
+a au aux avec c ce ces cet cette d dans de des du elle en est et il ils j l la le les leur leurs
+lui m ma mais me mes n ne nous on ou par pas pour qu que qui s sa se ses son sur t ta te tes
+un une vos votre vous y
+""".split())
+
+
+def tokenize(text):
+    """
+    Splits a text into index terms: case-folded, accents removed, French stopwords dropped.
+    Numbers are kept as terms, so dates and amounts can be matched.
+    """
+    text = _COMBINING_RE.sub("", unicodedata.normalize("NFKD", text.casefold()))
+    return [term for term in _TOKEN_RE.findall(text) if term not in STOPWORDS]
+
+
+def reciprocal_rank_fusion(rankings, k=DEFAULT_RRF_K):
+    """
+    Merges several rankings of the same items with reciprocal rank fusion: each item scores
+    the sum of 1 / (k + rank) over the rankings it appears in.
+
+    Parameters:
+    - rankings (List[List]): Rankings of item ids, best first.
+    - k (int): Damping constant; larger values flatten the weight of the top ranks.
+
+    Returns:
+    - List[Tuple]: (id, fused score) pairs, best first.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda pair: pair[1], reverse=True)
+
+
+class BM25Index:
+    """
+    Incremental BM25 inverted index keyed by docstore id.
+
+    Additions are buffered and removals only mark their chunks as deleted; both are merged
+    into the posting arrays on the next search or save.
+    """
+
+    def __init__(self, k1=DEFAULT_K1, b=DEFAULT_B):
+        self.k1 = k1
+        self.b = b
+        self._vocabulary = {}    # term -> term id
+        self._postings = []      # term id -> (slots int32 array, term frequencies float32 array)
+        self._doc_ids = []       # slot -> docstore id
+        self._slots = {}         # docstore id -> slot
+        self._lengths = np.empty(0, dtype=np.float32)
+        self._alive = np.empty(0, dtype=bool)
+        self._pending = {}       # term id -> ([slots], [term frequencies]) not merged yet
+        self._pending_lengths = []
+        self._removed = False
+        self._norms = None       # per slot k1 * (1 - b + b * length / average length)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._slots
+
+    def add(self, ids, texts):
+        """
+        Indexes chunks.
+
+        Parameters:
+        - ids (List[str]): Docstore ids, one per text. Ids already indexed are replaced.
+        - texts (List[str]): Chunk texts.
+        """
+        with self._lock:
+            replaced = [doc_id for doc_id in ids if doc_id in self._slots]
+            if replaced:
+                self._remove(replaced)  # Only then merge the pending postings: batched adds stay cheap
+            for doc_id, text in zip(ids, texts):
+                slot = len(self._doc_ids)
+                self._doc_ids.append(doc_id)
+                self._slots[doc_id] = slot
+                terms = tokenize(text)
+                self._pending_lengths.append(len(terms))
+                frequencies = {}
+                for term in terms:
+                    frequencies[term] = frequencies.get(term, 0) + 1
+                for term, frequency in frequencies.items():
+                    term_id = self._vocabulary.setdefault(term, len(self._vocabulary))
+                    slots, tfs = self._pending.setdefault(term_id, ([], []))
+                    slots.append(slot)
+                    tfs.append(frequency)
+            self._norms = None
+
+    def remove(self, ids):
+        """
+        Removes chunks from the index. Unknown ids are ignored.
+        """
+        with self._lock:
+            self._remove(ids)
+
+    def _remove(self, ids):
+        self._merge_pending()
+        for doc_id in ids:
+            slot = self._slots.pop(doc_id, None)
+            if slot is not None:
+                self._alive[slot] = False
+                self._removed = True
+        self._norms = None
+
+    def _merge_pending(self):
+        if self._pending_lengths:
+            self._lengths = np.concatenate([self._lengths, np.asarray(self._pending_lengths, dtype=np.float32)])
+            self._alive = np.concatenate([self._alive, np.ones(len(self._pending_lengths), dtype=bool)])
+            self._pending_lengths = []
+        empty = (np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32))
+        self._postings.extend(empty for _ in range(len(self._vocabulary) - len(self._postings)))
+        for term_id, (slots, tfs) in self._pending.items():
+            old_slots, old_tfs = self._postings[term_id]
+            self._postings[term_id] = (np.concatenate([old_slots, np.asarray(slots, dtype=np.int32)]),
+                                       np.concatenate([old_tfs, np.asarray(tfs, dtype=np.float32)]))
+        self._pending = {}
+
+    def _compact(self):
+        # Drops the removed chunks from the postings and renumbers the remaining slots
+        new_slots = np.cumsum(self._alive, dtype=np.int64).astype(np.int32) - 1
+        for term_id, (slots, tfs) in enumerate(self._postings):
+            keep = self._alive[slots]
+            self._postings[term_id] = (new_slots[slots[keep]], tfs[keep])
+        self._doc_ids = [doc_id for doc_id, alive in zip(self._doc_ids, self._alive) if alive]
+        self._slots = {doc_id: slot for slot, doc_id in enumerate(self._doc_ids)}
+        self._lengths = self._lengths[self._alive]
+        self._alive = np.ones(len(self._doc_ids), dtype=bool)
+        self._removed = False
+
+    def _refresh(self):
+        with self._lock:
+            self._merge_pending()
+            if self._removed:
+                self._compact()
+            if self._norms is None and len(self._doc_ids):
+                average_length = max(float(self._lengths.mean()), 1.0)
+                self._norms = self.k1 * (1.0 - self.b + self.b * self._lengths / average_length)
+            return self._norms
+
+    def search(self, query, k=10, allowed_ids=None):
+        """
+        Returns the chunks with the highest BM25 score for a query.
+
+        Parameters:
+        - query (str): The question.
+        - k (int): Maximum number of results.
+        - allowed_ids (Iterable[str], optional): Only return these chunks (metadata filters).
+
+        Returns:
+        - List[Tuple[str, float]]: (docstore id, score) pairs, best first. Chunks sharing no
+          term with the query are not returned.
+        """
+        norms = self._refresh()
+        if norms is None:
+            return []
+        n_docs = len(norms)
+        scores = np.zeros(n_docs, dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_id = self._vocabulary.get(term)
+            if term_id is None or term_id >= len(self._postings):
+                continue
+            slots, tfs = self._postings[term_id]
+            if not len(slots):
+                continue
+            idf = math.log(1.0 + (n_docs - len(slots) + 0.5) / (len(slots) + 0.5))
+            # A chunk appears at most once in a term's postings, so the fancy-indexed add is exact
+            scores[slots] += idf * tfs * (self.k1 + 1.0) / (tfs + norms[slots])
+        if allowed_ids is not None:
+            allowed = np.zeros(n_docs, dtype=bool)
+            allowed[[self._slots[doc_id] for doc_id in allowed_ids if doc_id in self._slots]] = True
+            scores[~allowed] = 0.0
+
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(self._doc_ids[slot], float(scores[slot])) for slot in candidates]
+
+    @classmethod
+    def from_documents(cls, documents, **params):
+        """
+        Builds an index from (docstore id, Document) pairs.
+        """
+        index = cls(**params)
+        documents = list(documents)
+        index.add([doc_id for doc_id, _ in documents], [doc.page_content for _, doc in documents])
+        return index
+
+    def save(self, path):
+        """
+        Writes the index to a NumPy archive.
+        """
+        self._refresh()
+        with self._lock:
+            terms = sorted(self._vocabulary, key=self._vocabulary.get)
+            sizes = [len(slots) for slots, _ in self._postings]
+            offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+            np.cumsum(sizes, out=offsets[1:])
+            with open(path, "wb") as f:
+                np.savez(
+                    f,
+                    format=np.array(SPARSE_INDEX_FORMAT),
+                    params=np.array([self.k1, self.b], dtype=np.float64),
+                    terms=np.array(terms, dtype=str),
+                    offsets=offsets,
+                    slots=np.concatenate([slots for slots, _ in self._postings] or [np.empty(0, np.int32)]),
+                    tfs=np.concatenate([tfs for _, tfs in self._postings] or [np.empty(0, np.float32)]),
+                    doc_ids=np.array(self._doc_ids, dtype=str),
+                    lengths=self._lengths,
+                )
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads an index written by `save`.
+        """
+        with np.load(path, allow_pickle=False) as archive:
+            if int(archive["format"]) != SPARSE_INDEX_FORMAT:
+                raise ValueError(f"Unsupported sparse index format in {path}: {int(archive['format'])}")
+            k1, b = archive["params"].tolist()
+            index = cls(k1=k1, b=b)
+            terms = archive["terms"].tolist()
+            offsets = archive["offsets"]
+            slots = archive["slots"]
+            tfs = archive["tfs"]
+            index._vocabulary = {term: term_id for term_id, term in enumerate(terms)}
+            index._postings = [(slots[offsets[i]:offsets[i + 1]], tfs[offsets[i]:offsets[i + 1]])
+                               for i in range(len(terms))]
+            index._doc_ids = archive["doc_ids"].tolist()
+            index._slots = {doc_id: slot for slot, doc_id in enumerate(index._doc_ids)}
+            index._lengths = archive["lengths"]
+            index._alive = np.ones(len(index._doc_ids), dtype=bool)
+        return index
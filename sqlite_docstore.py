@@ -0,0 +1,184 @@
+"""
+SQLite-backed docstore for the FAISS vector store.
+
+Chunks (text and metadata as JSON) and the FAISS label -> docstore id table live in a single
+SQLite file next to the index. Nothing is unpickled when the store is opened: a chunk is read
+only when a search returns it, and several processes can read the same file, sharing its pages
+through the OS page cache.
+
+Writes happen inside an open transaction, committed when the vector store is saved.
+"""
+import json
+import sqlite3
+import threading
+from collections.abc import MutableMapping
+
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain.schema import Document
+
+DOCSTORE_FILENAME = "docstore.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id TEXT PRIMARY KEY,
+    page_content TEXT NOT NULL,
+    metadata TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS labels (
+    label INTEGER PRIMARY KEY,
+    id TEXT NOT NULL
+);
+"""
+
+
+class SQLiteConnection:
+    """
+    SQLite connection shared by the docstore and the label mapping of one vector store.
+    Access is serialized with a lock, as Streamlit runs scripts in several threads.
+    """
+
+    def __init__(self, path, read_only=False):
+        self.path = path
+        self.lock = threading.RLock()
+        if read_only:
+            self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.executescript(_SCHEMA)
+            self.conn.commit()
+
+    def execute(self, query, params=()):
+        with self.lock:
+            return self.conn.execute(query, params).fetchall()
+
+    def executemany(self, query, rows):
+        with self.lock:
+            self.conn.executemany(query, rows)
+
+    def commit(self):
+        with self.lock:
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class SQLiteDocstore(Docstore, AddableMixin):
+    """
+    Docstore reading and writing chunks in the `documents` table.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def search(self, search):
+        rows = self.connection.execute("SELECT page_content, metadata FROM documents WHERE id = ?", (search,))
+        if not rows:
+            return f"ID {search} not found."
+        page_content, metadata = rows[0]
+        return Document(id=search, page_content=page_content, metadata=json.loads(metadata))
+
+    def add(self, texts):
+        try:
+            self.connection.executemany(
+                "INSERT INTO documents (id, page_content, metadata) VALUES (?, ?, ?)",
+                [(doc_id, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False))
+                 for doc_id, doc in texts.items()],
+            )
+        except sqlite3.IntegrityError as e:
+            raise ValueError(f"Tried to add ids that already exist: {e}")
+
+    def delete(self, ids):
+        self.connection.executemany("DELETE FROM documents WHERE id = ?", [(doc_id,) for doc_id in ids])
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM documents")[0][0]
+
+    def items(self):
+        """
+        Returns all (id, Document) pairs. Reads the whole table: meant for exports, not queries.
+        """
+        return [(doc_id, Document(page_content=page_content, metadata=json.loads(metadata)))
+                for doc_id, page_content, metadata
+                in self.connection.execute("SELECT id, page_content, metadata FROM documents")]
+
+    def iter_batches(self, batch_size=1000):
+        """
+        Yields all (id, Document) pairs in lists of at most `batch_size`, for full scans that
+        must not hold the whole table in memory.
+        """
+        last_rowid = 0
+        while True:
+            rows = self.connection.execute("SELECT rowid, id, page_content, metadata FROM documents "
+                                           "WHERE rowid > ? ORDER BY rowid LIMIT ?", (last_rowid, batch_size))
+            if not rows:
+                return
+            last_rowid = rows[-1][0]
+            yield [(doc_id, Document(page_content=page_content, metadata=json.loads(metadata)))
+                   for _, doc_id, page_content, metadata in rows]
+
+
+class SQLiteIndexMapping(MutableMapping):
+    """
+    FAISS label -> docstore id mapping stored in the `labels` table, used as
+    `FAISS.index_to_docstore_id`. Lookups hit SQLite instead of a dict loaded at startup.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __getitem__(self, label):
+        rows = self.connection.execute("SELECT id FROM labels WHERE label = ?", (int(label),))
+        if not rows:
+            raise KeyError(label)
+        return rows[0][0]
+
+    def __setitem__(self, label, doc_id):
+        self.connection.execute("INSERT OR REPLACE INTO labels (label, id) VALUES (?, ?)", (int(label), doc_id))
+
+    def __delitem__(self, label):
+        if label not in self:
+            raise KeyError(label)
+        self.connection.execute("DELETE FROM labels WHERE label = ?", (int(label),))
+
+    def __contains__(self, label):
+        return bool(self.connection.execute("SELECT 1 FROM labels WHERE label = ?", (int(label),)))
+
+    def __iter__(self):
+        return iter([row[0] for row in self.connection.execute("SELECT label FROM labels ORDER BY label")])
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM labels")[0][0]
+
+    # Single-query versions of the Mapping helpers, which would otherwise issue one query per key
+    def items(self):
+        return self.connection.execute("SELECT label, id FROM labels ORDER BY label")
+
+    def values(self):
+        return [row[1] for row in self.items()]
+
+    def update(self, other=(), **kwargs):
+        pairs = dict(other, **kwargs)
+        self.connection.executemany("INSERT OR REPLACE INTO labels (label, id) VALUES (?, ?)",
+                                    [(int(label), doc_id) for label, doc_id in pairs.items()])
+
+
+def write_docstore(path, documents, index_to_docstore_id):
+    """
+    Writes a complete docstore file from any docstore and label mapping.
+
+    Parameters:
+    - path (str): Path of the SQLite file to create (must not exist).
+    - documents (Iterable[Tuple[str, Document]]): (id, chunk) pairs.
+    - index_to_docstore_id (Mapping[int, str]): FAISS label -> docstore id.
+    """
+    connection = SQLiteConnection(path)
+    connection.executemany(
+        "INSERT INTO documents (id, page_content, metadata) VALUES (?, ?, ?)",
+        ((doc_id, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False)) for doc_id, doc in documents),
+    )
+    connection.executemany("INSERT INTO labels (label, id) VALUES (?, ?)",
+                           ((int(label), doc_id) for label, doc_id in index_to_docstore_id.items()))
+    connection.commit()
+    connection.close()
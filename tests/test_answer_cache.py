@@ -0,0 +1,112 @@
+"""
+Semantic answer cache: several instances (Streamlit sessions, CLI runs) share one SQLite file.
+"""
+import hashlib
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from langchain.schema import Document
+
+from answer_cache import AnswerCache, ANSWER_CACHE_FILENAME
+from sparse_index import tokenize
+
+DIMENSION = 64
+
+
+class BagOfWordsEmbeddings:
+    """
+    Deterministic embeddings: questions with the same words get the same vector.
+    """
+    model_name = "test-bag-of-words"
+
+    def embed_query(self, text):
+        vector = np.full(DIMENSION, 0.01, dtype=np.float32)
+        for term in tokenize(text):
+            vector[int(hashlib.md5(term.encode("utf-8")).hexdigest()[:8], 16) % DIMENSION] += 1
+        return vector.tolist()
+
+
+@pytest.fixture
+def vector_store():
+    return SimpleNamespace(index=SimpleNamespace(d=DIMENSION), embedding_function=BagOfWordsEmbeddings(),
+                           docstore=None, index_version="v1")
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / ANSWER_CACHE_FILENAME)
+
+
+def sources(text="Le budget est voté en septembre."):
+    return [Document(id="chunk-1", page_content=text, metadata={"source": "budget.txt"})]
+
+
+def test_hit_on_the_same_question(cache_path, vector_store):
+    cache = AnswerCache(cache_path, vector_store)
+    cache.put("Quel est le budget ?", "Dix mille euros.", sources())
+
+    answer, documents = cache.get("quel est le  budget ?")
+
+    assert answer == "Dix mille euros."
+    assert [document.id for document in documents] == ["chunk-1"]
+
+
+def test_entry_replaced_by_another_instance_is_a_miss(cache_path, vector_store):
+    first = AnswerCache(cache_path, vector_store)
+    first.put("Quel est le budget ?", "Dix mille euros.", sources())
+    first.put("Qui préside l'association ?", "Marie Dupont.", sources("Marie Dupont préside."))
+    second = AnswerCache(cache_path, vector_store)
+    assert second.get("Quel est le budget ?")[0] == "Dix mille euros."
+
+    # The first instance replaces the row the second one has in its index
+    first.put("Quel est le budget ?", "Douze mille euros.", sources())
+
+    assert second.get("Quel est le budget ?") is None
+    assert len(second) == 1
+    assert first.get("Quel est le budget ?")[0] == "Douze mille euros."
+    assert AnswerCache(cache_path, vector_store).get("Quel est le budget ?")[0] == "Douze mille euros."
+
+
+def test_reused_row_id_does_not_serve_another_question(cache_path, vector_store):
+    first = AnswerCache(cache_path, vector_store)
+    first.put("Quel est le budget ?", "Dix mille euros.", sources())
+    second = AnswerCache(cache_path, vector_store)
+
+    # After a clear, SQLite gives the freed id to the next row
+    first.clear()
+    first.put("Qui préside l'association ?", "Marie Dupont.", sources("Marie Dupont préside."))
+
+    assert second.get("Quel est le budget ?") is None
+
+
+def test_entry_evicted_by_another_instance_is_a_miss(cache_path, vector_store):
+    first = AnswerCache(cache_path, vector_store)
+    first.put("Quel est le budget ?", "Dix mille euros.", sources())
+    second = AnswerCache(cache_path, vector_store, max_entries=1)
+
+    second.put("Qui préside l'association ?", "Marie Dupont.", sources("Marie Dupont préside."))
+
+    assert first.get("Quel est le budget ?") is None
+    assert second.get("Qui préside l'association ?")[0] == "Marie Dupont."
+    assert second.stats()["evicted"] == 1
+
+
+@pytest.mark.parametrize("cached, asked", [
+    ("Réunion de septembre", "Réunion de septembre 2023"),
+    ("Réunion de septembre 2023", "Réunion de septembre"),
+    ("Réunion de septembre 2023", "Réunion de septembre 2024"),
+    ("Réunion de septembre", "Réunion d'octobre"),
+])
+def test_questions_with_other_dates_do_not_hit(cache_path, vector_store, cached, asked):
+    cache = AnswerCache(cache_path, vector_store, threshold=0.5)
+    cache.put(cached, "Le 12.", sources())
+
+    assert cache.get(asked) is None
+
+
+def test_same_dates_in_other_words_hit(cache_path, vector_store):
+    cache = AnswerCache(cache_path, vector_store, threshold=0.5)
+    cache.put("Réunion de septembre 2023", "Le 12.", sources())
+
+    assert cache.get("La réunion de septembre 2023 ?")[0] == "Le 12."
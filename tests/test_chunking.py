@@ -0,0 +1,42 @@
+"""
+Le découpage par caractères réparti sur des processus doit produire exactement les chunks du découpage séquentiel.
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+from langchain.schema import Document
+
+from chunking import split_documents
+
+
+def small_corpus():
+    paragraph = "Le chat dort sur le tapis.\n\nIl rêve de souris et de lait tiède. " * 12
+    return [Document(page_content=f"Document {i}.\n{paragraph[:200 * (i + 1)]}", metadata={"title": f"doc{i}"})
+            for i in range(5)] + [Document(page_content="", metadata={"title": "vide"})]
+
+
+def as_tuples(chunks):
+    return [(chunk.page_content, chunk.metadata) for chunk in chunks]
+
+
+def test_parallel_split_matches_sequential():
+    documents = small_corpus()
+    sequential = split_documents(documents, chunk_size=120, chunk_overlap=20, semantic_chunking=False, workers=1)
+    parallel = split_documents(documents, chunk_size=120, chunk_overlap=20, semantic_chunking=False, workers=2)
+
+    assert len(sequential) > len(documents)
+    assert as_tuples(parallel) == as_tuples(sequential)
+    texts = {document.metadata["title"]: document.page_content for document in documents}
+    for chunk in parallel:
+        start, end = chunk.metadata["start_index"], chunk.metadata["end_index"]
+        assert texts[chunk.metadata["title"]][start:end] == chunk.page_content
+
+
+def test_shared_executor_matches_sequential():
+    documents = small_corpus()
+    sequential = split_documents(documents, chunk_size=120, chunk_overlap=20, semantic_chunking=False)
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        shared = [split_documents(documents[i:i + 2], chunk_size=120, chunk_overlap=20, semantic_chunking=False,
+                                  executor=executor)
+                  for i in range(0, len(documents), 2)]
+
+    assert as_tuples(chunk for batch in shared for chunk in batch) == as_tuples(sequential)
@@ -0,0 +1,88 @@
+"""
+Une génération abandonnée en cours de flux (fermeture du générateur, tâche annulée) doit rester
+dans la trace et dans les métriques du client.
+"""
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from ollama_query import OllamaClient, AsyncOllamaClient
+from tracing import listening
+
+MESSAGES = [{"role": "user", "content": "Bonjour ?"}]
+
+
+class SlowChatHandler(BaseHTTPRequestHandler):
+    """
+    Réponse NDJSON de l'API de chat, un token toutes les 50 ms.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for token in ["Bon", "jour", " !"] * 20:
+                line = (json.dumps({"message": {"role": "assistant", "content": token}, "done": False}) + "\n").encode()
+                self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+                self.wfile.flush()
+                time.sleep(0.05)
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+@pytest.fixture
+def base_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SlowChatHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_closed_stream_is_recorded(base_url):
+    client = OllamaClient(base_url)
+    spans = []
+    with listening(spans.append):
+        stream = client.chat_stream(MESSAGES)
+        assert next(stream) == "Bon"
+        stream.close()
+
+    assert [(span.name, span.attributes.get("cancelled")) for span in spans] == [("generate", True)]
+    assert len(client.metrics) == 1
+    client.close()
+
+
+def test_cancelled_async_stream_is_recorded(base_url):
+    spans = []
+
+    async def main():
+        async with AsyncOllamaClient(base_url) as client:
+            async def consume():
+                async for _ in client.chat_stream(MESSAGES):
+                    pass
+
+            task = asyncio.ensure_future(consume())
+            await asyncio.sleep(0.2)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            return len(client.metrics)
+
+    with listening(spans.append):
+        recorded = asyncio.run(main())
+
+    assert [(span.name, span.attributes.get("cancelled")) for span in spans] == [("generate", True)]
+    assert recorded == 1
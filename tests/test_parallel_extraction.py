@@ -0,0 +1,28 @@
+"""
+Un fichier dont l'extraction bloque ne doit pas bloquer le lot, y compris avec un seul worker.
+"""
+import time
+
+from preprocessing.parallel import iter_extract_files
+
+
+def extract_or_hang(file_path):
+    if "bloque" in file_path:
+        time.sleep(60)
+    return {"text": file_path}
+
+
+def test_hung_file_times_out_with_one_worker():
+    start = time.perf_counter()
+    results = list(iter_extract_files(["a.txt", "bloque.pdf", "b.txt"], extract_or_hang, workers=1, timeout=1))
+
+    assert time.perf_counter() - start < 30
+    assert [result.content for result in results] == [{"text": "a.txt"}, None, {"text": "b.txt"}]
+    assert "Délai dépassé" in results[1].error
+
+
+def test_without_timeout_extraction_stays_in_process():
+    results = list(iter_extract_files(["a.txt", "b.txt"], lambda file_path: {"text": file_path},
+                                      workers=1, timeout=None))
+
+    assert [result.content for result in results] == [{"text": "a.txt"}, {"text": "b.txt"}]
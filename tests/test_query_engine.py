@@ -0,0 +1,98 @@
+"""
+Une question ne doit coûter qu'une génération Ollama, que la réponse soit produite en flux ou non,
+et la chaîne de questions-réponses est construite une fois pour la session.
+"""
+import builtins
+from types import SimpleNamespace
+
+import pytest
+from langchain.schema import Document
+
+import ollama_query
+import rag_cli
+import rag_pipeline
+from rag_pipeline import QueryEngine
+
+
+class FakeClient:
+    """
+    Client Ollama qui enregistre chaque génération au lieu d'interroger le serveur.
+    """
+
+    def __init__(self):
+        self.generations = []
+
+    def chat_stream(self, messages, model=None, options=None, stats=None, keep_alive=None):
+        self.generations.append(messages)
+        if stats is not None:
+            stats.update(time_to_first_token=0.0, total_time=0.0, tokens=2)
+        yield "Réponse"
+        yield " de test"
+
+    def chat(self, messages, model=None, options=None, stats=None):
+        return "".join(self.chat_stream(messages, model=model, options=options, stats=stats)).strip()
+
+
+class FakeRetriever:
+    def __init__(self, k):
+        self.k = k
+
+    def invoke(self, query, filters=None):
+        return [Document(page_content=f"Passage {i} sur {query}", metadata={"source": f"doc{i}.txt"})
+                for i in range(self.k)]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = FakeClient()
+    monkeypatch.setattr(ollama_query, "get_client", lambda base_url=None: client)
+    return client
+
+
+@pytest.fixture
+def built_retrievers(monkeypatch):
+    built = []
+
+    def build_retriever(vector_store, search_type="hybrid", k=5, filters=None, rerank=True):
+        built.append(k)
+        return FakeRetriever(k)
+
+    monkeypatch.setattr(rag_pipeline, "build_retriever", build_retriever)
+    return built
+
+
+@pytest.fixture
+def engine(built_retrievers):
+    vector_store = SimpleNamespace(index=SimpleNamespace(ntotal=100))
+    return QueryEngine(vector_store, search_type="similarity", k=3, rerank=False)
+
+
+@pytest.mark.parametrize("stream", [True, False])
+def test_generate_answer_calls_llm_once(engine, client, stream):
+    answer = engine.generate_answer("Quel est le budget ?", "Contexte", stream=stream)
+    if stream:
+        answer = "".join(answer)
+
+    assert answer.strip() == "Réponse de test"
+    assert len(client.generations) == 1
+    assert client.generations[0][-1]["role"] == "user"
+
+
+def test_engine_reuses_its_retriever(engine, built_retrievers):
+    for question in ("Quel est le budget ?", "Qui préside l'association ?", "Quel est le budget ?"):
+        assert len(engine.retrieve(question)) == 3
+
+    assert built_retrievers == [3]
+
+
+def test_interactive_session_generates_once_per_question(engine, client, built_retrievers, monkeypatch, capsys):
+    questions = iter(["Quel est le budget ?", "Qui préside l'association ?", "exit"])
+    monkeypatch.setattr(builtins, "input", lambda prompt="": next(questions))
+    monkeypatch.setattr(rag_cli, "build_context_from_docs",
+                        lambda docs: "\n\n".join(doc.page_content for doc in docs))
+
+    rag_cli.run_interactive_query(engine)
+
+    assert len(client.generations) == 2
+    assert built_retrievers == [3]
+    assert capsys.readouterr().out.count("Réponse de test") == 2
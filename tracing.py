@@ -0,0 +1,239 @@
+"""
+Lightweight tracing of the RAG pipeline stages.
+
+A span times one stage (extract, ocr, chunk, embed, index, load, retrieve, prompt_build, generate)
+and carries counters such as pages, images, chunks, tokens or bytes. Spans nest: a span opened
+inside another one becomes its child, including across asyncio tasks.
+
+Finished spans are:
+- aggregated in memory per stage name (see `summary`), for the CLI and the app;
+- passed to the listeners of the current thread or task (see `listening`), to drive progress
+  displays without seeing the spans of other Streamlit sessions;
+- written to a trace file when one is configured, with `configure` or the RAGNAR_TRACE_FILE
+  environment variable. Each line is an OTLP/JSON `ExportTraceServiceRequest` holding one span,
+  the format of the OpenTelemetry collector's file exporter, so traces can be replayed into any
+  OpenTelemetry backend.
+
+    with span("embed", chunks=len(texts)) as s:
+        ...
+        s.add("bytes", n)
+"""
+import os
+import json
+import time
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "ragnar"
+TRACE_FILE_ENV = "RAGNAR_TRACE_FILE"
+
+_current_span = contextvars.ContextVar("ragnar_current_span", default=None)
+_lock = threading.Lock()
+_listeners = contextvars.ContextVar("ragnar_span_listeners", default=())
+_stage_stats = {}
+_trace_file = os.environ.get(TRACE_FILE_ENV)
+
+
+class Span:
+    """
+    A timed pipeline stage. Use `span(...)` (or `start_span(...)` and `end()`) rather than
+    instantiating it directly.
+    """
+
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.duration = None
+        self.error = None
+        self._start = time.perf_counter()
+
+    def set(self, **attributes):
+        """
+        Sets attributes of the span.
+        """
+        self.attributes.update(attributes)
+        return self
+
+    def add(self, counter, amount=1):
+        """
+        Increments a counter attribute of the span.
+        """
+        self.attributes[counter] = self.attributes.get(counter, 0) + amount
+        return self
+
+    def end(self, duration=None, error=None):
+        """
+        Ends the span and hands it to the aggregator, the listeners and the trace file.
+        """
+        if self.end_ns is not None:
+            return
+        self.duration = duration if duration is not None else time.perf_counter() - self._start
+        self.end_ns = self.start_ns + int(self.duration * 1e9)
+        self.error = error or self.error
+        _finish(self)
+
+    def to_otlp(self):
+        """
+        Returns the span in OTLP/JSON form.
+        """
+        otlp = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            otlp["parentSpanId"] = self.parent_id
+        return otlp
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Times the enclosed block as a stage. Spans opened inside it become its children.
+
+    Parameters:
+    - name (str): Stage name.
+    - **attributes: Initial attributes and counters.
+
+    Yields:
+    - Span: The span, to add counters while the stage runs.
+    """
+    current = Span(name, _current_span.get(), attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end()
+
+
+def start_span(name, **attributes):
+    """
+    Starts a span without making it the parent of the spans opened after it, for stages that
+    outlive the current block (a streamed generation, for instance). Call `end()` on it.
+    """
+    return Span(name, _current_span.get(), attributes)
+
+
+def record_span(name, duration, **attributes):
+    """
+    Records a stage that was timed elsewhere (in an extraction worker process, for instance).
+
+    Parameters:
+    - name (str): Stage name.
+    - duration (float): Duration of the stage, in seconds.
+    - **attributes: Attributes and counters.
+    """
+    recorded = Span(name, _current_span.get(), attributes)
+    recorded.start_ns -= int(duration * 1e9)
+    recorded.end(duration=duration)
+    return recorded
+
+
+def _finish(finished):
+    with _lock:
+        stats = _stage_stats.setdefault(finished.name, {"count": 0, "total_s": 0.0, "errors": 0, "counters": {}})
+        stats["count"] += 1
+        stats["total_s"] += finished.duration
+        stats["errors"] += bool(finished.error)
+        for key, value in finished.attributes.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                stats["counters"][key] = stats["counters"].get(key, 0) + value
+        trace_file = _trace_file
+
+    for listener in _listeners.get():
+        try:
+            listener(finished)
+        except Exception as e:
+            logger.warning(f"Tracing listener failed: {e}")
+
+    if trace_file:
+        request = {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}},
+                                        {"key": "process.pid", "value": {"intValue": str(os.getpid())}}]},
+            "scopeSpans": [{"scope": {"name": __name__}, "spans": [finished.to_otlp()]}],
+        }]}
+        try:
+            # One line per span, appended in a single write: worker processes can share the file
+            with open(trace_file, "a", encoding="utf-8") as f:
+                f.write(json.dumps(request, ensure_ascii=False) + "\n")
+        except OSError as e:
+            logger.warning(f"Could not write trace to {trace_file}: {e}")
+
+
+def configure(trace_file=None):
+    """
+    Sets (or, with None, disables) the trace file. Defaults to RAGNAR_TRACE_FILE at import time.
+    """
+    global _trace_file
+    with _lock:
+        _trace_file = trace_file
+
+
+@contextmanager
+def listening(listener):
+    """
+    Calls `listener(span)` for every span finished in the current thread or task during a block.
+    """
+    token = _listeners.set(_listeners.get() + (listener,))
+    try:
+        yield
+    finally:
+        _listeners.reset(token)
+
+
+def summary(reset=False):
+    """
+    Returns the aggregated statistics of the finished spans, per stage name.
+
+    Parameters:
+    - reset (bool): Clear the statistics after reading them.
+
+    Returns:
+    - dict: {stage: {"count", "total_s", "mean_s", "errors", "counters": {counter: sum}}}
+    """
+    with _lock:
+        result = {name: {**stats, "counters": dict(stats["counters"]), "mean_s": stats["total_s"] / stats["count"]}
+                  for name, stats in _stage_stats.items()}
+        if reset:
+            _stage_stats.clear()
+    return result
+
+
+def format_summary(stages=None):
+    """
+    Formats the aggregated statistics as one line per stage, for console output.
+    """
+    lines = []
+    for name, stats in (stages if stages is not None else summary()).items():
+        counters = ", ".join(f"{key}={value:g}" for key, value in stats["counters"].items())
+        lines.append(f"{name:<13} {stats['count']:>6} x  {stats['total_s']:9.2f}s  "
+                     f"(mean {1000 * stats['mean_s']:8.1f}ms){'  ' + counters if counters else ''}")
+    return "\n".join(lines)
@@ -1,17 +1,28 @@
 import os
+import time
 import logging
 import json
+import uuid
 
 
 import faiss
 
 from langchain_community.vectorstores import FAISS
 from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain.schema import Document
 
-from langchain_huggingface import HuggingFaceEmbeddings
 
 import numpy as np
 
+from embedding_models import get_embedding_model
+from tracing import span
+from faiss_indexes import (create_index, describe_index, set_search_params, supports_stable_ids,
+                           reconstruct_vectors, search_with_selector)
+from sqlite_docstore import (SQLiteConnection, SQLiteDocstore, SQLiteIndexMapping, write_docstore,
+                             DOCSTORE_FILENAME)
+from sparse_index import BM25Index, SPARSE_INDEX_FILENAME, DEFAULT_RRF_K, reciprocal_rank_fusion
+from metadata_index import MetadataIndex, METADATA_INDEX_FILENAME
+
 # Configuration du logger
 logging.basicConfig(
     level=logging.INFO,
@@ -19,6 +30,14 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+DEFAULT_EMBEDDING_BATCH_SIZE = 64
+DEFAULT_HYBRID_FETCH_K = 20  # candidates taken from each of the dense and sparse rankings
+
+STORE_FORMAT = 2
+INDEX_BUILD_BATCH_SIZE = 1000  # chunks read from the docstore at a time when building the BM25/metadata indexes
+INDEX_FILENAME = "index.faiss"
+LEGACY_DOCSTORE_FILENAME = "index.pkl"
+
 
 def vector_store_exists(directory_path="faiss_index"):
     """
@@ -34,39 +53,284 @@ def vector_store_exists(directory_path="faiss_index"):
 
 
 
+def saved_index_config(directory_path):
+    """
+    Returns the index description recorded in the metadata.json of a saved store
+    (see faiss_indexes.describe_index), or None if there is none.
+    """
+    try:
+        with open(os.path.join(directory_path, "metadata.json"), "r") as metadata_file:
+            return json.load(metadata_file).get("index")
+    except (OSError, ValueError):
+        return None
+
+
+def mark_index_updated(vector_store):
+    """
+    Gives a vector store a new index version. Called whenever its index is built or modified,
+    so that caches keyed on the version (see query_cache) stop serving results of the old index.
+
+    Returns:
+    - str: The new version.
+    """
+    vector_store.index_version = uuid.uuid4().hex
+    return vector_store.index_version
+
+
+def index_version(vector_store):
+    """
+    Returns the index version of a vector store, assigning one if it has none yet.
+    """
+    return getattr(vector_store, "index_version", None) or mark_index_updated(vector_store)
+
+
+def _docstore_batches(docstore, batch_size):
+    if isinstance(docstore, SQLiteDocstore):
+        yield from docstore.iter_batches(batch_size)
+        return
+    items = list(docstore._dict.items())
+    for start in range(0, len(items), batch_size):
+        yield items[start:start + batch_size]
+
+
+def build_store_indexes(vector_store, sparse=True, metadata=True):
+    """
+    Builds the BM25 index and/or the metadata index of a vector store from its docstore, in a
+    single pass that reads the chunks in batches (the text of the store is never all in memory).
+
+    Parameters:
+    - vector_store (FAISS): The vector store; the built indexes are set on it.
+    - sparse (bool): Build the BM25 index (vector_store.sparse_index).
+    - metadata (bool): Build the metadata index (vector_store.metadata_index).
+    """
+    sparse_index = BM25Index() if sparse else None
+    metadata_index = MetadataIndex() if metadata else None
+    label_of = ({doc_id: label for label, doc_id in vector_store.index_to_docstore_id.items()}
+                if metadata else None)
+    with span("build_store_indexes", sparse=sparse, metadata=metadata) as build_span:
+        chunks = 0
+        for batch in _docstore_batches(vector_store.docstore, INDEX_BUILD_BATCH_SIZE):
+            chunks += len(batch)
+            if sparse_index is not None:
+                sparse_index.add([doc_id for doc_id, _ in batch], [doc.page_content for _, doc in batch])
+            if metadata_index is not None:
+                batch = [(doc_id, doc) for doc_id, doc in batch if doc_id in label_of]
+                metadata_index.add([doc_id for doc_id, _ in batch], [label_of[doc_id] for doc_id, _ in batch],
+                                   [doc.metadata for _, doc in batch])
+        build_span.set(chunks=chunks)
+    if sparse_index is not None:
+        vector_store.sparse_index = sparse_index
+    if metadata_index is not None:
+        vector_store.metadata_index = metadata_index
+    logger.info(f"Built {'BM25 ' if sparse else ''}{'metadata ' if metadata else ''}index for {chunks} chunks")
+
+
+def get_sparse_index(vector_store):
+    """
+    Returns the BM25 index of a vector store, building it from the docstore if it has none
+    (store built in memory by FAISS methods other than the ones below; stores loaded from
+    disk get theirs in load_vector_store).
+    """
+    if getattr(vector_store, "sparse_index", None) is None:
+        build_store_indexes(vector_store, metadata=False)
+    return vector_store.sparse_index
+
+
+def get_metadata_index(vector_store):
+    """
+    Returns the metadata index (date, source, title) of a vector store, building it from the
+    docstore if it has none.
+    """
+    if getattr(vector_store, "metadata_index", None) is None:
+        build_store_indexes(vector_store, sparse=False)
+    return vector_store.metadata_index
+
+
+def _dense_search(vector_store, embedding, k, labels=None):
+    """
+    Returns the docstore ids of the k nearest chunks, among the given FAISS labels if any.
+    """
+    query = np.asarray([embedding], dtype=np.float32)
+    if labels is None:
+        _, found = vector_store.index.search(query, k)
+    elif not len(labels):
+        return []
+    else:
+        _, found = search_with_selector(vector_store.index, query, k, labels)
+    mapping = vector_store.index_to_docstore_id
+    return [mapping[int(label)] for label in found[0] if label != -1]
+
+
+def _documents(vector_store, doc_ids):
+    documents = []
+    for doc_id in doc_ids:
+        document = vector_store.docstore.search(doc_id)
+        if isinstance(document, Document):
+            if document.id is None:
+                # The in-memory docstore keeps the chunks as they were added, without their id
+                document = Document(id=doc_id, page_content=document.page_content, metadata=document.metadata)
+            documents.append(document)
+    return documents
+
+
+def filtered_similarity_search(vector_store, embedding, k=5, filters=None):
+    """
+    Similarity search restricted to the chunks matching metadata filters. The filters are
+    resolved on the metadata index and applied inside the FAISS search, so the rest of the
+    archive is neither scanned nor ranked.
+
+    Parameters:
+    - vector_store (FAISS): The vector store.
+    - embedding (List[float]): Query embedding.
+    - k (int): Number of chunks returned.
+    - filters (dict, optional): Date, source and title filters, see metadata_index.
+
+    Returns:
+    - List[Document]: The chunks, best first.
+    """
+    labels = None
+    if filters:
+        with span("metadata_filter") as filter_span:
+            labels, _ = get_metadata_index(vector_store).select(filters)
+            filter_span.set(allowed=len(labels))
+    return _documents(vector_store, _dense_search(vector_store, embedding, k, labels))
+
+
+def hybrid_search(vector_store, query, k=5, fetch_k=DEFAULT_HYBRID_FETCH_K, embedding=None, rrf_k=DEFAULT_RRF_K,
+                  filters=None):
+    """
+    Retrieves chunks with both the FAISS index and the BM25 index, and fuses the two rankings
+    with reciprocal rank fusion. Exact terms (names, dates, amounts) found by BM25 complement
+    the semantic matches of the embeddings.
+
+    Parameters:
+    - vector_store (FAISS): The vector store.
+    - query (str): The question.
+    - k (int): Number of chunks returned.
+    - fetch_k (int): Number of candidates taken from each ranking before fusion.
+    - embedding (List[float], optional): Precomputed query embedding.
+    - rrf_k (int): Reciprocal rank fusion constant.
+    - filters (dict, optional): Date, source and title filters applied to both rankings,
+      see metadata_index.
+
+    Returns:
+    - List[Document]: The chunks, best first.
+    """
+    fetch_k = max(fetch_k, k)
+    if embedding is None:
+        embedding = vector_store.embedding_function.embed_query(query)
+    labels = allowed_ids = None
+    if filters:
+        with span("metadata_filter") as filter_span:
+            labels, allowed_ids = get_metadata_index(vector_store).select(filters)
+            filter_span.set(allowed=len(labels))
+        allowed_ids = allowed_ids.tolist()
+    dense_ids = _dense_search(vector_store, embedding, fetch_k, labels)
+
+    with span("sparse_search", fetch_k=fetch_k) as sparse_span:
+        sparse_ids = [doc_id for doc_id, _ in
+                      get_sparse_index(vector_store).search(query, fetch_k, allowed_ids=allowed_ids)]
+        sparse_span.set(results=len(sparse_ids))
+
+    fused = reciprocal_rank_fusion([dense_ids, sparse_ids], k=rrf_k)[:k]
+    return _documents(vector_store, [doc_id for doc_id, _ in fused])
+
+
 def save_vector_store(vector_store, model_name, directory_path="faiss_index"):
     """
     Saves the FAISS vector store and associated document store to a directory,
     along with metadata like the model name.
 
+    The index is written with faiss.write_index (index.faiss), the chunks with their
+    label mapping to a SQLite file (docstore.sqlite), the BM25 index to bm25.npz and the
+    metadata index to metadata_index.npz: nothing is pickled. A store that was
+    loaded from the same directory is saved by committing its pending SQLite writes.
+
     Parameters:
     - vector_store (FAISS): The FAISS vector store to save.
     - model_name (str): The name of the embedding model used.
     - directory_path (str): Path to the directory where the store will be saved.
     """
-    os.makedirs(directory_path, exist_ok=True)
-    vector_store.save_local(directory_path)
-
-    # Save metadata
-    metadata_path = os.path.join(directory_path, "metadata.json")
-    metadata = {"model_name": model_name}
-    with open(metadata_path, "w") as metadata_file:
-        json.dump(metadata, metadata_file)
+    with span("save", path=directory_path):
+        os.makedirs(directory_path, exist_ok=True)
+
+        # Files are written under a temporary name, then swapped in, so readers never see a partial file
+        index_path = os.path.join(directory_path, INDEX_FILENAME)
+        faiss.write_index(vector_store.index, index_path + ".tmp")
+        os.replace(index_path + ".tmp", index_path)
+
+        docstore_path = os.path.join(directory_path, DOCSTORE_FILENAME)
+        docstore = vector_store.docstore
+        if isinstance(docstore, SQLiteDocstore) and os.path.exists(docstore_path) \
+                and os.path.samefile(docstore.connection.path, docstore_path):
+            mapping = vector_store.index_to_docstore_id
+            if not isinstance(mapping, SQLiteIndexMapping):
+                # FAISS.delete and index rebuilds replace the mapping with a plain dict
+                docstore.connection.execute("DELETE FROM labels")
+                docstore.connection.executemany("INSERT INTO labels (label, id) VALUES (?, ?)",
+                                                [(int(label), doc_id) for label, doc_id in mapping.items()])
+                vector_store.index_to_docstore_id = SQLiteIndexMapping(docstore.connection)
+            docstore.connection.commit()
+        else:
+            documents = docstore.items() if isinstance(docstore, SQLiteDocstore) else docstore._dict.items()
+            if os.path.exists(docstore_path + ".tmp"):
+                os.remove(docstore_path + ".tmp")
+            write_docstore(docstore_path + ".tmp", documents, vector_store.index_to_docstore_id)
+            os.replace(docstore_path + ".tmp", docstore_path)
+
+        sparse_path = os.path.join(directory_path, SPARSE_INDEX_FILENAME)
+        get_sparse_index(vector_store).save(sparse_path + ".tmp")
+        os.replace(sparse_path + ".tmp", sparse_path)
+        metadata_index_path = os.path.join(directory_path, METADATA_INDEX_FILENAME)
+        get_metadata_index(vector_store).save(metadata_index_path + ".tmp")
+        os.replace(metadata_index_path + ".tmp", metadata_index_path)
+
+        # Pickled docstore from the previous format, superseded by docstore.sqlite
+        legacy_path = os.path.join(directory_path, LEGACY_DOCSTORE_FILENAME)
+        if os.path.exists(legacy_path):
+            os.remove(legacy_path)
+
+        # Save metadata, including the index type and its parameters
+        metadata_path = os.path.join(directory_path, "metadata.json")
+        metadata = {"model_name": model_name, "format": STORE_FORMAT, "index": describe_index(vector_store.index),
+                    "index_version": index_version(vector_store)}
+        with open(metadata_path, "w") as metadata_file:
+            json.dump(metadata, metadata_file)
     
-    logger.info(f"Vector store and metadata saved to {directory_path}")
+        logger.info(f"Vector store and metadata saved to {directory_path}")
 
 
-def load_vector_store(directory_path="faiss_index"):
+def load_vector_store(directory_path="faiss_index", nprobe=None, ef_search=None, mmap=True, progress=None):
     """
     Loads a FAISS vector store and associated document store from a directory,
-    ensuring the correct model is used based on saved metadata.
+    ensuring the correct model and index search parameters are used based on saved metadata.
+
+    With `mmap`, the index is memory-mapped where FAISS supports it and the docstore is opened
+    read-only: opening is near-instant, chunks are read from SQLite only when retrieved, and
+    processes opening the same store share pages through the OS page cache. Pass mmap=False
+    to get a store that can be updated in place.
+
+    Stores saved in the previous pickle format (index.pkl) are still loaded, and converted
+    on their next save.
 
     Parameters:
     - directory_path (str): Path to the directory containing the saved vector store.
+    - nprobe (int, optional): Overrides the saved number of IVF cells scanned per query.
+    - ef_search (int, optional): Overrides the saved HNSW query-time beam width.
+    - mmap (bool): Open the store read-only and memory-mapped.
+    - progress (Callable[[float, str], None], optional): Called with the completed fraction
+      and the name of the next stage as loading proceeds.
 
     Returns:
     - FAISS: The loaded vector store.
     """
+    with span("load", path=directory_path, mmap=mmap) as load_span:
+        vector_store = _load_vector_store(directory_path, nprobe, ef_search, mmap, progress or (lambda *_: None))
+        load_span.set(chunks=vector_store.index.ntotal, index_type=describe_index(vector_store.index)["type"])
+    return vector_store
+
+
+def _load_vector_store(directory_path, nprobe, ef_search, mmap, progress):
     if not os.path.exists(directory_path):
         raise FileNotFoundError(f"No vector store found at {directory_path}")
 
@@ -83,16 +347,165 @@ def load_vector_store(directory_path="faiss_index"):
         raise ValueError("Model name not found in metadata.")
 
     print(f"Using model '{model_name}' to load vector store...")
-    embedding_function = HuggingFaceEmbeddings(model_name=model_name)
+    progress(0.1, "model")
+    with span("load_model", model=model_name):
+        embedding_function = get_embedding_model(model_name)
 
     # Load the vector store
-    vector_store = FAISS.load_local(directory_path, embeddings=embedding_function, allow_dangerous_deserialization=True)
-    logger.info(f"Vector store loaded from {directory_path} with model '{model_name}'")
+    progress(0.6, "index")
+    docstore_path = os.path.join(directory_path, DOCSTORE_FILENAME)
+    if os.path.exists(docstore_path):
+        io_flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY | getattr(faiss, "IO_FLAG_MMAP_IFC", 0) if mmap else 0
+        index_path = os.path.join(directory_path, INDEX_FILENAME)
+        with span("load_index", bytes=os.path.getsize(index_path)):
+            index = faiss.read_index(index_path, io_flags)
+        progress(0.9, "docstore")
+        connection = SQLiteConnection(docstore_path, read_only=mmap)
+        vector_store = FAISS(
+            index=index,
+            docstore=SQLiteDocstore(connection),
+            index_to_docstore_id=SQLiteIndexMapping(connection),
+            embedding_function=embedding_function,
+        )
+    else:
+        logger.info(f"Loading vector store from the legacy pickle format in {directory_path}")
+        with span("load_index", legacy=True):
+            vector_store = FAISS.load_local(directory_path, embeddings=embedding_function,
+                                            allow_dangerous_deserialization=True)
+
+    vector_store.index_version = metadata.get("index_version") or uuid.uuid4().hex
+
+    sparse_path = os.path.join(directory_path, SPARSE_INDEX_FILENAME)
+    vector_store.sparse_index = None
+    if os.path.exists(sparse_path):
+        with span("load_sparse_index", bytes=os.path.getsize(sparse_path)):
+            vector_store.sparse_index = BM25Index.load(sparse_path)
+    metadata_index_path = os.path.join(directory_path, METADATA_INDEX_FILENAME)
+    vector_store.metadata_index = None
+    if os.path.exists(metadata_index_path):
+        vector_store.metadata_index = MetadataIndex.load(metadata_index_path)
+    if vector_store.sparse_index is None or vector_store.metadata_index is None:
+        # Stores saved before hybrid retrieval or metadata filters lack these indexes: they are
+        # built once here and saved next to the store, so no process rebuilds them at its first query
+        progress(0.95, "indexes")
+        _migrate_store_indexes(vector_store, sparse_path, metadata_index_path)
+
+    index_config = metadata.get("index", {"type": "flat"})
+    set_search_params(
+        vector_store.index,
+        nprobe=nprobe if nprobe is not None else index_config.get("nprobe"),
+        ef_search=ef_search if ef_search is not None else index_config.get("ef_search"),
+    )
+    logger.info(f"Vector store loaded from {directory_path} with model '{model_name}' "
+                f"and index {describe_index(vector_store.index)}")
+    progress(1.0, "done")
     return vector_store
 
 
 
-def create_vector_store(chunks, model_name="all-MiniLM-L6-v2", save_path=".vector_store"):
+def _migrate_store_indexes(vector_store, sparse_path, metadata_index_path):
+    missing = [(path, name) for path, name in ((sparse_path, "sparse_index"), (metadata_index_path, "metadata_index"))
+               if getattr(vector_store, name) is None]
+    build_store_indexes(vector_store, sparse=vector_store.sparse_index is None,
+                        metadata=vector_store.metadata_index is None)
+    for path, name in missing:
+        try:
+            getattr(vector_store, name).save(path + ".tmp")
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            # Read-only directory: the index stays in memory for this process
+            logger.warning(f"Could not save {os.path.basename(path)} next to the store: {e}")
+
+
+def embedding_dimension(embedding_function):
+    """
+    Returns the dimension of the vectors produced by an embedding function.
+    """
+    client = getattr(embedding_function, "client", None)
+    if hasattr(client, "get_sentence_embedding_dimension"):
+        return client.get_sentence_embedding_dimension()
+    return len(embedding_function.embed_query("dimension"))
+
+
+def embed_texts(embedding_function, texts, batch_size=DEFAULT_EMBEDDING_BATCH_SIZE):
+    """
+    Embeds texts in batches directly into a preallocated float32, C-contiguous array.
+
+    With a sentence-transformers backed HuggingFaceEmbeddings, each batch is encoded to a
+    float32 NumPy array and copied into its slice of the output buffer, so no nested Python
+    lists or float64 intermediates are created. The result can be passed to `index.add` as is.
+
+    Parameters:
+    - embedding_function (HuggingFaceEmbeddings): The embedding model.
+    - texts (List[str]): Texts to embed.
+    - batch_size (int): Number of texts encoded per call.
+
+    Returns:
+    - np.ndarray: Array of shape (len(texts), dimension), dtype float32.
+    """
+    with span("embed", chunks=len(texts), bytes=sum(len(text) for text in texts), batch_size=batch_size):
+        return _embed_texts(embedding_function, texts, batch_size)
+
+
+def _embed_texts(embedding_function, texts, batch_size):
+    start_time = time.perf_counter()
+    embeddings = np.empty((len(texts), embedding_dimension(embedding_function)), dtype=np.float32)
+
+    client = getattr(embedding_function, "client", None)
+    encode_kwargs = dict(getattr(embedding_function, "encode_kwargs", None) or {})
+    encode_kwargs.update(batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False)
+
+    for start in range(0, len(texts), batch_size):
+        # Same preprocessing as HuggingFaceEmbeddings.embed_documents, so query vectors stay comparable
+        batch = [text.replace("\n", " ") for text in texts[start:start + batch_size]]
+        if hasattr(client, "encode"):
+            embeddings[start:start + len(batch)] = client.encode(batch, **encode_kwargs)
+        else:
+            embeddings[start:start + len(batch)] = embedding_function.embed_documents(batch)
+
+    elapsed = time.perf_counter() - start_time
+    if texts:
+        logger.info(f"Embedded {len(texts)} chunks in {elapsed:.2f}s "
+                    f"({len(texts) / max(elapsed, 1e-9):.1f} chunks/s)")
+    return embeddings
+
+
+def _precomputed(embeddings, count, valid, dimension):
+    """
+    Checks precomputed chunk vectors and keeps the rows of the valid chunks, as float32.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if embeddings.shape != (count, dimension):
+        raise ValueError(f"Expected embeddings of shape {(count, dimension)}, got {embeddings.shape}: "
+                         "they must be computed with the store's embedding model, one row per chunk.")
+    return np.ascontiguousarray(embeddings[valid])
+
+
+def _add_embeddings(vector_store, embeddings, chunks, ids):
+    """
+    Appends precomputed float32 embeddings and their chunks to a vector store.
+    """
+    index = vector_store.index
+    with span("index", vectors=len(ids), index_type=describe_index(index)["type"]):
+        if supports_stable_ids(index):
+            # IVF labels are not renumbered on removal: continue after the largest label in use
+            start = max(vector_store.index_to_docstore_id, default=-1) + 1
+            index.add_with_ids(embeddings, np.arange(start, start + len(ids), dtype=np.int64))
+        else:
+            start = index.ntotal
+            index.add(embeddings)
+        vector_store.docstore.add(dict(zip(ids, chunks)))
+        vector_store.index_to_docstore_id.update({start + i: chunk_id for i, chunk_id in enumerate(ids)})
+    if getattr(vector_store, "sparse_index", None) is not None:
+        vector_store.sparse_index.add(ids, [chunk.page_content for chunk in chunks])
+    if getattr(vector_store, "metadata_index", None) is not None:
+        vector_store.metadata_index.add(ids, range(start, start + len(ids)), [chunk.metadata for chunk in chunks])
+    mark_index_updated(vector_store)
+
+
+def create_vector_store(chunks, model_name="all-MiniLM-L6-v2", save_path=".vector_store", ids=None,
+                        batch_size=DEFAULT_EMBEDDING_BATCH_SIZE, index_type="flat", index_params=None,
+                        embeddings=None):
     """
     Creates or loads a FAISS vector store using HuggingFaceEmbeddings.
 
@@ -100,24 +513,44 @@ def create_vector_store(chunks, model_name="all-MiniLM-L6-v2", save_path=".vecto
     - chunks (List[Document]): List of document chunks to embed.
     - model_name (str): Sentence embedding model to use.
     - save_path (str, optional): Path to save the vector store (if created).
+    - ids (List[str], optional): Docstore ids, one per chunk. Chunks with empty
+      content are dropped together with their id. Defaults to "0", "1", ...
+    - batch_size (int): Number of chunks embedded per batch.
+    - index_type (str): FAISS index type, one of faiss_indexes.INDEX_TYPES.
+    - index_params (dict, optional): Index parameters (nlist, nprobe, pq_m, pq_nbits, hnsw_m,
+      ef_construction, ef_search), see faiss_indexes.DEFAULT_INDEX_PARAMS.
+    - embeddings (np.ndarray, optional): Precomputed vectors of the chunks, one row per chunk,
+      computed with `model_name` (see chunking.semantic_split_documents). Chunks are embedded otherwise.
 
     Returns:
     - FAISS: A vector store ready for use.
     """
-    embedding_function = HuggingFaceEmbeddings(model_name=model_name)
+    embedding_function = get_embedding_model(model_name)
 
-    valid_chunks = [chunk for chunk in chunks if chunk.page_content.strip()]
-    if not valid_chunks:
+    if ids is None:
+        ids = [str(i) for i in range(len(chunks))]
+    valid = [i for i, chunk in enumerate(chunks) if chunk.page_content.strip()]
+    if not valid:
         raise ValueError("No valid documents found after filtering.")
+    valid_ids = [ids[i] for i in valid]
+    valid_chunks = [chunks[i] for i in valid]
 
     texts = [chunk.page_content for chunk in valid_chunks]
-    embeddings = np.array(embedding_function.embed_documents(texts))
-    dimension = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dimension)
-    index.add(embeddings)
-
-    docstore = InMemoryDocstore({str(i): chunk for i, chunk in enumerate(valid_chunks)})
-    index_to_docstore_id = {i: str(i) for i in range(len(valid_chunks))}
+    if embeddings is not None:
+        embeddings = _precomputed(embeddings, len(chunks), valid, embedding_dimension(embedding_function))
+    else:
+        embeddings = embed_texts(embedding_function, texts, batch_size=batch_size)
+    with span("index", vectors=len(texts), index_type=index_type) as index_span:
+        index = create_index(index_type, embeddings, index_params)
+        index_span.set(index_type=describe_index(index)["type"])
+    with span("sparse_index", chunks=len(texts)):
+        sparse_index = BM25Index()
+        sparse_index.add(valid_ids, texts)
+        metadata_index = MetadataIndex()
+        metadata_index.add(valid_ids, range(len(valid_ids)), [chunk.metadata for chunk in valid_chunks])
+
+    docstore = InMemoryDocstore(dict(zip(valid_ids, valid_chunks)))
+    index_to_docstore_id = dict(enumerate(valid_ids))
 
     vector_store = FAISS(
         index=index,
@@ -125,9 +558,143 @@ def create_vector_store(chunks, model_name="all-MiniLM-L6-v2", save_path=".vecto
         index_to_docstore_id=index_to_docstore_id,
         embedding_function=embedding_function,
     )
+    vector_store.sparse_index = sparse_index
+    vector_store.metadata_index = metadata_index
+    mark_index_updated(vector_store)
 
     # Save the vector store if a save path is provided
     if save_path:
         save_vector_store(vector_store, model_name, save_path)
 
     return vector_store
+
+
+def create_empty_vector_store(model_name="all-MiniLM-L6-v2"):
+    """
+    Creates an empty FAISS vector store, to be filled incrementally with add_chunks_to_vector_store.
+
+    Parameters:
+    - model_name (str): Sentence embedding model to use.
+
+    Returns:
+    - FAISS: An empty vector store whose index matches the model's embedding dimension.
+    """
+    embedding_function = get_embedding_model(model_name)
+    vector_store = FAISS(
+        index=faiss.IndexFlatL2(embedding_dimension(embedding_function)),
+        docstore=InMemoryDocstore({}),
+        index_to_docstore_id={},
+        embedding_function=embedding_function,
+    )
+    vector_store.sparse_index = BM25Index()
+    vector_store.metadata_index = MetadataIndex()
+    mark_index_updated(vector_store)
+    return vector_store
+
+
+def add_chunks_to_vector_store(vector_store, chunks, ids, batch_size=DEFAULT_EMBEDDING_BATCH_SIZE, embeddings=None):
+    """
+    Embeds new chunks and appends them to an existing vector store in place.
+
+    Parameters:
+    - vector_store (FAISS): The vector store to update.
+    - chunks (List[Document]): Chunks to embed and add.
+    - ids (List[str]): Docstore ids, one per chunk.
+    - batch_size (int): Number of chunks embedded per batch.
+    - embeddings (np.ndarray, optional): Precomputed vectors of the chunks, one row per chunk,
+      computed with the store's embedding model.
+
+    Returns:
+    - List[str]: The ids actually added (chunks with empty content are skipped).
+    """
+    valid = [i for i, chunk in enumerate(chunks) if chunk.page_content.strip()]
+    if not valid:
+        return []
+    valid_ids = [ids[i] for i in valid]
+    valid_chunks = [chunks[i] for i in valid]
+    if embeddings is not None:
+        embeddings = _precomputed(embeddings, len(chunks), valid, vector_store.index.d)
+    else:
+        embeddings = embed_texts(vector_store.embedding_function, [chunk.page_content for chunk in valid_chunks],
+                                 batch_size=batch_size)
+    _add_embeddings(vector_store, embeddings, valid_chunks, valid_ids)
+    return valid_ids
+
+
+def remove_chunks_from_vector_store(vector_store, ids):
+    """
+    Removes chunks from the FAISS index and the docstore in place.
+
+    Ids that are not present in the store are ignored.
+
+    Parameters:
+    - vector_store (FAISS): The vector store to update.
+    - ids (Iterable[str]): Docstore ids of the chunks to remove.
+
+    Returns:
+    - int: Number of chunks removed.
+    """
+    known_ids = set(vector_store.index_to_docstore_id.values())
+    ids_to_remove = [chunk_id for chunk_id in ids if chunk_id in known_ids]
+    if not ids_to_remove:
+        return 0
+
+    index = vector_store.index
+    if isinstance(index, faiss.IndexFlat):
+        # Flat indexes renumber their vectors, which FAISS.delete accounts for
+        vector_store.delete(ids_to_remove)
+    elif supports_stable_ids(index):
+        removed = set(ids_to_remove)
+        labels = [label for label, chunk_id in vector_store.index_to_docstore_id.items() if chunk_id in removed]
+        index.remove_ids(np.array(labels, dtype=np.int64))
+        vector_store.docstore.delete(ids_to_remove)
+        for label in labels:
+            del vector_store.index_to_docstore_id[label]
+    else:
+        # HNSW graphs cannot drop nodes: rebuild the index from the remaining vectors
+        removed = set(ids_to_remove)
+        remaining = sorted((label, chunk_id) for label, chunk_id in vector_store.index_to_docstore_id.items()
+                           if chunk_id not in removed)
+        vectors = reconstruct_vectors(index, [label for label, _ in remaining])
+        config = describe_index(index)
+        vector_store.index = create_index(config["type"], vectors, config)
+        vector_store.docstore.delete(ids_to_remove)
+        vector_store.index_to_docstore_id = {i: chunk_id for i, (_, chunk_id) in enumerate(remaining)}
+    if getattr(vector_store, "sparse_index", None) is not None:
+        vector_store.sparse_index.remove(ids_to_remove)
+    if getattr(vector_store, "metadata_index", None) is not None:
+        vector_store.metadata_index.remove(ids_to_remove)
+        if not supports_stable_ids(vector_store.index):
+            # Flat removals and HNSW rebuilds renumber the remaining vectors
+            vector_store.metadata_index.relabel(vector_store.index_to_docstore_id)
+    mark_index_updated(vector_store)
+    return len(ids_to_remove)
+
+
+def convert_vector_store_index(vector_store, index_type, index_params=None):
+    """
+    Rebuilds the FAISS index of a vector store with another index type, in place.
+
+    Vectors are read back from the current index (approximately, if it is product-quantized),
+    so no chunk is re-embedded.
+
+    Parameters:
+    - vector_store (FAISS): The vector store to update.
+    - index_type (str): Target index type, one of faiss_indexes.INDEX_TYPES.
+    - index_params (dict, optional): Index parameters, see faiss_indexes.DEFAULT_INDEX_PARAMS.
+
+    Returns:
+    - dict: Description of the new index.
+    """
+    items = sorted(vector_store.index_to_docstore_id.items())
+    if not items:
+        return describe_index(vector_store.index)
+    vectors = reconstruct_vectors(vector_store.index, [label for label, _ in items])
+    vector_store.index = create_index(index_type, np.ascontiguousarray(vectors, dtype=np.float32), index_params)
+    vector_store.index_to_docstore_id = {i: chunk_id for i, (_, chunk_id) in enumerate(items)}
+    if getattr(vector_store, "metadata_index", None) is not None:
+        vector_store.metadata_index.relabel(vector_store.index_to_docstore_id)
+    mark_index_updated(vector_store)
+    config = describe_index(vector_store.index)
+    logger.info(f"Vector store index converted to {config}")
+    return config